@@ -0,0 +1,176 @@
+"""
+LLM 流水线端到端压测：在本地启动 mock Gemini 服务器，用合成数据分别运行
+标注生成 (src/pipeline.py) 和两个改写流水线，报告吞吐 (records/sec)、
+API 调用延迟 p50/p99、重试次数、服务器端的 429/5xx/格式错误次数以及未缓存的输入 token 数。
+必须在仓库根目录下运行。
+
+用法：
+    python src/bench/load_test.py --records 200 --latency lognormal --latency-mean 0.5 --rate-limit-rate 0.05
+    python src/bench/load_test.py --pipelines annotate --prefill-latency 0.2 --prompt-prefix inline
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SRC_DIR)
+from bench.mock_gemini import start_server, add_config_arguments, config_from_args
+
+REWRITERS = {
+    "abg-coqa": "convert/ambiguity/abg-coqa",
+    "seal-tools": "convert/tools_need/seal-tools",
+}
+PIPELINES = ["annotate", *REWRITERS]
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def make_scenes(path, n):
+    """以仓库中的场景定义为模板，生成 n 个 ID 不同的合成场景。"""
+    with open(os.path.join("data", "proactive_scenarios.json"), "r", encoding="utf-8") as f:
+        templates = json.load(f)["scenarios"]
+    scenes = []
+    for i in range(n):
+        scene = dict(templates[i % len(templates)])
+        scene["id"] = f"bench_scene_{i:05d}"
+        scenes.append(scene)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"scenarios": scenes}, f, ensure_ascii=False)
+
+
+def make_records(sample_path, path, n):
+    """以样例输入为模板，生成 n 条 ID 不同的合成记录。"""
+    with open(sample_path, "r", encoding="utf-8") as f:
+        templates = [json.loads(line) for line in f if line.strip()]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            record = dict(templates[i % len(templates)])
+            record["id"] = f"bench_record_{i:05d}"
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def run_annotate(workdir, n, concurrency, prompt_prefix):
+    module = load_module("bench_annotate", os.path.join(SRC_DIR, "pipeline.py"))
+    module.USE_CACHE = False
+    module.PROMPT_PREFIX_MODE = prompt_prefix
+    module.CONTEXT_CACHE_MIN_TOKENS = 0 # mock 服务器没有最小缓存长度，短前缀也注册缓存以便对比
+    module.SCENES_FILE = os.path.join(workdir, "scenes.json")
+    module.ANNOTATIONS_DIR = os.path.join(workdir, "annotations")
+    module.QUARANTINE_FILE = os.path.join(workdir, "quarantine.jsonl")
+    module.DEAD_LETTER_FILE = os.path.join(workdir, "failed.jsonl")
+    # 构建清单也放进临时目录：finish() 会删除本次没有处理的场景，不能碰真实运行的清单
+    module.BUILD_MANIFEST_FILE = os.path.join(workdir, "build.sqlite")
+    make_scenes(module.SCENES_FILE, n)
+    asyncio.run(module.main_async(concurrency=concurrency, rpm=None, tpm=None))
+    return len(os.listdir(module.ANNOTATIONS_DIR))
+
+
+def run_rewriter(name, workdir, n, concurrency, batch_size):
+    rewriter_dir = os.path.join(SRC_DIR, REWRITERS[name])
+    module = load_module(f"bench_{name.replace('-', '_')}", os.path.join(rewriter_dir, "pipeline.py"))
+    module.USE_CACHE = False
+    module.limiter = module.RateLimiter()
+    module.MAX_WORKERS = concurrency
+    if batch_size is not None:
+        module.BATCH_SIZE = batch_size
+    input_file = os.path.join(workdir, f"{name}_input.jsonl")
+    output_file = os.path.join(workdir, f"{name}_output.jsonl")
+    make_records(os.path.join(rewriter_dir, "input.jsonl"), input_file, n)
+    module.process_jsonl_file(input_file, output_file)
+    return count_lines(output_file)
+
+
+def run_one(pipeline, server, args):
+    from utils.llm_client import call_stats
+
+    call_stats.reset()
+    before = server.stats.snapshot()
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        # 流水线本身的逐条打印会淹没压测结果
+        with contextlib.redirect_stdout(io.StringIO()):
+            if pipeline == "annotate":
+                records = run_annotate(workdir, args.records, args.concurrency, args.prompt_prefix)
+            else:
+                records = run_rewriter(pipeline, workdir, args.records, args.concurrency, args.batch_size)
+        elapsed = time.perf_counter() - start
+    after = server.stats.snapshot()
+
+    server_counts = {key: after[key] - before[key] for key in after}
+    return {
+        "pipeline": pipeline,
+        "records": records,
+        "seconds": elapsed,
+        "records_per_sec": records / elapsed if elapsed > 0 else 0.0,
+        "api_calls": call_stats.calls,
+        "api_errors": call_stats.errors,
+        "retries": call_stats.retries,
+        "latency_p50_ms": call_stats.percentile(0.50) * 1000,
+        "latency_p99_ms": call_stats.percentile(0.99) * 1000,
+        "server": server_counts,
+    }
+
+
+def print_report(results):
+    header = (f"{'pipeline':<12}{'records':>9}{'sec':>9}{'rec/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+              f"{'calls':>8}{'errors':>8}{'retries':>9}{'429':>6}{'5xx':>6}{'bad':>6}{'in tok':>10}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        s = r["server"]
+        print(f"{r['pipeline']:<12}{r['records']:>9}{r['seconds']:>9.2f}{r['records_per_sec']:>9.1f}"
+              f"{r['latency_p50_ms']:>9.0f}{r['latency_p99_ms']:>9.0f}{r['api_calls']:>8}{r['api_errors']:>8}"
+              f"{r['retries']:>9}{s['rate_limited']:>6}{s['server_error']:>6}{s['malformed']:>6}{s['input_tokens']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地 mock 服务器上压测 LLM 流水线")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=PIPELINES)
+    parser.add_argument("--records", type=int, default=100, help="每条流水线的合成记录数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--batch-size", type=int, default=None, help="改写流水线的批量大小，默认使用脚本中的配置")
+    parser.add_argument("--prompt-prefix", choices=["context", "inline"], default="context",
+                        help="标注流水线的提示词前缀引用上下文缓存还是每个请求内联发送")
+    parser.add_argument("--output", default=None, help="将结果以 JSON 写入该文件")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(config_from_args(args))
+    os.environ["GEMINI_BASE_URL"] = server.base_url
+    print(f"Mock server: {server.base_url}")
+
+    results = []
+    try:
+        for pipeline in args.pipelines:
+            results.append(run_one(pipeline, server, args))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
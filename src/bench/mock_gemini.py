@@ -0,0 +1,492 @@
+"""
+本地 Gemini mock 服务器，实现 generateContent 接口（v1beta/models/{model}:generateContent）
+和上下文缓存接口（v1beta/cachedContents），用于离线测试和压测各条 LLM 流水线。
+同时实现 OpenAI 兼容的 /v1/chat/completions 接口，可作为客户端池中 type 为 openai 的后端（见 utils.client_pool）。
+可配置延迟分布、5xx 错误率、429 限流率和格式错误响应的比例；prefill_latency 按未缓存的输入 token 数
+增加延迟，用于对比提示词前缀内联发送和引用上下文缓存的差别。
+
+用法：
+    python src/bench/mock_gemini.py --port 8765 --latency lognormal --latency-mean 0.8 --rate-limit-rate 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8765 python src/pipeline.py
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.ratelimit import estimate_tokens
+
+_PATH_PATTERN = re.compile(r"^/(v1beta|v1alpha|v1)/models/([^/:]+):(generateContent|streamGenerateContent)")
+_CACHE_PATH_PATTERN = re.compile(r"^/(v1beta|v1alpha|v1)/cachedContents(?:/([^/?]+))?/?(?:\?.*)?$")
+_CHAT_PATH_PATTERN = re.compile(r"^(?:/v1)?/chat/completions/?$")
+_RECORD_PATTERN = re.compile(r"=== RECORD (.+?) ===")
+_DURATION_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)s\s*$")
+DEFAULT_CACHE_TTL = 3600
+
+
+class MockConfig:
+    """
+    mock 服务器的行为配置。
+
+    Args:
+        latency (str): 延迟分布，"fixed"、"uniform" 或 "lognormal"。
+        latency_mean (float): 平均延迟（秒）。
+        latency_spread (float): uniform 时为 [mean - spread, mean + spread]，lognormal 时为对数标准差。
+        error_rate (float): 返回 500 的概率。
+        rate_limit_rate (float): 返回 429 的概率。
+        retry_after (float): 429 响应中建议的重试等待秒数。
+        malformed_rate (float): 返回 200 但模型输出被截断、无法解析的概率。
+        prefill_latency (float): 每千个未缓存的输入 token 额外增加的延迟（秒），引用上下文缓存的部分不计。
+        seed (int): 随机种子。
+    """
+
+    def __init__(self, latency="fixed", latency_mean=0.0, latency_spread=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, malformed_rate=0.0, prefill_latency=0.0, seed=None):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self.prefill_latency = prefill_latency
+        self.seed = seed
+
+    def sample_latency(self, rng):
+        if self.latency_mean <= 0:
+            return 0.0
+        if self.latency == "uniform":
+            return max(0.0, rng.uniform(self.latency_mean - self.latency_spread,
+                                        self.latency_mean + self.latency_spread))
+        if self.latency == "lognormal":
+            sigma = self.latency_spread or 0.5
+            # 使分布的均值等于 latency_mean
+            mu = math.log(self.latency_mean) - sigma * sigma / 2
+            return rng.lognormvariate(mu, sigma)
+        return self.latency_mean
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "server_error": 0, "malformed": 0,
+                       "input_tokens": 0, "cached_tokens": 0}
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def _prompt_text(body):
+    texts = []
+    for content in body.get("contents", []):
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def _chat_text(body):
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        elif content:
+            texts.append(str(content))
+    return "\n".join(texts)
+
+
+def _timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+def _ttl_seconds(body):
+    match = _DURATION_PATTERN.match(str(body.get("ttl", "")))
+    return float(match.group(1)) if match else None
+
+
+def _tagged_reply(label):
+    return (f"<think>\n模拟的思考过程：分析请求 {label} 的各个部分。\n</think>\n"
+            f"<perplexity>\n模拟的困惑说明。\n</perplexity>\n"
+            f"final_answer: 这是针对 {label} 的模拟回复。")
+
+
+def _annotation_reply():
+    annotation = {
+        "messages": [
+            {"role": "user", "content": "模拟的用户请求。"},
+            {"role": "assistant", "content": "模拟的澄清问题？"},
+        ],
+        "sub_category": "contextual_ambiguity",
+        "uncertainty_type": None,
+        "requires_tool": False,
+        "thinking_process": {
+            "intent_understanding": "模拟的意图理解。",
+            "self_reflection": {
+                "information_sufficiency": "信息不足。",
+                "knowledge_status": "知识充足。",
+                "capability_status": "能力充足。",
+            },
+        },
+    }
+    return "```json\n" + json.dumps(annotation, ensure_ascii=False, indent=2) + "\n```"
+
+
+def build_reply_text(prompt):
+    """
+    根据提示词的类型生成看起来合理的模型输出：
+    批量改写提示返回按 ID 分隔的多段回复，标注提示返回 JSON，其余返回 think/perplexity/final_answer 格式。
+    """
+    record_ids = _RECORD_PATTERN.findall(prompt)
+    if record_ids:
+        return "\n".join(
+            f"=== RESPONSE {record_id} ===\n{_tagged_reply(record_id)}\n=== END RESPONSE ==="
+            for record_id in record_ids
+        )
+    if "JSON Schema" in prompt or "json_schema" in prompt:
+        return _annotation_reply()
+    return _tagged_reply("该请求")
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, code, status, message, details=None, headers=None):
+        error = {"code": code, "message": message, "status": status}
+        if details:
+            error["details"] = details
+        self._send_json(code, {"error": error}, headers)
+
+    def _read_body(self):
+        """读取请求体，不是合法 JSON 时返回 None（已发送 400）。"""
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            self._send_error(400, "INVALID_ARGUMENT", "Request body is not valid JSON")
+            return None
+
+    def _send_openai_error(self, code, error_type, message, headers=None):
+        self._send_json(code, {"error": {"message": message, "type": error_type, "code": code}}, headers)
+
+    def _simulate(self, uncached_tokens):
+        """
+        模拟一次模型调用：按配置等待，并决定这次请求的结果，
+        返回 "rate_limited"、"server_error"、"malformed" 或 "ok"（前两种由调用方按各自接口的格式返回错误）。
+        """
+        config = self.server.config
+        stats = self.server.stats
+        stats.incr("requests")
+        with self.server.rng_lock:
+            rng_value = self.server.rng.random()
+            latency = config.sample_latency(self.server.rng)
+        time.sleep(latency + config.prefill_latency * uncached_tokens / 1000)
+
+        if rng_value < config.rate_limit_rate:
+            outcome = "rate_limited"
+        elif rng_value < config.rate_limit_rate + config.error_rate:
+            outcome = "server_error"
+        elif rng_value < config.rate_limit_rate + config.error_rate + config.malformed_rate:
+            outcome = "malformed"
+        else:
+            outcome = "ok"
+        stats.incr(outcome)
+        return outcome
+
+    def _cached_content(self):
+        """返回 (路径匹配的 cachedContents/{id}, 缓存条目)，路径不是单个缓存或缓存不存在时已发送 404。"""
+        match = _CACHE_PATH_PATTERN.match(self.path)
+        if not match or not match.group(2):
+            self._send_error(404, "NOT_FOUND", f"Unknown path {self.path}")
+            return None, None
+        name = f"cachedContents/{match.group(2)}"
+        entry = self.server.get_cached_content(name)
+        if entry is None:
+            self._send_error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+        return name, entry
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats.snapshot())
+            return
+        _, entry = self._cached_content()
+        if entry is not None:
+            self._send_json(200, self.server.describe_cached_content(entry))
+
+    def do_PATCH(self):
+        body = self._read_body()
+        if body is None:
+            return
+        _, entry = self._cached_content()
+        if entry is not None:
+            ttl = _ttl_seconds(body)
+            self._send_json(200, self.server.update_cached_content(entry, ttl or DEFAULT_CACHE_TTL))
+
+    def do_DELETE(self):
+        name, entry = self._cached_content()
+        if entry is not None:
+            self.server.delete_cached_content(name)
+            self._send_json(200, {})
+
+    def do_POST(self):
+        body = self._read_body()
+        if body is None:
+            return
+
+        if _CACHE_PATH_PATTERN.match(self.path):
+            system = body.get("systemInstruction")
+            text = _prompt_text({"contents": ([system] if system else []) + body.get("contents", [])})
+            entry = self.server.create_cached_content(body.get("model"), body.get("displayName"), text,
+                                                      _ttl_seconds(body) or DEFAULT_CACHE_TTL)
+            self._send_json(200, self.server.describe_cached_content(entry))
+            return
+
+        if _CHAT_PATH_PATTERN.match(self.path):
+            self._chat_completion(body)
+            return
+
+        match = _PATH_PATTERN.match(self.path)
+        if not match:
+            self._send_error(404, "NOT_FOUND", f"Unknown path {self.path}")
+            return
+        model = match.group(2)
+
+        prompt = _prompt_text(body)
+        uncached_tokens = estimate_tokens(prompt)
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            entry = self.server.get_cached_content(body["cachedContent"])
+            if entry is None:
+                self._send_error(404, "NOT_FOUND", f"CachedContent not found: {body['cachedContent']}")
+                return
+            prompt = entry["text"] + "\n" + prompt
+            cached_tokens = entry["tokens"]
+
+        config = self.server.config
+        stats = self.server.stats
+        outcome = self._simulate(uncached_tokens)
+        if outcome == "rate_limited":
+            self._send_error(
+                429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).",
+                details=[{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                          "retryDelay": f"{config.retry_after:g}s"}],
+                headers={"Retry-After": f"{config.retry_after:g}"},
+            )
+            return
+        if outcome == "server_error":
+            self._send_error(500, "INTERNAL", "An internal error has occurred.")
+            return
+
+        text = build_reply_text(prompt)
+        if outcome == "malformed":
+            text = text[: len(text) // 2]
+
+        prompt_tokens = uncached_tokens + cached_tokens
+        output_tokens = estimate_tokens(text)
+        stats.incr("input_tokens", uncached_tokens)
+        stats.incr("cached_tokens", cached_tokens)
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": usage,
+            "modelVersion": model,
+        })
+
+    def _chat_completion(self, body):
+        """OpenAI 兼容的 chat/completions（不支持 stream），延迟和错误的模拟与 generateContent 相同。"""
+        if body.get("stream"):
+            self._send_openai_error(400, "invalid_request_error", "stream is not supported by the mock server")
+            return
+        prompt = _chat_text(body)
+        prompt_tokens = estimate_tokens(prompt)
+        config = self.server.config
+        outcome = self._simulate(prompt_tokens)
+        if outcome == "rate_limited":
+            self._send_openai_error(429, "rate_limit_exceeded", "Rate limit reached for requests",
+                                    headers={"Retry-After": f"{config.retry_after:g}"})
+            return
+        if outcome == "server_error":
+            self._send_openai_error(500, "server_error", "The server had an error while processing your request.")
+            return
+
+        text = build_reply_text(prompt)
+        if outcome == "malformed":
+            text = text[: len(text) // 2]
+        output_tokens = estimate_tokens(text)
+        self.server.stats.incr("input_tokens", prompt_tokens)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{self.server.stats.snapshot()['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            },
+        })
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, MockGeminiHandler)
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.cached_contents = {}
+        self._cache_lock = threading.Lock()
+        self._cache_seq = 0
+
+    def create_cached_content(self, model, display_name, text, ttl):
+        now = time.time()
+        with self._cache_lock:
+            self._cache_seq += 1
+            entry = {"name": f"cachedContents/mock-{self._cache_seq}", "model": model, "displayName": display_name,
+                     "text": text, "tokens": estimate_tokens(text), "created": now, "updated": now,
+                     "expires": now + ttl}
+            self.cached_contents[entry["name"]] = entry
+        return entry
+
+    def get_cached_content(self, name):
+        """返回未过期的缓存条目，不存在或已过期时返回 None。"""
+        with self._cache_lock:
+            entry = self.cached_contents.get(name)
+            if entry is not None and entry["expires"] <= time.time():
+                del self.cached_contents[name]
+                entry = None
+            return entry
+
+    def update_cached_content(self, entry, ttl):
+        with self._cache_lock:
+            entry["updated"] = time.time()
+            entry["expires"] = entry["updated"] + ttl
+        return self.describe_cached_content(entry)
+
+    def delete_cached_content(self, name):
+        with self._cache_lock:
+            self.cached_contents.pop(name, None)
+
+    @staticmethod
+    def describe_cached_content(entry):
+        resource = {
+            "name": entry["name"],
+            "model": entry["model"],
+            "createTime": _timestamp(entry["created"]),
+            "updateTime": _timestamp(entry["updated"]),
+            "expireTime": _timestamp(entry["expires"]),
+            "usageMetadata": {"totalTokenCount": entry["tokens"]},
+        }
+        if entry["displayName"]:
+            resource["displayName"] = entry["displayName"]
+        return resource
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动 mock 服务器，返回服务器对象（port=0 时自动选择空闲端口）。
+    """
+    server = MockGeminiServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--latency-mean", type=float, default=0.2, help="平均延迟（秒）")
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应建议的重试秒数")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="返回无法解析的输出的概率")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="每千个未缓存输入 token 增加的延迟（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args):
+    return MockConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_spread=args.latency_spread,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        malformed_rate=args.malformed_rate,
+        prefill_latency=args.prefill_latency,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Gemini generateContent / cachedContents / OpenAI chat mock 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGeminiServer((args.host, args.port), config_from_args(args))
+    print(f"Mock Gemini server listening on {server.base_url}")
+    print(f"  export GEMINI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Stats: {server.stats.snapshot()}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
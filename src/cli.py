@@ -0,0 +1,225 @@
+"""
+所有转换和生成脚本的统一命令行入口，必须在仓库根目录下运行：
+
+    python src/cli.py convert-in3 --workers 8
+    python src/cli.py annotate --retry-failed
+    python src/cli.py rewrite-seal --input in.jsonl --output out.jsonl
+    python src/cli.py rewrite-seal --backends backends.json --max-workers 16
+    python src/cli.py show dataset/proactive_annotations_from_in3.jsonl --sample 5 --category clarification
+    python src/cli.py --metrics metrics/annotate.prom --profile annotate.folded --profiler sampling annotate
+
+子命令执行时才导入对应的脚本：离线转换和统计（convert-*、stats、dedup、pack、export、mix）不会导入 google-genai，
+不需要 SDK 或凭据；annotate、rewrite-* 也要到第一次调用 API 时才创建客户端。
+命令行参数覆盖脚本中的同名配置常量，未指定的参数沿用脚本中的配置。
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SRC_DIR)
+
+SCRIPTS = {
+    "annotate": "pipeline.py",
+    "rewrite-coqa": "convert/ambiguity/abg-coqa/pipeline.py",
+    "rewrite-seal": "convert/tools_need/seal-tools/pipeline.py",
+    "convert-coqa": "convert/ambiguity/abg-coqa/abg-coqa-jsonl.py",
+    "convert-in3": "convert/ambiguity/in3/in3.py",
+    "convert-seal": "convert/tools_need/seal-tools/seal.py",
+    "convert-trivia-qa": "convert/knowledge_gap/trivia_qa/trivia_qa.py",
+    "stats": "dataset_stats.py",
+    "dedup": "dedup.py",
+    "pack": "pack.py",
+    "export": "export.py",
+    "mix": "mix.py",
+}
+
+
+def load_script(command):
+    """按路径导入子命令对应的脚本（部分脚本名含连字符，无法直接 import）。"""
+    name = "cli_" + command.replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SRC_DIR, SCRIPTS[command]))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module # 转换子进程按模块名查找 worker 函数
+    spec.loader.exec_module(module)
+    return module
+
+
+def configure(module, **settings):
+    """用命令行中指定了的参数覆盖脚本的配置常量。"""
+    for name, value in settings.items():
+        if value is not None:
+            setattr(module, name, value)
+
+
+def run_annotate(args):
+    module = load_script(args.command)
+    configure(module, SCENES_FILE=args.scenes, ANNOTATIONS_DIR=args.output_dir, CONCURRENCY=args.concurrency,
+              BACKENDS_FILE=args.backends)
+    if args.sync:
+        module.main(retry_failed=args.retry_failed)
+    else:
+        asyncio.run(module.main_async(concurrency=module.CONCURRENCY, retry_failed=args.retry_failed))
+
+
+def run_rewrite(args):
+    module = load_script(args.command)
+    configure(module, INPUT_FILE=args.input, OUTPUT_FILE=args.output, BATCH_SIZE=args.batch_size,
+              MAX_WORKERS=args.max_workers, BACKENDS_FILE=args.backends)
+    module.process_jsonl_file(module.INPUT_FILE, module.OUTPUT_FILE, retry_failed=args.retry_failed)
+
+
+def run_offline(args):
+    """离线转换、统计、去重、打包、导出和混合：--workers 未指定时使用脚本中的 WORKERS。"""
+    module = load_script(args.command)
+    configure(module, INPUT_FILE=getattr(args, "input", None), OUTPUT_FILE=getattr(args, "output", None),
+              TOOLS_FILE=getattr(args, "tools", None), STORY_TABLE_FILE=getattr(args, "stories", None),
+              TASKS_FILE=getattr(args, "tasks", None), MAX_TOKENS=getattr(args, "max_tokens", None),
+              OUTPUT_DIR=getattr(args, "output_dir", None), FORMAT=getattr(args, "format", None),
+              MIX_SIZE=getattr(args, "size", None), SEED=getattr(args, "seed", None),
+              UPSAMPLE=getattr(args, "upsample", None))
+    workers = args.workers or module.WORKERS
+    if args.command == "pack":
+        module.main(workers=workers, max_tokens=module.MAX_TOKENS)
+    else:
+        module.main(workers=workers)
+
+
+def run_show(args):
+    """按 ID、位置或随机抽样取出样本，第一次使用时在文件旁建立 .records.idx 偏移索引。"""
+    from utils.record_index import open_record_index
+
+    with contextlib.redirect_stdout(sys.stderr): # 建立索引时的进度信息不混入样本输出
+        dataset = open_record_index(args.input, workers=args.workers, rebuild=args.rebuild_index)
+    with dataset:
+        if args.ids:
+            for record_id in args.ids:
+                record = dataset.get(record_id)
+                if record is None:
+                    print(f"未找到: {record_id}", file=sys.stderr)
+                else:
+                    print(json.dumps(record, ensure_ascii=False))
+        elif args.positions:
+            for position in args.positions:
+                print(json.dumps(dataset[position], ensure_ascii=False))
+        elif args.sample:
+            conditions = {"proactive_category": args.category, "sub_category": args.sub_category,
+                          "requires_tool": args.requires_tool}
+            records = dataset.sample(args.sample, seed=args.seed,
+                                     **{key: value for key, value in conditions.items() if value is not None})
+            for record in records:
+                print(json.dumps(record, ensure_ascii=False))
+        else:
+            print(json.dumps({"records": len(dataset), **dataset.label_counts()}, ensure_ascii=False, indent=2))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Proactive 数据集构建工具")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="导出性能指标：.prom 结尾时为 Prometheus textfile，否则为 JSON 快照")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="运行期间写出指标的间隔秒数")
+    parser.add_argument("--profile", metavar="FILE", help="对整个子命令做性能剖析并把结果写入该文件")
+    parser.add_argument("--profiler", choices=["cprofile", "sampling"], default="cprofile",
+                        help="cprofile 只覆盖主线程（.pstats）；sampling 采样所有线程的调用栈（folded stacks）")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    annotate = commands.add_parser("annotate", help="用 Gemini 为场景定义生成主动行为注释 (src/pipeline.py)")
+    annotate.add_argument("--scenes", help="场景定义文件")
+    annotate.add_argument("--output-dir", help="注释输出目录")
+    annotate.add_argument("--concurrency", type=int, help="同时在途的请求数")
+    annotate.add_argument("--sync", action="store_true", help="逐个场景串行处理")
+    annotate.add_argument("--retry-failed", action="store_true", help="只重新生成死信队列中调用失败的场景")
+    annotate.add_argument("--backends", help="多后端客户端池的配置文件（JSON），见 src/utils/client_pool.py")
+    annotate.set_defaults(handler=run_annotate)
+
+    for command, description in (("rewrite-coqa", "用 Gemini 改写 abg-coqa 记录的最后一条回复"),
+                                 ("rewrite-seal", "用 Gemini 改写 seal-tools 记录的最后一条回复")):
+        rewrite = commands.add_parser(command, help=description)
+        rewrite.add_argument("--input", help="输入 JSONL")
+        rewrite.add_argument("--output", help="输出 JSONL")
+        rewrite.add_argument("--batch-size", type=int, help="每个请求打包的记录数，1 表示关闭批量模式")
+        rewrite.add_argument("--max-workers", type=int, help="同时在途的请求数")
+        rewrite.add_argument("--retry-failed", action="store_true", help="只重放死信队列中调用失败的记录")
+        rewrite.add_argument("--backends", help="多后端客户端池的配置文件（JSON），见 src/utils/client_pool.py")
+        rewrite.set_defaults(handler=run_rewrite)
+
+    for command, description in (("convert-coqa", "把 CoQA-Abg 转换为训练样本"),
+                                 ("convert-in3", "把 IN3 交互数据转换为训练样本"),
+                                 ("convert-seal", "把 Seal-Tools 转换为训练样本"),
+                                 ("convert-trivia-qa", "把 TriviaQA rc.nocontext 转换为 knowledge_gap 训练样本")):
+        convert = commands.add_parser(command, help=description)
+        convert.add_argument("--input", help="输入文件（convert-trivia-qa 也可以是包含多个分片的目录）")
+        convert.add_argument("--output", help="输出 JSONL")
+        if command == "convert-seal":
+            convert.add_argument("--tools", help="tool.jsonl 路径")
+        elif command == "convert-coqa":
+            convert.add_argument("--stories", help="reference 模式下的故事表")
+        elif command == "convert-in3":
+            convert.add_argument("--tasks", help="reference 模式下的原始任务表")
+        convert.add_argument("--workers", type=int, help="转换进程数")
+        convert.set_defaults(handler=run_offline)
+
+    stats = commands.add_parser("stats", help="统计各数据集并更新 readme 表格")
+    stats.add_argument("--workers", type=int, help="统计进程数")
+    stats.set_defaults(handler=run_offline)
+
+    dedup = commands.add_parser("dedup", help="合并各数据集并做 MinHash-LSH 近似去重")
+    dedup.add_argument("--output", help="输出 JSONL")
+    dedup.add_argument("--workers", type=int, help="计算签名的进程数")
+    dedup.set_defaults(handler=run_offline)
+
+    pack = commands.add_parser("pack", help="按长度把样本打包成训练序列")
+    pack.add_argument("--output", help="输出 JSONL")
+    pack.add_argument("--max-tokens", type=int, help="训练序列长度")
+    pack.add_argument("--workers", type=int, help="计算长度的进程数")
+    pack.set_defaults(handler=run_offline)
+
+    export = commands.add_parser("export", help="把各数据集导出为 Parquet 或 Arrow IPC 列式文件")
+    export.add_argument("--output-dir", help="输出目录")
+    export.add_argument("--format", choices=["parquet", "arrow"], help="输出格式")
+    export.add_argument("--workers", type=int, help="解析 JSON 的进程数")
+    export.set_defaults(handler=run_offline)
+
+    mix = commands.add_parser("mix", help="按数据集和类别权重抽样，生成打乱的均衡混合集")
+    mix.add_argument("--output", help="输出 JSONL")
+    mix.add_argument("--size", type=int, help="混合集总条数")
+    mix.add_argument("--seed", type=int, help="抽样和打乱的随机种子")
+    mix.add_argument("--upsample", action="store_true", default=None, help="样本不足的层重复样本以达到配额")
+    mix.add_argument("--workers", type=int, help="解析 JSON 的进程数")
+    mix.set_defaults(handler=run_offline)
+
+    show = commands.add_parser("show", help="按 ID、位置或随机抽样查看转换输出中的样本（不扫描整个文件）")
+    show.add_argument("input", help="未压缩的转换输出 JSONL")
+    show.add_argument("--id", dest="ids", nargs="+", help="样本 ID")
+    show.add_argument("--position", dest="positions", type=int, nargs="+", help="样本位置（从 0 开始）")
+    show.add_argument("--sample", type=int, help="随机抽取的样本数")
+    show.add_argument("--seed", type=int, help="抽样的随机种子")
+    show.add_argument("--category", help="只抽取该 proactive_category 的样本")
+    show.add_argument("--sub-category", help="只抽取该 sub_category 的样本")
+    show.add_argument("--requires-tool", type=lambda value: value.lower() in ("1", "true", "yes"),
+                      help="只抽取 requires_tool 为该值的样本")
+    show.add_argument("--workers", type=int, help="建立索引的进程数")
+    show.add_argument("--rebuild-index", action="store_true", help="强制重建索引")
+    show.set_defaults(handler=run_show)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from utils.metrics import metrics, MetricsExporter, Profiler
+
+    metrics.const_labels["command"] = args.command
+    with contextlib.ExitStack() as stack:
+        if args.metrics:
+            stack.enter_context(MetricsExporter(args.metrics, args.metrics_interval))
+        if args.profile:
+            stack.enter_context(Profiler(args.profile, args.profiler))
+        args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
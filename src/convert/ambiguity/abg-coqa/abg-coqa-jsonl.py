@@ -2,14 +2,33 @@
 import json
 import os
 import re 
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.jsonstream import iter_json_array, MissingKeyError
+from utils.parallel import map_items_ordered, default_workers
+from utils.sink import open_sink, sharded_dir_for
+from utils.build_manifest import (BuildManifest, MISSING, code_version, content_hash, init_worker_manifest,
+                                  lookup_worker, save_incremental, utils_sources, worker_incremental)
+from utils.story_table import StoryTableWriter, StoryCollector, combine_story_question
+from utils.metrics import metrics
 
 # --- 配置 ---
 INPUT_FILE = "data/coqa_abg_train.json" # 您提供的输入文件路径
 OUTPUT_FILE = "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl" # 输出 JSONL 文件路径
-
-# 确保输出目录存在
-output_dir = os.path.dirname(OUTPUT_FILE)
-os.makedirs(output_dir, exist_ok=True)
+# 故事存储方式："inline" 时把 story 直接拼进第一条用户消息（完整展开，stats/dedup/pack/export/mix 都按此格式读取）；
+# "reference" 时每个不同的 story 只写一次到 STORY_TABLE_FILE，样本通过 story_ref 引用，体积小得多，
+# 但下游阶段使用前要先用 utils.story_table.materialize_file 还原成完整消息
+STORY_MODE = "inline"
+STORY_TABLE_FILE = "dataset/contextual_ambiguity/coqa_abg_stories.jsonl"
+STREAMING = True # 逐个读取 'data' 数组中的元素，内存占用与输入大小无关；False 时一次性 json.load 整个文件
+WORKERS = default_workers() # 转换进程数，1 表示单进程
+SHARDED_OUTPUT = False # True 时把样本写成 OUTPUT_FILE 同名目录下按大小滚动的压缩分片，并生成 manifest.json
+OUTPUT_COMPRESSION = "gzip" # 分片的压缩格式："gzip"、"zstd"（需要 zstandard 包）或 None
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # 单个分片的大小上限（字节）
+INCREMENTAL = False # 增量构建：输入元素与上次构建相同（且本脚本和配置未改动）时直接沿用上次的结果，代价见 utils.build_manifest
+BUILD_MANIFEST_FILE = "cache/build/coqa_abg.sqlite" # 增量构建清单
 
 def clean_filename(filename):
     """
@@ -25,9 +44,21 @@ def clean_filename(filename):
         cleaned = cleaned[:max_length]
     return cleaned
 
-def convert_coref_to_proactive_item(coref_item, new_id):
+def make_first_user_message(story_content, question, story_table=None):
+    """
+    构建第一条用户消息：提供 story_table 时只保存问题并引用故事，否则将 story 与问题合并。
+    """
+    if not story_content:
+        # 如果没有 story，直接使用问题
+        return {"role": "user", "content": question}
+    if story_table is not None:
+        return {"role": "user", "content": question, "story_ref": story_table.add(story_content)}
+    return {"role": "user", "content": combine_story_question(story_content, question)}
+
+def convert_coref_to_proactive_item(coref_item, new_id, story_table=None):
     """
     将单个 coref 数据项转换为主动对话训练项。
+    提供 story_table (StoryTableWriter) 时，story 写入侧表，第一条用户消息只保留引用。
     """
     # 检查 coref_item 是否为字典 (现在应该在 data 列表内部了)
     if not isinstance(coref_item, dict):
@@ -46,13 +77,7 @@ def convert_coref_to_proactive_item(coref_item, new_id):
     if history_turns:
         # 如果有历史对话，将 story 与 history_turns[0] 合并
         first_question = history_turns[0]["question"]
-        if story_content:
-            combined_first_user_message = f"According to the story:\n\n{story_content}\n\nAnswer the following question:\n\n{first_question}"
-        else:
-            # 如果没有 story，直接使用第一个问题
-            combined_first_user_message = first_question
-
-        messages.append({"role": "user", "content": combined_first_user_message})
+        messages.append(make_first_user_message(story_content, first_question, story_table))
         # 添加第一个问题对应的助手回答
         messages.append({"role": "assistant", "content": history_turns[0]["answer"]})
 
@@ -66,13 +91,7 @@ def convert_coref_to_proactive_item(coref_item, new_id):
 
     else:
         # 如果没有历史对话，将 story 与 target_turn 合并作为第一条用户消息
-        if story_content:
-            combined_first_user_message = f"According to the story:\n\n{story_content}\n\nAnswer the following question:\n\n{target_turn['question']}"
-        else:
-            # 如果没有 story，直接使用 target_turn 的问题
-            combined_first_user_message = target_turn["question"]
-
-        messages.append({"role": "user", "content": combined_first_user_message})
+        messages.append(make_first_user_message(story_content, target_turn["question"], story_table))
 
 
 
@@ -110,24 +129,18 @@ def convert_coref_to_proactive_item(coref_item, new_id):
 
     return proactive_item
 
-def main():
-    print(f"Loading data from {INPUT_FILE}...")
-    try:
-        with open(INPUT_FILE, "r", encoding="utf-8") as f:
-            full_data = json.load(f) # 加载整个 JSON
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON 解析错误: {e}")
-        print(f"  请检查文件 {INPUT_FILE} 的格式是否为有效的 JSON。")
-        return
-    except FileNotFoundError:
-        print(f"❌ 文件未找到: {INPUT_FILE}")
-        return
+def load_coref_items(input_file):
+    """
+    一次性加载整个 JSON 文件并返回 'data' 列表，格式不符时打印原因并返回 None。
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        full_data = json.load(f) # 加载整个 JSON
 
     # 检查加载的数据是否为字典，并包含 'data' 键
     if not isinstance(full_data, dict) or "data" not in full_data:
         print(f"❌ 加载的数据不是预期的字典格式或缺少 'data' 键: {type(full_data)}")
-        print(f"  请确保 {INPUT_FILE} 文件内容形如 {{'version': '...', 'data': [...]}}")
-        return
+        print(f"  请确保 {input_file} 文件内容形如 {{'version': '...', 'data': [...]}}")
+        return None
 
     # 提取 'data' 列表
     coref_data_list = full_data["data"]
@@ -135,30 +148,165 @@ def main():
     # 检查 data 键对应的值是否为列表
     if not isinstance(coref_data_list, list):
         print(f"❌ 'data' 键对应的值不是列表类型: {type(coref_data_list)}")
-        print(f"  请确保 {INPUT_FILE} 文件中的 'data' 字段是一个 JSON 数组，例如 [...]")
-        return
+        print(f"  请确保 {input_file} 文件中的 'data' 字段是一个 JSON 数组，例如 [...]")
+        return None
 
     print(f"Found {len(coref_data_list)} items in 'data' field. Converting...")
+    return coref_data_list
+
+def iter_coref_items(input_file):
+    """
+    流式读取 'data' 数组，逐个产出元素，不把整个文件加载进内存。
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        yield from iter_json_array(f, ("data",))
+
+# 当前（子）进程中收集故事的对象，见 convert_item_to_line
+_story_collector = None
 
-    # 打开输出文件以写入 JSONL
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f_out:
+def reset_story_collector():
+    # 每次运行开始时清空，避免 fork 出的子进程继承上一次运行中已见过的故事
+    global _story_collector
+    _story_collector = None
+
+def init_worker(manifest_path, version):
+    reset_story_collector()
+    init_worker_manifest(manifest_path, version)
+
+def current_story_collector():
+    global _story_collector
+    if _story_collector is None:
+        _story_collector = StoryCollector()
+    return _story_collector
+
+def convert_item_to_line(i, item, story_mode):
+    """
+    转换 'data' 列表中索引为 i 的元素，返回 (样本 JSON 行或 None, 本进程新见到的故事列表)。
+    供多进程驱动在子进程中调用。
+    """
+    # 再次检查 item 是否为字典 (来自 data 列表)
+    if not isinstance(item, dict):
+        print(f"  - 跳过 'data' 列表中索引 {i} 处的非字典项目: {type(item)}")
+        return None, []
+
+    story_table = current_story_collector() if story_mode == "reference" else None
+
+    # 传递顺序编号 (i) 作为 new_id
+    try:
+        proactive_item = convert_coref_to_proactive_item(item, i, story_table)
+    except (KeyError, TypeError, AttributeError) as e:
+        # 缺少字段或字段类型不对的元素跳过，不中断整个转换；
+        # 出错前已经加入收集器的故事仍然返回，否则后续引用同一故事的样本会找不到它
+        print(f"  - 跳过 'data' 列表中索引 {i} 处格式不完整的项目: {type(e).__name__}: {e}")
+        proactive_item = None
+    output_line = json.dumps(proactive_item, ensure_ascii=False) if proactive_item else None
+    return output_line, story_table.drain() if story_table is not None else []
+
+def convert_item_incremental(i, item, story_mode):
+    """
+    增量模式下的 convert_item_to_line，返回 (key, 输入哈希, 是否沿用, (样本 JSON 行或 None, 新故事列表))。
+    清单只保存样本行：故事侧表每次都会重新生成，所以沿用的样本所引用的故事要从输入中重新收集。
+    """
+    key = str(i)
+    if not worker_incremental():
+        return key, None, False, convert_item_to_line(i, item, story_mode)
+
+    input_hash = content_hash(item)
+    output_line = lookup_worker(key, input_hash)
+    if output_line is MISSING:
+        return key, input_hash, False, convert_item_to_line(i, item, story_mode)
+
+    new_stories = []
+    if output_line and story_mode == "reference":
+        story_content = item.get("story", "").strip()
+        if story_content:
+            story_table = current_story_collector()
+            story_table.add(story_content)
+            new_stories = story_table.drain()
+    return key, input_hash, True, (output_line, new_stories)
+
+def main(workers=WORKERS):
+    print(f"Loading data from {INPUT_FILE}...")
+    if not os.path.exists(INPUT_FILE):
+        print(f"❌ 文件未找到: {INPUT_FILE}")
+        return
+
+    if STREAMING:
+        print("Streaming items from 'data' field. Converting...")
+        coref_items = iter_coref_items(INPUT_FILE)
+    else:
+        try:
+            coref_items = load_coref_items(INPUT_FILE)
+        except json.JSONDecodeError as e:
+            print(f"❌ JSON 解析错误: {e}")
+            print(f"  请检查文件 {INPUT_FILE} 的格式是否为有效的 JSON。")
+            return
+        if coref_items is None:
+            return
+
+    # 确保输出目录存在
+    for path in (OUTPUT_FILE, STORY_TABLE_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    story_table = StoryTableWriter(STORY_TABLE_FILE) if STORY_MODE == "reference" else None
+
+    # 增量构建：子进程只读打开同一份清单，输入元素未变化时直接返回上次的样本行
+    version = code_version([os.path.abspath(__file__), *utils_sources("story_table", "jsonstream")],
+                           story_mode=STORY_MODE)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE, version) if INCREMENTAL else None
+    manifest_path = BUILD_MANIFEST_FILE if INCREMENTAL else None
+
+    # 打开输出文件以写入 JSONL，结果按输入顺序合并
+    with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
         converted_count = 0
-        for i, item in enumerate(coref_data_list):
-            # 再次检查 item 是否为字典 (来自 data 列表)
-            if not isinstance(item, dict):
-                print(f"  - 跳过 'data' 列表中索引 {i} 处的非字典项目: {type(item)}")
-                continue
-            # 传递顺序编号 (i) 作为 new_id
-            proactive_item = convert_coref_to_proactive_item(item, i)
-            if proactive_item:
-                # 将单个 JSON 对象写入文件，并以换行符分隔
-                f_out.write(json.dumps(proactive_item, ensure_ascii=False) + "\n")
-                converted_count += 1
-                # 可选：打印进度
-                if converted_count % 1000 == 0:
-                    print(f"  - Converted {converted_count} items...")
-
-    print(f"Conversion complete! {converted_count} items saved to {OUTPUT_FILE}")
+        results = map_items_ordered(coref_items, partial(convert_item_incremental, story_mode=STORY_MODE), workers,
+                                    initializer=init_worker, initargs=(manifest_path, version))
+        written = metrics.counter("records_total", status="written")
+        write_timer = metrics.timer("write")
+        try:
+            # convert 阶段为主进程等待（读取输入和子进程转换）结果的时间
+            for key, input_hash, reused, (output_line, new_stories) in metrics.timed(results, "convert"):
+                with write_timer:
+                    save_incremental(manifest, key, input_hash, reused, output_line)
+                    if story_table is not None:
+                        for story in new_stories:
+                            story_table.add(story)
+                    if output_line:
+                        # 将单个 JSON 对象写入文件，并以换行符分隔
+                        f_out.write(output_line)
+                if output_line:
+                    converted_count += 1
+                    written.inc()
+                    # 可选：打印进度
+                    if converted_count % 1000 == 0:
+                        print(f"  - Converted {converted_count} items "
+                              f"({metrics.rate('records_total', status='written'):.0f} items/s)...")
+        except MissingKeyError:
+            print(f"❌ 输入文件缺少 'data' 键")
+            print(f"  请确保 {INPUT_FILE} 文件内容形如 {{'version': '...', 'data': [...]}}")
+            return
+        except json.JSONDecodeError as e:
+            print(f"❌ JSON 解析错误 (已转换 {converted_count} 项): {e}")
+            print(f"  请检查文件 {INPUT_FILE} 的格式是否为有效的 JSON，且 'data' 字段是一个 JSON 数组。")
+            return
+        else:
+            # 只有完整读完输入时才清除清单中本次没有出现的记录
+            if manifest is not None:
+                manifest.finish()
+        finally:
+            if story_table is not None:
+                story_table.close()
+            if manifest is not None:
+                manifest.close()
+
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    print(f"Conversion complete! {converted_count} items saved to {output_location}")
+    if story_table is not None:
+        print(f"  {len(story_table)} unique stories saved to {STORY_TABLE_FILE}")
+        print("  样本只包含 story_ref，运行 stats/dedup/pack/export/mix 前请先用 "
+              "utils.story_table.materialize_file 还原完整消息")
+    if manifest is not None:
+        print(f"  Incremental build: {manifest.summary()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
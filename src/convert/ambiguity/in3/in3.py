@@ -1,24 +1,43 @@
 # convert_vague_task_to_proactive.py
 import json
 import os
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.parallel import map_lines_ordered, default_workers
+from utils.sink import open_sink, sharded_dir_for
+from utils.build_manifest import BuildManifest, code_version, init_worker_manifest, run_incremental, save_incremental
+from utils.metrics import metrics
 
 # --- 配置 ---
 INPUT_FILE = "data/interaction_data_train.jsonl" # 您提供的输入 JSONL 文件路径
 OUTPUT_FILE = "dataset/proactive_annotations_from_in3.jsonl" # 输出 JSONL 文件路径
-
-# 确保输出目录存在
-output_dir = os.path.dirname(OUTPUT_FILE)
-os.makedirs(output_dir, exist_ok=True)
-
-def convert_vague_task_to_proactive_items(vague_task_item, base_id):
+# 原始任务的保存方式："reference" 时每个任务只写一次到 TASKS_FILE，样本通过 original_task_ref 引用；
+# "embed" 时每个样本都带一份完整的 original_vague_task_data
+ORIGINAL_TASK_MODE = "reference"
+TASKS_FILE = "dataset/in3_original_tasks.jsonl"
+WORKERS = default_workers() # 转换进程数，1 表示单进程
+SHARDED_OUTPUT = False # True 时把样本写成 OUTPUT_FILE 同名目录下按大小滚动的压缩分片，并生成 manifest.json
+OUTPUT_COMPRESSION = "gzip" # 分片的压缩格式："gzip"、"zstd"（需要 zstandard 包）或 None
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # 单个分片的大小上限（字节）
+INCREMENTAL = False # 增量构建：输入行与上次构建相同（且本脚本和配置未改动）时直接沿用上次的结果，代价见 utils.build_manifest
+BUILD_MANIFEST_FILE = "cache/build/in3.sqlite" # 增量构建清单
+
+def task_ref_for(base_id):
+    return f"vague_task_{base_id:05d}"
+
+def iter_vague_task_items(vague_task_item, base_id, embed_original=True):
     """
-    将单个 vague task 数据项转换为多个主动对话训练项。
+    将单个 vague task 数据项逐个转换为主动对话训练项。
     每个助手的回复（无论 type）都会生成一个独立的样本。
+    对话历史随遍历增量构建，每个样本只复制一次当前前缀，总耗时与 actions 数量成线性关系（不计输出本身）。
+    embed_original 为 False 时样本只记录 original_task_ref，不再复制原始任务数据。
     """
     # 检查 vague_task_item 是否为字典
     if not isinstance(vague_task_item, dict):
         print(f"  - 跳过非字典类型的项目: {type(vague_task_item)}")
-        return []
+        return
 
     task = vague_task_item.get("task", "").strip()
     actions = vague_task_item.get("actions", [])
@@ -28,10 +47,11 @@ def convert_vague_task_to_proactive_items(vague_task_item, base_id):
 
     if not actions:
         print(f"  - 跳过无 actions 的项目: {category}")
-        return []
+        return
 
-    proactive_items = []
     assistant_action_count = 0 # 计数助手的所有动作，用于生成 ID
+    # 到当前动作之前的对话历史：1. 用户初始任务 2. actions[0..i-1]
+    history = [{"role": "user", "content": task}]
 
     # 遍历 actions，找到所有助手的回复
     for i, action in enumerate(actions):
@@ -40,26 +60,9 @@ def convert_vague_task_to_proactive_items(vague_task_item, base_id):
         action_type = action.get("type")
 
         if role == "assistant":
-            # --- 构建当前助手回复的上下文历史 ---
-            # 从 actions[0] 到 action[i-1]，构建一个对话历史
-            context_messages = []
-            for j in range(i):
-                hist_action = actions[j]
-                context_messages.append({
-                    "role": hist_action.get("role"),
-                    "content": hist_action.get("content")
-                })
-
             # --- 构建当前样本的 messages ---
-            # 1. 用户初始任务
-            user_initial_message = task
-            # 2. 上下文对话历史 (包含到当前助手回复之前的所有历史)
-            # 3. 助手的当前回复
-
-            messages = [
-                {"role": "user", "content": user_initial_message},
-                *context_messages, # 展开历史消息
-            ]
+            # 复制到当前助手回复之前的对话历史，再追加助手的当前回复
+            messages = list(history)
 
             # --- 根据 action_type 设置类别和内容 ---
             if action_type == "New":
@@ -122,44 +125,97 @@ def convert_vague_task_to_proactive_items(vague_task_item, base_id):
                 "source_dataset_id": category,
                 "original_action_index": i, # 记录该助手回复在原 actions 中的索引
                 "original_action_type": action_type, # 记录原始动作类型
-                "original_vague_task_data": vague_task_item # 可选：保留原始数据引用
             }
+            if embed_original:
+                proactive_item["original_vague_task_data"] = vague_task_item # 可选：保留原始数据引用
+            else:
+                proactive_item["original_task_ref"] = task_ref_for(base_id) # 原始数据见 TASKS_FILE
 
-            proactive_items.append(proactive_item)
+            yield proactive_item
             assistant_action_count += 1
 
-    return proactive_items
+        history.append({"role": role, "content": content})
 
-def main():
-    print(f"Loading data from {INPUT_FILE}...")
+def convert_vague_task_to_proactive_items(vague_task_item, base_id, embed_original=True):
+    """
+    将单个 vague task 数据项转换为多个主动对话训练项，返回列表。
+    """
+    return list(iter_vague_task_items(vague_task_item, base_id, embed_original))
+
+def convert_line(i, line, embed_original):
+    """
+    转换输入文件的第 i 行（从 0 开始），返回 (样本 JSON 行列表, 原始任务 JSON 行或 None)。
+    供多进程驱动在子进程中调用。
+    """
     try:
-        with open(INPUT_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-    except FileNotFoundError:
+        item = json.loads(line.strip())
+    except json.JSONDecodeError:
+        print(f"  - 跳过第 {i+1} 行，JSON 解析失败.")
+        return [], None
+
+    output_lines = [json.dumps(proactive_item, ensure_ascii=False)
+                    for proactive_item in iter_vague_task_items(item, i, embed_original)]
+
+    task_line = None
+    if output_lines and not embed_original:
+        # 每个任务只保存一份原始数据
+        task_line = json.dumps({"task_ref": task_ref_for(i), "data": item}, ensure_ascii=False)
+    return output_lines, task_line
+
+def main(workers=WORKERS):
+    print(f"Loading data from {INPUT_FILE}...")
+    if not os.path.exists(INPUT_FILE):
         print(f"❌ 文件未找到: {INPUT_FILE}")
         return
 
-    print(f"Found {len(lines)} lines in JSONL file. Converting...")
-
-    # 打开输出文件以写入 JSONL
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f_out:
+    print(f"Converting with {workers} worker(s)...")
+    embed_original = ORIGINAL_TASK_MODE == "embed"
+
+    # 增量构建：子进程只读打开同一份清单，输入行未变化时直接返回上次的结果
+    version = code_version([os.path.abspath(__file__)], original_task_mode=ORIGINAL_TASK_MODE)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE, version) if INCREMENTAL else None
+    manifest_path = BUILD_MANIFEST_FILE if INCREMENTAL else None
+
+    # 确保输出目录存在
+    for path in (OUTPUT_FILE, TASKS_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 按输入顺序逐条写出，内存占用与输入大小无关
+    f_tasks = None if embed_original else open(TASKS_FILE, "w", encoding="utf-8")
+    with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
         converted_count = 0
-        for i, line in enumerate(lines):
-            try:
-                item = json.loads(line.strip())
-            except json.JSONDecodeError:
-                print(f"  - 跳过第 {i+1} 行，JSON 解析失败.")
-                continue
-
-            proactive_items = convert_vague_task_to_proactive_items(item, i)
-            for proactive_item in proactive_items:
-                f_out.write(json.dumps(proactive_item, ensure_ascii=False) + "\n")
-                converted_count += 1
-
-            if proactive_items and converted_count % 100 == 0: # 只在有输出时打印进度
-                print(f"  - Converted {converted_count} items...")
-
-    print(f"Conversion complete! {converted_count} items saved to {OUTPUT_FILE}")
+        results = map_lines_ordered(INPUT_FILE, partial(run_incremental, convert_line, embed_original=embed_original),
+                                    workers, initializer=init_worker_manifest, initargs=(manifest_path, version))
+        written = metrics.counter("records_total", status="written")
+        write_timer = metrics.timer("write")
+        # convert 阶段为主进程等待（子进程）转换结果的时间
+        for key, input_hash, reused, result in metrics.timed(results, "convert"):
+            with write_timer:
+                save_incremental(manifest, key, input_hash, reused, result)
+                output_lines, task_line = result
+                for output_line in output_lines:
+                    f_out.write(output_line)
+                    converted_count += 1
+
+                if task_line is not None:
+                    f_tasks.write(task_line + "\n")
+            written.inc(len(output_lines))
+
+            if output_lines and converted_count % 100 == 0: # 只在有输出时打印进度
+                print(f"  - Converted {converted_count} items "
+                      f"({metrics.rate('records_total', status='written'):.0f} items/s)...")
+
+    if f_tasks is not None:
+        f_tasks.close()
+    if manifest is not None:
+        manifest.finish()
+        print(f"  Incremental build: {manifest.summary()}")
+        manifest.close()
+
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    print(f"Conversion complete! {converted_count} items saved to {output_location}")
+    if not embed_original:
+        print(f"  Original tasks saved to {TASKS_FILE}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
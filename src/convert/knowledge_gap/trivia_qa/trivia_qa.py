@@ -0,0 +1,217 @@
+# convert_trivia_qa_to_proactive.py
+import glob
+import json
+import os
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.jsonstream import iter_json_array, MissingKeyError
+from utils.parallel import map_items_ordered, default_workers
+from utils.sink import open_sink, sharded_dir_for
+from utils.build_manifest import (BuildManifest, code_version, init_worker_manifest, run_incremental, save_incremental,
+                                  utils_sources)
+from utils.metrics import metrics
+
+# --- 配置 ---
+# TriviaQA rc.nocontext：可以是官方的 JSON（{"Data": [...]}）、每行一条记录的 JSONL、
+# HuggingFace 导出的 Parquet，或包含这些文件（如多个 Parquet 分片）的目录
+INPUT_FILE = "data/trivia_qa/rc.nocontext/train.parquet"
+OUTPUT_FILE = "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl" # 输出 JSONL 文件路径
+INPUT_FORMATS = (".json", ".jsonl", ".parquet") # 目录输入时读取的文件类型
+PARQUET_BATCH_ROWS = 4096 # Parquet 每次读取的行数，内存占用与文件大小无关
+MAX_ALIASES = 20 # 每个样本最多保留的答案别名数，None 表示全部保留
+WORKERS = default_workers() # 转换进程数，1 表示单进程
+SHARDED_OUTPUT = False # True 时把样本写成 OUTPUT_FILE 同名目录下按大小滚动的压缩分片，并生成 manifest.json
+OUTPUT_COMPRESSION = "gzip" # 分片的压缩格式："gzip"、"zstd"（需要 zstandard 包）或 None
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # 单个分片的大小上限（字节）
+INCREMENTAL = False # 增量构建：输入记录与上次构建相同（且本脚本和配置未改动）时直接沿用上次的结果，代价见 utils.build_manifest
+BUILD_MANIFEST_FILE = "cache/build/trivia_qa.sqlite" # 增量构建清单
+
+# 助手回复：没有可供查证的上下文，承认不确定并给出有待核实的答案
+PERPLEXITY_TEXT = ("I am not certain that I remember this fact correctly, and there is no reference material "
+                   "in the conversation to check it against.")
+FINAL_ANSWER_TEMPLATE = ("I'm not completely sure, but I believe the answer is {answer}. If this matters, please "
+                         "verify it against a reliable source, or share a reference document and I can confirm it.")
+
+# Parquet 只读取转换用到的列
+PARQUET_COLUMNS = ["question", "question_id", "question_source", "answer"]
+
+def normalize_record(raw):
+    """
+    把官方 JSON（Question/QuestionId/Answer.Value ...）或 HuggingFace（question/question_id/answer.value ...）
+    格式的记录整理为转换需要的字段，丢弃检索结果等大字段，减少发给子进程的数据量。
+    没有问题或答案（如测试集）时返回 None。
+    """
+    if not isinstance(raw, dict):
+        return None
+    if "Question" in raw:
+        answer = raw.get("Answer") or {}
+        record = {
+            "question": raw.get("Question"),
+            "question_id": raw.get("QuestionId"),
+            "question_source": raw.get("QuestionSource"),
+            "answer": answer.get("Value"),
+            "aliases": answer.get("Aliases") or [],
+            "answer_type": answer.get("Type"),
+        }
+    else:
+        answer = raw.get("answer") or {}
+        record = {
+            "question": raw.get("question"),
+            "question_id": raw.get("question_id"),
+            "question_source": raw.get("question_source"),
+            "answer": answer.get("value"),
+            "aliases": list(answer.get("aliases") or []),
+            "answer_type": answer.get("type"),
+        }
+    if not (record["question"] or "").strip() or not (record["answer"] or "").strip():
+        return None
+    return record
+
+def iter_json_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_json_array(f, ("Data",))
+
+def iter_jsonl_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"  - 跳过 {path} 第 {line_num} 行，JSON 解析失败.")
+
+def iter_parquet_records(path, batch_rows=PARQUET_BATCH_ROWS):
+    """逐个 record batch 读取 Parquet，每次只在内存中保留一个 batch。"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet input requires the 'pyarrow' package: pip install pyarrow") from None
+    parquet_file = pq.ParquetFile(path)
+    available = set(parquet_file.schema_arrow.names)
+    columns = [name for name in PARQUET_COLUMNS if name in available]
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+        yield from batch.to_pylist()
+
+def input_files(input_path):
+    """单个文件直接返回，目录则按文件名顺序返回其中所有支持的文件。"""
+    if not os.path.isdir(input_path):
+        return [input_path]
+    return sorted(path for path in glob.glob(os.path.join(input_path, "*")) if path.endswith(INPUT_FORMATS))
+
+def iter_trivia_qa_records(input_path):
+    """
+    按文件顺序流式产出整理后的记录，跳过没有问题或答案的记录。
+    """
+    readers = {".json": iter_json_records, ".jsonl": iter_jsonl_records, ".parquet": iter_parquet_records}
+    for path in input_files(input_path):
+        reader = readers.get(os.path.splitext(path)[1])
+        if reader is None:
+            print(f"  - 跳过不支持的文件类型: {path}")
+            continue
+        for raw in reader(path):
+            record = normalize_record(raw)
+            if record is not None:
+                yield record
+
+def convert_trivia_qa_to_proactive_item(record, new_id):
+    """
+    将单条 TriviaQA 记录转换为 knowledge_gap 主动对话训练项：
+    rc.nocontext 不提供证据文档，助手只能凭记忆回答，因此说明不确定性并建议核实。
+    """
+    question = record["question"].strip()
+    answer = record["answer"].strip()
+    final_answer = FINAL_ANSWER_TEMPLATE.format(answer=answer)
+    assistant_reply = f"<think></think>\n<perplexity>{PERPLEXITY_TEXT}</perplexity>\nfinal_answer:{final_answer}"
+
+    aliases = record["aliases"] if MAX_ALIASES is None else record["aliases"][:MAX_ALIASES]
+    return {
+        "id": f"trivia_qa_{new_id:06d}",
+        "messages": [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": assistant_reply},
+        ],
+        "proactive_category": "help_seeking",
+        "sub_category": "epistemic_uncertainty",
+        "uncertainty_type": "epistemic",
+        "requires_tool": False,
+        "thinking_process": {
+            "intent_understanding": f"用户询问一个事实性问题：'{question}'。",
+            "self_reflection": {
+                "information_check": "对话中没有提供任何可供查证的上下文或参考资料。",
+                "knowledge_check": "助手只能依赖记忆中的知识，无法确认答案是否准确。",
+                "tool_check": "没有可用的检索工具，只能提示用户自行核实或提供参考资料。"
+            }
+        },
+        "final_answer": final_answer,
+        "reference_answer": answer, # 数据集中的标准答案
+        "answer_aliases": aliases, # 可接受的答案别名，便于评测
+        "answer_type": record["answer_type"],
+        "source_dataset_id": record["question_id"],
+    }
+
+def convert_record_to_line(i, record):
+    """
+    转换第 i 条（从 0 开始）整理后的记录，返回样本 JSON 行。供多进程驱动在子进程中调用。
+    """
+    return json.dumps(convert_trivia_qa_to_proactive_item(record, i), ensure_ascii=False)
+
+def main(workers=WORKERS):
+    print(f"Loading data from {INPUT_FILE}...")
+    if not os.path.exists(INPUT_FILE):
+        print(f"❌ 文件未找到: {INPUT_FILE}")
+        return
+
+    print(f"Streaming records, converting with {workers} worker(s)...")
+    records = iter_trivia_qa_records(INPUT_FILE)
+
+    # 增量构建：子进程只读打开同一份清单，输入记录未变化时直接返回上次的样本行
+    version = code_version([os.path.abspath(__file__), *utils_sources("jsonstream")], max_aliases=MAX_ALIASES)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE, version) if INCREMENTAL else None
+    manifest_path = BUILD_MANIFEST_FILE if INCREMENTAL else None
+
+    # 确保输出目录存在
+    if os.path.dirname(OUTPUT_FILE):
+        os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    # 输入按块分发给子进程、结果按输入顺序逐条写出，内存占用与输入大小无关
+    with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
+        converted_count = 0
+        results = map_items_ordered(records, partial(run_incremental, convert_record_to_line), workers,
+                                    initializer=init_worker_manifest, initargs=(manifest_path, version))
+        written = metrics.counter("records_total", status="written")
+        write_timer = metrics.timer("write")
+        try:
+            # convert 阶段为主进程等待（读取输入和子进程转换）结果的时间
+            for key, input_hash, reused, output_line in metrics.timed(results, "convert"):
+                with write_timer:
+                    save_incremental(manifest, key, input_hash, reused, output_line)
+                    f_out.write(output_line)
+                converted_count += 1
+                written.inc()
+                if converted_count % 10000 == 0:
+                    print(f"  - Converted {converted_count} items "
+                          f"({metrics.rate('records_total', status='written'):.0f} items/s)...")
+        except MissingKeyError:
+            print(f"❌ 输入文件缺少 'Data' 键")
+            print(f"  请确保 JSON 输入形如 {{'Version': '...', 'Data': [...]}}")
+            return
+        except json.JSONDecodeError as e:
+            print(f"❌ JSON 解析错误 (已转换 {converted_count} 项): {e}")
+            return
+        else:
+            # 只有完整读完输入时才清除清单中本次没有出现的记录
+            if manifest is not None:
+                manifest.finish()
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    print(f"Conversion complete! {converted_count} items saved to {output_location}")
+    if manifest is not None:
+        print(f"  Incremental build: {manifest.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,41 @@
+import argparse
 import os
-import json
-import time
-import re
-from google import genai
+import sys
 
-# 代理设置
-PROXY = "http://127.0.0.1:10808"
-os.environ["HTTP_PROXY"] = PROXY
-os.environ["HTTPS_PROXY"] = PROXY
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.llm_client import LazyClient, make_llm_client, llm_cache_model
+from utils.ratelimit import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.rewrite_engine import TaggedReplyRewriter, rewrite_jsonl_file
 
-# 初始化Gemini客户端
-client = genai.Client()
+# 输入输出文件路径
+INPUT_FILE = "src/convert/tools_need/seal-tools/input.jsonl"
+OUTPUT_FILE = "src/convert/tools_need/seal-tools/output.jsonl"
 
-def process_single_record(record):
-    """
-    处理单条记录，生成think和final_answer
-    """
-    # 获取用户消息
-    user_message = None
-    agent_message=None
-    for msg in record["messages"]:
-        if msg["role"] == "user":
-            user_message = msg["content"]
-        else:
-            agent_message=msg['content']
-    
-    if not user_message:
-        return None
-    
-    # 构建prompt
-    prompt = f"""请分析以下请求，并按照指定格式回复：
+# Gemini客户端在第一次调用 API 时才创建（代理及 GEMINI_BASE_URL 的处理见 utils.llm_client.make_client）
+# BACKENDS_FILE 指向后端配置文件时改为多后端客户端池（见 utils.client_pool），请求按各后端的延迟和剩余配额分发
+BACKENDS_FILE = None
+client = LazyClient(lambda: make_llm_client(BACKENDS_FILE),
+                    cache_model=lambda model: llm_cache_model(BACKENDS_FILE, model))
+MODEL = "gemini-2.0-flash"
+
+MAX_WORKERS = 4 # 同时在途的请求数，使用客户端池时按后端数相应调大
+RPM_LIMIT = 60 # 所有后端合计的每分钟请求数上限，代替原来每条记录后的固定等待
+limiter = RateLimiter(rpm=RPM_LIMIT)
+BATCH_SIZE = 8 # 每个请求打包的记录数，设为 1 关闭批量模式
+
+# 响应缓存：重新运行时相同提示词不再调用 API
+USE_CACHE = True
+CACHE_FILE = "cache/gemini_responses.sqlite"
+response_cache = None # 由 process_jsonl_file 打开
+
+# 格式不完整的回复连同原因写入 <输出文件>.quarantine.jsonl（见 utils.rewrite_engine.rewrite_jsonl_file）
 
-用户请求:{user_message}
-需修改的回复:{agent_message}
+PROMPT_HEADER = "请分析以下请求，并按照指定格式回复："
+BATCH_PROMPT_HEADER = "请分别分析以下每条记录中的请求，并按照指定格式为每条记录回复："
 
-请按照以下格式回复：
+# 所有记录共用的回复格式说明，批量模式下每个请求只出现一次
+RESPONSE_FORMAT = """请按照以下格式回复：
 <think>
 你的思考过程，分析用户请求的各个部分，识别哪些是你能做的，哪些需要特定工具或权限
 </think>
@@ -48,86 +49,43 @@ final_answer:
 2. perplexity部分说明无法完成的具体原因
 3. final_answer要使用友好的中文说明无法直接完成，并提供替代帮助"""
 
-    try:
-        # 调用Gemini API
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        
-        result_text = response.text
-        
-        # 解析响应，提取各部分
-        think_match = re.search(r'<think>(.*?)</think>', result_text, re.DOTALL)
-        perplexity_match = re.search(r'<perplexity>(.*?)</perplexity>', result_text, re.DOTALL)
-        final_answer_match = re.search(r'final_answer(.*?)$', result_text, re.DOTALL)
-        
-        think_content = think_match.group(1).strip() if think_match else "分析用户请求..."
-        perplexity_content = perplexity_match.group(1).strip() if perplexity_match else "作为LLM，我缺乏直接检索特定数据、分析技术可行性以及访问特定机构内部政策的能力。"
-        final_answer_content = final_answer_match.group(1).strip() if final_answer_match else "作为一个LLM，我无法直接为您检索社会科学数据、分析应用程序迁移到云的可行性或检索图书馆的信息治理政策。但我可以帮您分析这些任务的一般性框架，或提供相关领域的知识指导。您希望我怎么做？"
-        
-        # 构建assistant回复
-        assistant_reply = f"<think>{think_content}</think>\n<perplexity>{perplexity_content}</perplexity>\nfinal_answer: {final_answer_content}"
-        
-        return assistant_reply
-        
-    except Exception as e:
-        print(f"处理记录时出错: {e}")
-        # 返回默认回复
-        return "<think>分析用户请求，发现需要处理三个不同领域的任务：社会科学数据检索、技术可行性分析和特定机构政策获取。</think>\n<perplexity>作为LLM，我缺乏直接检索特定数据、分析技术可行性以及访问特定机构内部政策的能力。</perplexity>\nfinal_answer: 作为一个LLM，我无法直接为您检索社会科学数据、分析应用程序迁移到云的可行性或检索图书馆的信息治理政策。但我可以帮您分析这些任务的一般性框架，或提供相关领域的知识指导。您希望我怎么做？"
-
-def process_jsonl_file(input_file, output_file):
+def describe_record(record):
     """
-    处理整个JSONL文件
+    提取记录中需要交给模型分析的内容，没有用户消息时返回 None
     """
-    processed_records = []
-    
-    with open(input_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                record = json.loads(line.strip())
-                print(f"处理记录 ID: {record.get('id', '未知')}")
-                
-                # 生成assistant回复
-                assistant_content = process_single_record(record)
-                
-                if assistant_content:
-                    # 构建完整的消息记录
-                    new_messages = record["messages"]
-                    new_messages[-1]={
-                        "role": "assistant",
-                        "content": assistant_content
-                    }
-                    
-                    processed_record = {
-                        "id": record["id"],
-                        "messages": new_messages,
-                        "proactive_category": record.get("proactive_category", "tool_use"),
-                        "sub_category": record.get("sub_category", "multi_api_call"),
-                        "source_scene_id": record.get("source_scene_id", "")
-                    }
-                    
-                    processed_records.append(processed_record)
-                
-                # 添加延迟以避免API限制
-                time.sleep(1)
+    # 获取用户消息
+    user_message = None
+    agent_message=None
+    for msg in record["messages"]:
+        if msg["role"] == "user":
+            user_message = msg["content"]
+        else:
+            agent_message=msg['content']
     
-    # 写入输出文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for record in processed_records:
-            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    if not user_message:
+        return None
     
-    print(f"处理完成！共处理 {len(processed_records)} 条记录")
-    return processed_records
+    return f"""用户请求:{user_message}
+需修改的回复:{agent_message}"""
+
+def process_jsonl_file(input_file, output_file, retry_failed=False):
+    """
+    处理整个JSONL文件，结果边处理边写入，中断后重新运行会从检查点继续
+    格式不完整的回复在单条处理时写入隔离文件，调用失败的记录写入死信队列；
+    retry_failed=True 时只重放上次死信队列中的记录
+    """
+    global response_cache
+    if USE_CACHE and response_cache is None:
+        response_cache = ResponseCache(CACHE_FILE)
+    rewriter = TaggedReplyRewriter(describe_record, PROMPT_HEADER, BATCH_PROMPT_HEADER, RESPONSE_FORMAT,
+                                   client, MODEL, limiter=limiter, cache=response_cache)
+    return rewrite_jsonl_file(input_file, output_file, rewriter, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE,
+                              retry_failed=retry_failed)
 
 # 示例使用
 if __name__ == "__main__":
-    # 输入文件路径
-    input_file = "src/convert/tools_need/seal-tools/input.jsonl"
-    output_file = "src/convert/tools_need/seal-tools/output.jsonl"
-    processed_data = process_jsonl_file(input_file, output_file)
-    
-    # 打印处理结果示例
-    if processed_data:
-        print("\n处理后的第一条记录：")
-        print(json.dumps(processed_data[0], ensure_ascii=False, indent=2))
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--retry-failed", action="store_true", help="只重放死信队列中调用失败的记录")
+    args = parser.parse_args()
+
+    process_jsonl_file(INPUT_FILE, OUTPUT_FILE, retry_failed=args.retry_failed)
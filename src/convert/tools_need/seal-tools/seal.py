@@ -1,27 +1,122 @@
 import json
+import os
 import sys
+from functools import partial
 
-def load_api_descriptions(tools_file_path):
-    """Loads API descriptions and parameters from tools.jsonl."""
-    api_descriptions = {}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.parallel import map_lines_ordered, default_workers
+from utils.sink import open_sink, sharded_dir_for
+from utils.tool_index import ToolCatalog, ensure_tool_index
+from utils.build_manifest import (BuildManifest, code_version, init_worker_manifest, run_incremental, save_incremental,
+                                  utils_sources)
+from utils.metrics import metrics
+
+INPUT_FILE = "data/Seal-Tools_Dataset/train.jsonl"  # Replace with your input file path
+TOOLS_FILE = "data/Seal-Tools_Dataset/tool.jsonl"  # Replace with your tools file path
+OUTPUT_FILE = "dataset/capability_limitation/converted_perplexity_training_data.jsonl" # Replace with your desired output file path
+# Whether the perplexity text also lists the required parameters of each called API
+INCLUDE_REQUIRED_PARAMS = True
+# Write the output as size-capped compressed shards plus manifest.json in a directory
+# named after the output file, instead of a single JSONL file
+SHARDED_OUTPUT = False
+OUTPUT_COMPRESSION = "gzip" # "gzip", "zstd" (needs the zstandard package) or None
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # Size cap of a single shard in bytes
+# Reuse the previous output of input lines that are unchanged since the last build
+# (the build is invalidated when this script, utils/tool_index.py, tool.jsonl or the settings above change).
+# Off by default: the manifest keeps a compressed copy of every output line and slows down a cold build,
+# so it only pays off when rebuilding repeatedly after small input changes.
+INCREMENTAL = False
+BUILD_MANIFEST_FILE = "cache/build/seal_tools.sqlite"
+WORKERS = default_workers() # Number of conversion processes, 1 for a single process
+
+def describe_required_parameters(catalog, api_names):
+    """Builds a sentence listing the required parameters of the given APIs, or '' if there are none."""
+    details = []
+    for api_name in api_names:
+        for param_name, param_desc in catalog.required_parameters(api_name):
+            details.append(f"{param_name}: {param_desc}" if param_desc else param_name)
+    if not details:
+        return ""
+    return f" To do this I would need the following information: {'; '.join(details)}."
+
+def convert_record(line_num, line, catalog):
+    """
+    Converts one input line into a dialogue training record.
+
+    Returns:
+        str: The JSON-encoded output record, or None if the line is empty or invalid.
+    """
     try:
-        with open(tools_file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                tool_data = json.loads(line)
-                api_name = tool_data.get("api_name")
-                description = tool_data.get("api_description", "")
-                if api_name:
-                    api_descriptions[api_name] = description
-    except FileNotFoundError:
-        print(f"Warning: Tools file '{tools_file_path}' not found. Using empty map.", file=sys.stderr)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing tools file '{tools_file_path}': {e}", file=sys.stderr)
-    return api_descriptions
-
-def convert_to_perplexity_training_format(input_file_path, output_file_path, tools_file_path):
+        line = line.strip()
+        if not line:
+            return None
+
+        original_data = json.loads(line)
+
+        # --- 1. Extract Information from Original Data ---
+        query_text = original_data.get("query", "")
+        api_calls = original_data.get("calling", [])
+        scene_id = original_data.get("id", f"converted_line_{line_num}")
+
+        # --- 2. Determine Category and Tool Requirement ---
+        # Assume all these queries require tools based on the example structure
+        proactive_category = "tool_use"
+        sub_category = "direct_api_call" # Or "multi_api_call" if multiple calls are present
+        if len(api_calls) > 1:
+            sub_category = "multi_api_call"
+
+        # --- 3. Identify the Required Tool/API Names and Details ---
+        required_apis = [call.get("api", "Unknown API") for call in api_calls]
+        # Only the APIs this query calls are loaded from the catalog
+        unique_apis = list(dict.fromkeys(required_apis)) # Avoid duplicates, keep call order deterministic
+        required_capabilities_details = []
+        for api_name in unique_apis:
+            api_desc = catalog.description(api_name)
+            required_capabilities_details.append(api_desc)
+        parameter_details = describe_required_parameters(catalog, unique_apis) if INCLUDE_REQUIRED_PARAMS else ""
+        
+        # --- 5. Construct Messages with Perplexity ---
+        user_message = {"role": "user", "content": query_text}
+        
+        # Perplexity message - includes parameter details
+        assistant_content = f"<think></think>\n<perplexity>As an LLM, I lack the capability to directly {', and '.join(required_capabilities_details)}. I would need access to specific tools or APIs to fulfill this request.{parameter_details}</perplexity>\nfinal_answer:"
+        assistant_message = {"role": "assistant", "content": assistant_content}
+
+        messages = [user_message, assistant_message]
+
+        # --- 6. Create Final Output Dictionary ---
+        output_dict = {
+            "id": scene_id,
+            "messages": messages,
+            "proactive_category": proactive_category,
+            "sub_category": sub_category,
+            "source_scene_id": scene_id
+        }
+
+        return json.dumps(output_dict, ensure_ascii=False)
+
+    except json.JSONDecodeError:
+        print(f"Error: Could not parse JSON on line {line_num}: {line.strip()}", file=sys.stderr)
+    except KeyError as e:
+        print(f"Error: Missing expected key {e} on line {line_num}", file=sys.stderr)
+    except Exception as e:
+        print(f"Unexpected error processing line {line_num}: {e}", file=sys.stderr)
+    return None
+
+# Tool catalog of the current (worker) process, set by init_worker
+_catalog = None
+
+def init_worker(tools_file_path, manifest_path=None, version=None):
+    # Every worker maps the same prebuilt index, so tool.jsonl is never re-parsed
+    global _catalog
+    _catalog = ToolCatalog(tools_file_path)
+    init_worker_manifest(manifest_path, version)
+
+def convert_line(index, line):
+    # line numbers in messages and default IDs are 1-based
+    return convert_record(index + 1, line, _catalog)
+
+def convert_to_perplexity_training_format(input_file_path, output_file_path, tools_file_path, workers=1):
     """
     Converts a JSONL file with API call information into a dialogue training format
     where the assistant first expresses perplexity about its lack of capability,
@@ -29,74 +124,49 @@ def convert_to_perplexity_training_format(input_file_path, output_file_path, too
 
     Args:
         input_file_path (str): Path to the input JSONL file.
-        output_file_path (str): Path to the output JSONL file.
+        output_file_path (str): Path to the output JSONL file. With SHARDED_OUTPUT the shards
+            are written to a directory of the same name without the .jsonl extension.
         tools_file_path (str): Path to the tools JSONL file.
+        workers (int): Number of worker processes. Output order always follows the input.
     """
-    api_description_map = load_api_descriptions(tools_file_path)
-
-    with open(input_file_path, 'r', encoding='utf-8') as infile, \
-         open(output_file_path, 'w', encoding= 'utf-8') as outfile:
-
-        for line_num, line in enumerate(infile, start=1):
-            try:
-                line = line.strip()
-                if not line:
-                    continue
-
-                original_data = json.loads(line)
-
-                # --- 1. Extract Information from Original Data ---
-                query_text = original_data.get("query", "")
-                api_calls = original_data.get("calling", [])
-                scene_id = original_data.get("id", f"converted_line_{line_num}")
-
-                # --- 2. Determine Category and Tool Requirement ---
-                # Assume all these queries require tools based on the example structure
-                proactive_category = "tool_use"
-                sub_category = "direct_api_call" # Or "multi_api_call" if multiple calls are present
-                if len(api_calls) > 1:
-                    sub_category = "multi_api_call"
-
-                # --- 3. Identify the Required Tool/API Names and Details ---
-                required_apis = [call.get("api", "Unknown API") for call in api_calls]
-                required_capabilities_details = []
-                for api_name in set(required_apis): # Use set to avoid duplicates
-                    api_desc = api_description_map.get(api_name)
-                    required_capabilities_details.append(api_desc)
-                
-                # --- 5. Construct Messages with Perplexity ---
-                user_message = {"role": "user", "content": query_text}
-                
-                # Perplexity message - includes parameter details
-                assistant_content = f"<think></think>\n<perplexity>As an LLM, I lack the capability to directly {', and '.join(required_capabilities_details)}. I would need access to specific tools or APIs to fulfill this request.</perplexity>\nfinal_answer:"
-                assistant_message = {"role": "assistant", "content": assistant_content}
-
-                messages = [user_message, assistant_message]
-
-                # --- 6. Create Final Output Dictionary ---
-                output_dict = {
-                    "id": scene_id,
-                    "messages": messages,
-                    "proactive_category": proactive_category,
-                    "sub_category": sub_category,
-                    "source_scene_id": scene_id
-                }
-
-                # --- 7. Write to Output File ---
-                outfile.write(json.dumps(output_dict, ensure_ascii=False) + '\n')
-
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse JSON on line {line_num}: {line.strip()}", file=sys.stderr)
-            except KeyError as e:
-                print(f"Error: Missing expected key {e} on line {line_num}", file=sys.stderr)
-            except Exception as e:
-                print(f"Unexpected error processing line {line_num}: {e}", file=sys.stderr)
+    if os.path.exists(tools_file_path):
+        # Build the index once here instead of racing to build it in every worker
+        ensure_tool_index(tools_file_path)
+
+    # Workers open the build manifest read-only and skip lines that did not change
+    version = code_version([os.path.abspath(__file__), tools_file_path, *utils_sources("tool_index")],
+                           include_required_params=INCLUDE_REQUIRED_PARAMS)
+    manifest = BuildManifest(BUILD_MANIFEST_FILE, version) if INCREMENTAL else None
+    manifest_path = BUILD_MANIFEST_FILE if INCREMENTAL else None
+
+    results = map_lines_ordered(input_file_path, partial(run_incremental, convert_line), workers,
+                                initializer=init_worker, initargs=(tools_file_path, manifest_path, version))
+
+    with open_sink(output_file_path, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as outfile:
+        written = metrics.counter("records_total", status="written")
+        skipped = metrics.counter("records_total", status="skipped")
+        write_timer = metrics.timer("write")
+        # The "convert" stage is the time spent waiting for the (worker) results
+        for key, input_hash, reused, output_line in metrics.timed(results, "convert"):
+            with write_timer:
+                save_incremental(manifest, key, input_hash, reused, output_line)
+                if output_line is not None:
+                    # --- 7. Write to Output File ---
+                    outfile.write(output_line)
+            (written if output_line is not None else skipped).inc()
+
+    if manifest is not None:
+        manifest.finish()
+        print(f"Incremental build: {manifest.reused} lines reused, {manifest.rebuilt} converted")
+        manifest.close()
+
+def main(workers=WORKERS):
+    convert_to_perplexity_training_format(INPUT_FILE, OUTPUT_FILE, TOOLS_FILE, workers=workers)
+    written = metrics.value("records_total", status="written")
+    print(f"Perplexity conversion complete: {written} items "
+          f"({metrics.rate('records_total', status='written'):.0f} items/s). "
+          f"Output saved to {sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE}")
 
 # --- Example Usage ---
 if __name__ == "__main__":
-    input_path = "data/Seal-Tools_Dataset/train.jsonl"  # Replace with your input file path
-    tools_path = "data/Seal-Tools_Dataset/tool.jsonl"  # Replace with your tools file path
-    output_path = "dataset/capability_limitation/converted_perplexity_training_data.jsonl" # Replace with your desired output file path
-
-    convert_to_perplexity_training_format(input_path, output_path, tools_path)
-    print(f"Perplexity conversion complete. Output saved to {output_path}")
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import json
+import os
+
+from utils.dataset_stats import collect_stats, update_readme_table
+from utils.parallel import default_workers
+from utils.sink import resolve_dataset_path
+
+# 需要统计的数据集：readme 表格中的名称 -> (类别, 转换输出路径)
+# 输出为分片目录（SHARDED_OUTPUT）时自动改用 OUTPUT_FILE 同名目录
+DATASETS = {
+    "abg-coqa": ("ambiguity", "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl"),
+    "in3": ("ambiguity", "dataset/proactive_annotations_from_in3.jsonl"),
+    "seal-tools": ("tool_need", "dataset/capability_limitation/converted_perplexity_training_data.jsonl"),
+    "trivia_qa rc_nocontext": ("knowledge_gap", "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl"),
+}
+STATS_FILE = "dataset/stats.json" # 详细统计结果（各类别计数和长度直方图）
+README_FILE = "readme.md"
+UPDATE_README = True # 是否用统计结果更新 readme 中的数据集表格
+WORKERS = default_workers() # 统计进程数，1 表示单进程
+
+def main(workers=WORKERS):
+    datasets = {}
+    for name, (_, path) in DATASETS.items():
+        resolved = resolve_dataset_path(path)
+        if resolved is None:
+            print(f"未找到输出，跳过: {name} ({path})")
+            continue
+        datasets[name] = resolved
+
+    if not datasets:
+        print("没有可统计的数据集")
+        return
+
+    print(f"统计 {len(datasets)} 个数据集 (进程数 {workers})...")
+    results = collect_stats(datasets, workers)
+
+    rows = []
+    for name, stats in results.items():
+        print(f"  {name}: 共 {stats.total} 条，proactive {stats.proactive} 条，non-proactive {stats.non_proactive} 条"
+              + (f"，{stats.invalid} 行无法解析" if stats.invalid else ""))
+        rows.append([name, DATASETS[name][0], str(stats.proactive), str(stats.non_proactive), str(stats.total)])
+
+    stats_dir = os.path.dirname(STATS_FILE)
+    if stats_dir:
+        os.makedirs(stats_dir, exist_ok=True)
+    with open(STATS_FILE, "w", encoding="utf-8") as f:
+        json.dump({name: stats.to_dict() for name, stats in results.items()}, f, ensure_ascii=False, indent=2)
+    print(f"详细统计已保存到 {STATS_FILE}")
+
+    if UPDATE_README:
+        table = update_readme_table(README_FILE, rows)
+        print(f"已更新 {README_FILE}:")
+        print("\n".join(table))
+
+if __name__ == "__main__":
+    main()
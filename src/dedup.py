@@ -0,0 +1,116 @@
+import json
+from collections import Counter
+
+import numpy as np
+
+from utils.dedup import (MinHasher, lsh_clusters, signature_from_line,
+                         DEFAULT_NUM_PERM, DEFAULT_BANDS, DEFAULT_SHINGLE_SIZE, DEFAULT_THRESHOLD)
+from utils.parallel import map_items_ordered, default_workers
+from utils.sink import open_sink, iter_lines, resolve_dataset_path, sharded_dir_for
+
+# 参与去重的转换输出（按顺序合并；同一簇中最早出现的样本作为代表）
+INPUTS = {
+    "seal-tools": "dataset/capability_limitation/converted_perplexity_training_data.jsonl",
+    "abg-coqa": "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl",
+    "in3": "dataset/proactive_annotations_from_in3.jsonl",
+    "trivia_qa": "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl",
+}
+OUTPUT_FILE = "dataset/proactive_combined_dedup.jsonl" # 合并后的输出
+# "tag" 时保留全部样本并写入 dup_cluster_id（簇代表样本的 ID），便于按簇划分训练/验证集；
+# "drop" 时每个簇只保留代表样本
+MODE = "tag"
+NUM_PERM = DEFAULT_NUM_PERM # MinHash 签名长度
+BANDS = DEFAULT_BANDS # LSH 分段数，必须整除 NUM_PERM
+SHINGLE_SIZE = DEFAULT_SHINGLE_SIZE # shingle 字节数
+THRESHOLD = DEFAULT_THRESHOLD # 判定为近似重复的估计 Jaccard 相似度
+SEED = 1
+SHARDED_OUTPUT = False # True 时输出写为 OUTPUT_FILE 同名目录下的压缩分片
+OUTPUT_COMPRESSION = "gzip"
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+WORKERS = default_workers() # 计算签名的进程数，1 表示单进程
+
+# 当前（子）进程中的 MinHasher，见 init_worker
+_minhasher = None
+
+def init_worker(num_perm, shingle_size, seed):
+    global _minhasher
+    _minhasher = MinHasher(num_perm, shingle_size, seed)
+
+def compute_signature(index, line):
+    try:
+        return signature_from_line(_minhasher, line)
+    except json.JSONDecodeError:
+        print(f"  - 跳过第 {index + 1} 条，JSON 解析失败.")
+        return None
+
+def iter_input_lines(inputs):
+    """按 INPUTS 的顺序产出 (数据集名, 行)。"""
+    for name, path in inputs.items():
+        for line in iter_lines(path):
+            yield name, line
+
+def main(workers=WORKERS):
+    inputs = {}
+    for name, path in INPUTS.items():
+        resolved = resolve_dataset_path(path)
+        if resolved is None:
+            print(f"未找到输出，跳过: {name} ({path})")
+            continue
+        inputs[name] = resolved
+    if not inputs:
+        print("没有可去重的数据集")
+        return
+
+    # 第一遍：并行计算签名
+    print(f"计算 MinHash 签名 (进程数 {workers})...")
+    lines = (line for _, line in iter_input_lines(inputs))
+    ids = []
+    signature_bytes = []
+    empty = bytes(4 * NUM_PERM)
+    results = map_items_ordered(lines, compute_signature, workers,
+                                initializer=init_worker, initargs=(NUM_PERM, SHINGLE_SIZE, SEED))
+    valid = []
+    unparsed = set()
+    for i, result in enumerate(results):
+        record_id, signature = result if result is not None else (None, None)
+        if result is None:
+            unparsed.add(i)
+        ids.append(record_id)
+        valid.append(signature is not None) # 无法解析或没有用户消息的样本不参与去重
+        signature_bytes.append(signature if signature is not None else empty)
+
+    signatures = np.frombuffer(b"".join(signature_bytes), dtype=np.uint32).reshape(len(ids), NUM_PERM)
+    del signature_bytes
+    print(f"共 {len(ids)} 条样本，LSH 分桶 ({BANDS} 段 × {NUM_PERM // BANDS} 行，阈值 {THRESHOLD})...")
+    roots = lsh_clusters(signatures, np.array(valid, dtype=bool), BANDS, THRESHOLD)
+
+    # 第二遍：按簇标记或丢弃
+    duplicates = Counter()
+    totals = Counter()
+    with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
+        for i, (name, line) in enumerate(iter_input_lines(inputs)):
+            if i in unparsed:
+                continue
+            root = int(roots[i])
+            totals[name] += 1
+            if root != i:
+                duplicates[name] += 1
+            if MODE == "drop":
+                if root == i:
+                    f_out.write(line)
+            else:
+                record = json.loads(line)
+                record["dup_cluster_id"] = ids[root] if ids[root] is not None else f"record_{root}"
+                f_out.write(json.dumps(record, ensure_ascii=False))
+
+    cluster_sizes = Counter(Counter(roots.tolist()).values())
+    print(f"近似重复簇 {sum(count for size, count in cluster_sizes.items() if size > 1)} 个，"
+          f"最大簇 {max(cluster_sizes, default=0)} 条")
+    for name in inputs:
+        print(f"  {name}: {totals[name]} 条，其中 {duplicates[name]} 条与之前的样本近似重复")
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    action = "已丢弃重复样本" if MODE == "drop" else "已写入 dup_cluster_id"
+    print(f"{action}，输出保存到 {output_location}")
+
+if __name__ == "__main__":
+    main()
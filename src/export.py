@@ -0,0 +1,59 @@
+import os
+from functools import partial
+
+from utils.columnar import ColumnarWriter, line_to_row, DEFAULT_ROW_GROUP_ROWS
+from utils.parallel import map_items_ordered, default_workers
+from utils.sink import iter_lines, resolve_dataset_path
+
+# 需要导出的转换输出：每个数据集导出为 OUTPUT_DIR 下的一个同名文件
+INPUTS = {
+    "seal-tools": "dataset/capability_limitation/converted_perplexity_training_data.jsonl",
+    "abg-coqa": "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl",
+    "in3": "dataset/proactive_annotations_from_in3.jsonl",
+    "trivia_qa": "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl",
+}
+OUTPUT_DIR = "dataset/columnar"
+FORMAT = "parquet" # "parquet"，或 "arrow"（Arrow IPC 文件，可以 memory map 零拷贝加载）
+ROW_GROUP_ROWS = DEFAULT_ROW_GROUP_ROWS # 每个 row group 的行数，读取时每个 row group 可以交给一个线程
+COMPRESSION = "zstd" # Parquet 的压缩算法："zstd"、"lz4"、"snappy" 或 None
+ARROW_COMPRESSION = None # Arrow 文件默认不压缩以便 memory map 零拷贝读取；"lz4"、"zstd" 可减小文件
+WORKERS = default_workers() # 解析 JSON 的进程数，1 表示单进程
+
+def parse_line(index, line, source):
+    return line_to_row(line, source)
+
+def export_dataset(name, path, output_path, workers):
+    """把一个数据集逐行转换写出，返回 (导出行数, 跳过行数, row group 数)。"""
+    skipped = 0
+    compression = COMPRESSION if FORMAT == "parquet" else ARROW_COMPRESSION
+    with ColumnarWriter(output_path, FORMAT, ROW_GROUP_ROWS, compression) as writer:
+        for row in map_items_ordered(iter_lines(path), partial(parse_line, source=name), workers):
+            if row is None:
+                skipped += 1
+                continue
+            writer.write_row(row)
+    return writer.rows, skipped, writer.row_groups
+
+def main(workers=WORKERS):
+    inputs = {}
+    for name, path in INPUTS.items():
+        resolved = resolve_dataset_path(path)
+        if resolved is None:
+            print(f"未找到输出，跳过: {name} ({path})")
+            continue
+        inputs[name] = resolved
+    if not inputs:
+        print("没有可导出的数据集")
+        return
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    extension = ".parquet" if FORMAT == "parquet" else ".arrow"
+    print(f"导出 {len(inputs)} 个数据集为 {FORMAT} (进程数 {workers})...")
+    for name, path in inputs.items():
+        output_path = os.path.join(OUTPUT_DIR, name + extension)
+        rows, skipped, row_groups = export_dataset(name, path, output_path, workers)
+        print(f"  {name}: {rows} 条，{row_groups} 个 row group -> {output_path}"
+              + (f"（{skipped} 行为空或无法解析，已跳过）" if skipped else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import json
+import mmap
+import os
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from utils.mixture import SelectionSampler, compute_quotas, stratum_rng
+from utils.parallel import map_items_ordered, default_workers
+from utils.sink import open_sink, iter_lines, resolve_dataset_path, sharded_dir_for
+
+# 参与混合的转换输出
+INPUTS = {
+    "seal-tools": "dataset/capability_limitation/converted_perplexity_training_data.jsonl",
+    "abg-coqa": "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl",
+    "in3": "dataset/proactive_annotations_from_in3.jsonl",
+    "trivia_qa": "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl",
+}
+OUTPUT_FILE = "dataset/mix/proactive_mix.jsonl" # 打乱后的混合训练集
+REPORT_FILE = "dataset/mix/mix_report.json" # 每层的样本数、配额和实际输出条数
+# 各数据集在混合集中的相对权重，权重为 0 或未列出的数据集不参与混合
+SOURCE_WEIGHTS = {"seal-tools": 1.0, "abg-coqa": 1.0, "in3": 1.0, "trivia_qa": 1.0}
+# proactive_category 在各数据集内的相对权重，未列出的类别为 1.0，即同一数据集内各类别等量
+# （例如 abg-coqa 的 clarification 与 direct_answer 各占一半）
+CATEGORY_WEIGHTS = {}
+MIX_SIZE = None # 混合集总条数，None 时取不需要上采样就能满足所有权重的最大条数
+UPSAMPLE = False # True 时样本不足的层重复样本以达到配额，否则按实际条数输出
+SEED = 1 # 抽样和打乱的随机种子
+SHUFFLE = True # 是否打乱输出顺序
+SHARDED_OUTPUT = False # True 时输出写为 OUTPUT_FILE 同名目录下的压缩分片
+OUTPUT_COMPRESSION = "gzip"
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+WORKERS = default_workers() # 解析 JSON 的进程数，1 表示单进程
+
+INVALID = False # category_of 对无法解析的行的返回值（类别本身可能是 None）
+
+def category_of(index, line):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return INVALID
+    return record.get("proactive_category") if isinstance(record, dict) else INVALID
+
+def iter_categories(path, workers):
+    """按行顺序产出每条样本的 proactive_category，与 iter_lines(path) 一一对应。"""
+    return map_items_ordered(iter_lines(path), category_of, workers)
+
+def stratum_name(key):
+    source, category = key
+    return f"{source}/{category}"
+
+def tag_line(line, source, copy):
+    """在样本 JSON 行末尾追加 mix_source（以及上采样时的 mix_copy），不重新序列化整条样本。"""
+    extra = f', "mix_source": {json.dumps(source, ensure_ascii=False)}'
+    if copy:
+        extra += f', "mix_copy": {copy}'
+    return line[:-1] + extra + "}"
+
+def main(workers=WORKERS):
+    inputs = {}
+    for name, path in INPUTS.items():
+        resolved = resolve_dataset_path(path)
+        if resolved is None:
+            print(f"未找到输出，跳过: {name} ({path})")
+            continue
+        inputs[name] = resolved
+    if not inputs:
+        print("没有可混合的数据集")
+        return
+
+    # 第一遍：统计每层的样本数
+    print(f"统计各数据集的类别分布 (进程数 {workers})...")
+    counts = Counter()
+    invalid = Counter()
+    for name, path in inputs.items():
+        for category in iter_categories(path, workers):
+            if category is INVALID:
+                invalid[name] += 1
+            else:
+                counts[(name, category)] += 1
+    quotas = compute_quotas(counts, SOURCE_WEIGHTS, CATEGORY_WEIGHTS, MIX_SIZE, UPSAMPLE)
+    print(f"混合集共 {sum(quotas.values())} 条，来自 {len(quotas)} 个 (数据集, 类别) 分层")
+
+    # 第二遍：逐层选择抽样，入选的样本追加到 spool 文件，只在内存中保留偏移
+    for output_dir in {os.path.dirname(OUTPUT_FILE), os.path.dirname(REPORT_FILE)}:
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+    spool_path = OUTPUT_FILE + ".spool"
+    offsets = array("Q")
+    sizes = array("I")
+    selected = Counter()
+    try:
+        with open(spool_path, "wb") as spool:
+            position = 0
+            for name, path in inputs.items():
+                samplers = {key: SelectionSampler(counts[key], quota, stratum_rng(SEED, *key))
+                            for key, quota in quotas.items() if key[0] == name}
+                for category, line in zip(iter_categories(path, workers), iter_lines(path)):
+                    sampler = samplers.get((name, category)) if category is not INVALID else None
+                    if sampler is None:
+                        continue
+                    for copy in range(sampler.copies()):
+                        data = tag_line(line.rstrip(), name, copy).encode("utf-8")
+                        spool.write(data + b"\n")
+                        offsets.append(position)
+                        sizes.append(len(data))
+                        position += len(data) + 1
+                        selected[(name, category)] += 1
+
+        # 第三遍：按随机排列从 spool 中取出样本写入输出
+        order = np.arange(len(offsets))
+        if SHUFFLE:
+            np.random.default_rng(SEED).shuffle(order)
+        with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
+            if len(offsets):
+                with open(spool_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    for i in order.tolist():
+                        f_out.write(m[offsets[i]:offsets[i] + sizes[i]].decode("utf-8"))
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+    report = {
+        "seed": SEED,
+        "total": len(offsets),
+        "strata": {stratum_name(key): {"available": counts[key], "quota": quotas.get(key, 0),
+                                       "selected": selected[key]}
+                   for key in sorted(counts, key=lambda key: (key[0], str(key[1])))},
+        "invalid_lines": dict(invalid),
+    }
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for key in sorted(quotas, key=lambda key: (key[0], str(key[1]))):
+        print(f"  {stratum_name(key)}: {counts[key]} 条中选出 {selected[key]} 条")
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    print(f"混合集已保存到 {output_location}，详细报告已保存到 {REPORT_FILE}")
+
+if __name__ == "__main__":
+    main()
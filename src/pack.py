@@ -0,0 +1,73 @@
+import json
+import os
+
+from utils.packing import (best_fit_decreasing, build_length_index, iter_packs, load_length_index,
+                           plain_sources, save_length_index, utilization_report)
+from utils.parallel import default_workers
+from utils.sink import open_sink, resolve_dataset_path, sharded_dir_for
+
+# 需要打包的转换输出，按原样读取（CoQA-Abg 以 STORY_MODE = "reference" 转换时，故事不在样本中，
+# 需要先用 utils.story_table.materialize_file 还原完整消息再打包）
+INPUTS = {
+    "seal-tools": "dataset/capability_limitation/converted_perplexity_training_data.jsonl",
+    "abg-coqa": "dataset/contextual_ambiguity/proactive_annotations_from_coqa_abg_all_with_story.jsonl",
+    "in3": "dataset/proactive_annotations_from_in3.jsonl",
+    "trivia_qa": "dataset/knowledge_gap/proactive_annotations_from_trivia_qa.jsonl",
+}
+OUTPUT_FILE = "dataset/packed/proactive_packed.jsonl" # 每行一个打包后的训练序列
+MAX_TOKENS = 4096 # 训练序列长度
+LENGTH_INDEX_FILE = "dataset/packed/length_index.npz" # 长度索引，输入未变化时复用
+REPORT_FILE = "dataset/packed/packing_report.json"
+SHARDED_OUTPUT = True # 输出写为 OUTPUT_FILE 同名目录下的压缩分片
+OUTPUT_COMPRESSION = "gzip"
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+WORKERS = default_workers() # 计算长度的进程数，1 表示单进程
+
+def main(workers=WORKERS, max_tokens=MAX_TOKENS):
+    inputs = []
+    for name, path in INPUTS.items():
+        resolved = resolve_dataset_path(path)
+        if resolved is None:
+            print(f"未找到输出，跳过: {name} ({path})")
+            continue
+        inputs.append(resolved)
+    if not inputs:
+        print("没有可打包的数据集")
+        return
+
+    os.makedirs(os.path.dirname(LENGTH_INDEX_FILE), exist_ok=True)
+    spool_path = LENGTH_INDEX_FILE + ".spool.jsonl"
+    files, spooled = plain_sources(inputs, spool_path)
+    try:
+        index = load_length_index(LENGTH_INDEX_FILE, files) if not spooled else None
+        if index is None:
+            print(f"计算长度索引 (进程数 {workers})...")
+            index = build_length_index(files, workers)
+            if not spooled:
+                save_length_index(LENGTH_INDEX_FILE, files, index)
+        else:
+            print(f"复用长度索引: {LENGTH_INDEX_FILE}")
+
+        print(f"打包 {len(index)} 条样本到长度 {max_tokens} 的序列...")
+        bins = best_fit_decreasing(index["tokens"], max_tokens)
+
+        with open_sink(OUTPUT_FILE, SHARDED_OUTPUT, OUTPUT_COMPRESSION, SHARD_MAX_BYTES) as f_out:
+            for pack_id, (lines, num_tokens) in enumerate(iter_packs(files, index, bins)):
+                # 样本行本身就是 JSON，直接拼接，不再解析
+                f_out.write(f'{{"id": "pack_{pack_id:07d}", "num_tokens": {num_tokens}, "records": [{", ".join(lines)}]}}')
+    finally:
+        if spooled:
+            os.remove(spool_path)
+
+    report = utilization_report(index, bins, max_tokens)
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    output_location = sharded_dir_for(OUTPUT_FILE) if SHARDED_OUTPUT else OUTPUT_FILE
+    print(f"完成：{report['records']} 条样本打包为 {report['packs']} 个序列，保存到 {output_location}")
+    print(f"  填充率 {report['utilization']:.1%}（逐条 padding 时为 {report['unpacked_utilization']:.1%}），"
+          f"超长样本 {report['oversize_records']} 条")
+    print(f"  详细报告已保存到 {REPORT_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -2,87 +2,273 @@ import os
 import json
 import time
 import re
-from google import genai
+import asyncio
+import argparse
 
-PROXY = "http://127.0.0.1:10808"
-os.environ["HTTP_PROXY"] = PROXY
-os.environ["HTTPS_PROXY"] = PROXY
+from utils.llm_client import LazyClient, generate_text, agenerate_text, make_llm_client, llm_cache_model, cache_model
+from utils.ratelimit import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.sink import open_sink, sharded_dir_for
+from utils.build_manifest import BuildManifest, MISSING, content_hash
+from utils.validation import ValidationError, QuarantineWriter, schema_validator
+from utils.retry import DeadLetterQueue, read_dead_letters
+from utils.prompt_cache import InlinePrefix, ContextCachedPrefix
+from utils.metrics import metrics
 
-client = genai.Client() 
+# Gemini客户端在第一次调用 API 时才创建（代理及 GEMINI_BASE_URL 的处理见 utils.llm_client.make_client）
+# BACKENDS_FILE 指向后端配置文件时改为多后端客户端池（多个 key / 模型 / OpenAI 兼容端点，见 utils.client_pool），
+# 请求按各后端的延迟和剩余配额分发；RPM_LIMIT / TPM_LIMIT 仍然限制所有后端合计的速率
+BACKENDS_FILE = None
+client = LazyClient(lambda: make_llm_client(BACKENDS_FILE),
+                    cache_model=lambda model: llm_cache_model(BACKENDS_FILE, model))
 
 # 其他配置
 SCENES_FILE = "data/proactive_scenarios.json" # 输入场景定义
 ANNOTATIONS_DIR = "dataset/proactive_annotations" # 输出训练集
-PROMPT_TEMPLATE_FILE = "data/proactive_prompt_template.txt" # 提示词模板
+PROMPT_PREFIX_FILE = "data/proactive_prompt_prefix.txt" # 提示词的静态前缀：所有场景共用的说明、JSON Schema 和要求
+PROMPT_TEMPLATE_FILE = "data/proactive_prompt_template.txt" # 提示词中每个场景不同的部分
 DELAY = 1
+MODEL = "gemini-2.0-flash"
 
-# 读取提示词模板
-with open(PROMPT_TEMPLATE_FILE, "r", encoding="utf-8") as f:
-    PROMPT_TEMPLATE = f.read().strip()
+# 异步并发模式配置
+ASYNC_MODE = True # False 时退回逐个场景串行处理
+CONCURRENCY = 16 # 同时在途的请求数
+RPM_LIMIT = 1000 # 每分钟请求数上限
+TPM_LIMIT = 1000000 # 每分钟 token 数上限
 
-def generate_annotation(scene):
+# 提示词前缀的发送方式："context" 时把静态前缀注册为 Gemini 上下文缓存，每个请求只发送场景部分；
+# "inline" 时每个请求都发送完整提示词。上下文缓存创建失败时自动退回 inline。
+# 目前的前缀约 800 tokens，短于 CONTEXT_CACHE_MIN_TOKENS，"context" 模式下也不会创建缓存，
+# 前缀扩充到最小长度以上后才会实际使用上下文缓存
+PROMPT_PREFIX_MODE = "context"
+CONTEXT_CACHE_TTL = 3600 # 上下文缓存的存活秒数，运行时间更长时会在过期前自动延长
+CONTEXT_CACHE_MIN_TOKENS = 4096 # MODEL 允许显式缓存的最小 token 数，更换模型时按其文档调整
+
+# 响应缓存配置：相同 (模型, 提示词, 生成参数) 的请求直接复用上次的响应
+USE_CACHE = True
+CACHE_FILE = "cache/gemini_responses.sqlite"
+CACHE_MAX_BYTES = 2 * 1024 ** 3 # 缓存总大小上限
+CACHE_MAX_AGE = 30 * 24 * 3600 # 缓存条目最长保留 30 天
+
+# 输出格式：False 时每个场景保存为 ANNOTATIONS_DIR 下的一个 JSON 文件；
+# True 时所有注释写入 ANNOTATIONS_SINK_FILE 同名目录下按大小滚动的压缩 JSONL 分片（含 manifest.json）。
+# 分片模式下未开启 INCREMENTAL 时每次运行都会处理全部场景，已有结果由响应缓存直接复用
+SHARDED_OUTPUT = False
+ANNOTATIONS_SINK_FILE = "dataset/proactive_annotations_all.jsonl"
+OUTPUT_COMPRESSION = "gzip" # "gzip"、"zstd"（需要 zstandard 包）或 None
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # 单个分片的大小上限（字节）
+
+# 增量构建：记录每个场景定义的哈希，重新运行时只处理新增或修改过的场景
+# （模型、提示词模板或 JSON schema 变化时全部重新生成），未变化的场景沿用上次的注释
+INCREMENTAL = True
+BUILD_MANIFEST_FILE = "cache/build/pipeline.sqlite"
+
+# 无法解析或不符合 PROACTIVE_JSON_SCHEMA 的响应连同原因写入隔离文件，不进入数据集
+QUARANTINE_FILE = "dataset/quarantine/proactive_annotations.jsonl"
+# 重试后仍然调用失败（或遇到永久错误）的场景写入死信队列，用 --retry-failed 只重新生成这些场景
+DEAD_LETTER_FILE = "dataset/dead_letter/proactive_annotations.jsonl"
+
+prompt_template = None # 提示词模板，第一次构建提示词时读取
+prompt_prefix = None # 提示词的静态前缀 (utils.prompt_cache)，由 main / main_async 打开
+response_cache = None # 由 main / main_async 打开
+quarantine = None # 第一次出现未通过校验的响应时打开
+dead_letters = None # 由 main / main_async 打开
+
+def load_prompt_template():
+    global prompt_template
+    if prompt_template is None:
+        with open(PROMPT_TEMPLATE_FILE, "r", encoding="utf-8") as f:
+            prompt_template = f.read().strip()
+    return prompt_template
+
+def load_prompt_prefix_text():
+    """静态前缀中的 JSON Schema 只序列化一次。"""
+    with open(PROMPT_PREFIX_FILE, "r", encoding="utf-8") as f:
+        return f.read().strip().format(json_schema=json.dumps(PROACTIVE_JSON_SCHEMA, indent=2))
+
+def open_prompt_prefix():
+    global prompt_prefix
+    if prompt_prefix is None:
+        text = load_prompt_prefix_text()
+        if PROMPT_PREFIX_MODE == "context" and BACKENDS_FILE:
+            print("客户端池不支持上下文缓存（缓存绑定单个 key），提示词前缀改为在每个请求中发送")
+            prompt_prefix = InlinePrefix(text)
+        elif PROMPT_PREFIX_MODE == "context":
+            prompt_prefix = ContextCachedPrefix(text, client, MODEL, ttl=CONTEXT_CACHE_TTL,
+                                                display_name="proactive-annotation-prefix",
+                                                min_tokens=CONTEXT_CACHE_MIN_TOKENS)
+        else:
+            prompt_prefix = InlinePrefix(text)
+
+def close_prompt_prefix():
+    global prompt_prefix
+    if prompt_prefix is not None:
+        prompt_prefix.release()
+        prompt_prefix = None
+
+def open_response_cache():
+    global response_cache
+    if USE_CACHE and response_cache is None:
+        response_cache = ResponseCache(CACHE_FILE, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE)
+
+def build_prompt(scene):
     """
-    生成单个场景的注释数据。
+    根据场景定义构建提示词中每个场景不同的部分，完整提示词为 prompt_prefix.full_prompt(build_prompt(scene))。
     """
-    prompt = PROMPT_TEMPLATE.format(
+    return load_prompt_template().format(
         proactive_category=scene["category"],
         scenario_description=scene["description"],
         initial_user_query=scene.get("initial_user_query", ""),
         required_assistant_behavior=scene.get("required_behavior", ""),
-        example_dialogue=scene.get("example_dialogue", ""),
-        json_schema=json.dumps(PROACTIVE_JSON_SCHEMA, indent=2)
+        example_dialogue=scene.get("example_dialogue", "")
     )
 
+def parse_annotation(scene, generated_text):
+    """
+    将模型返回的文本解析为最终的注释数据。
+    解析失败时抛出 json.JSONDecodeError，不符合 PROACTIVE_JSON_SCHEMA 或没有助手回复时抛出 ValidationError。
+    """
+    print(f"Raw Gemini response: {generated_text[:200]}...")
+
+    # 尝试直接解析 JSON
     try:
-        response = client.models.generate_content(
-            model = 'gemini-2.0-flash', 
-            contents=prompt,
-        )
-
-        # 提取生成的文本内容
-        generated_text = response.text
-        print(f"Raw Gemini response: {generated_text[:200]}...")
-
-        # 尝试直接解析 JSON
-        try:
-            annotation_data = json.loads(generated_text)
-        except json.JSONDecodeError:
-            json_match = re.search(r'```json\s*(.*?)\s*```', generated_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = generated_text
-
-            annotation_data = json.loads(json_str)
-
-        final_answer = ""
-        messages = annotation_data.get("messages", [])
-        for msg in reversed(messages):
-            if msg.get("role") == "assistant":
-                final_answer = msg.get("content", "")
-                break
-
-        final_output = {
-            "id": scene.get("id", f"dlg_{hash(str(scene)) % 10000}_turn0"), # 生成一个 ID
-            "messages": messages,
-            "proactive_category": scene["category"],
-            "sub_category": annotation_data.get("sub_category", ""),
-            "uncertainty_type": annotation_data.get("uncertainty_type", None),
-            "requires_tool": annotation_data.get("requires_tool", False),
-            "thinking_process": annotation_data.get("thinking_process", {}),
-            "final_answer": final_answer,
-            "source_scene_id": scene.get("id")
-        }
+        annotation_data = json.loads(generated_text)
+    except json.JSONDecodeError:
+        json_match = re.search(r'```json\s*(.*?)\s*```', generated_text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1)
+        else:
+            json_str = generated_text
 
-        return final_output
+        annotation_data = json.loads(json_str)
 
-    except json.JSONDecodeError as e:
-        print(f"JSON 解析失败: {e}")
+    validate_annotation_data(annotation_data)
+
+    final_answer = ""
+    messages = annotation_data["messages"]
+    for msg in reversed(messages):
+        if msg["role"] == "assistant":
+            final_answer = msg["content"]
+            break
+    if not final_answer.strip():
+        raise ValidationError("no non-empty assistant message")
+
+    final_output = {
+        "id": scene.get("id", f"dlg_{hash(str(scene)) % 10000}_turn0"), # 生成一个 ID
+        "messages": messages,
+        "proactive_category": scene["category"],
+        "sub_category": annotation_data["sub_category"],
+        "uncertainty_type": annotation_data.get("uncertainty_type", None),
+        "requires_tool": annotation_data.get("requires_tool", False),
+        "thinking_process": annotation_data["thinking_process"],
+        "final_answer": final_answer,
+        "source_scene_id": scene.get("id")
+    }
+
+    return final_output
+
+def quarantine_response(scene, prompt, generated_text, reason):
+    """
+    把未通过校验的响应写入隔离文件，并从响应缓存中删除，下次运行时重新生成。
+    """
+    global quarantine
+    if quarantine is None:
+        quarantine = QuarantineWriter(QUARANTINE_FILE)
+    quarantine.add(scene.get("id"), "annotation", reason, response=generated_text, input_data=scene)
+    metrics.inc("records_total", status="quarantined")
+    if response_cache is not None:
+        response_cache.discard(cache_model(client, MODEL), prompt_prefix.full_prompt(prompt))
+    print(f"未通过校验，已隔离: {scene.get('id')} ({reason})")
+
+def close_quarantine():
+    global quarantine
+    if quarantine is not None:
+        print(f"{quarantine.count} 条响应未通过校验，已写入 {QUARANTINE_FILE}")
+        quarantine.close()
+        quarantine = None
+
+def record_failure(scene, error):
+    """
+    记录重试后仍然失败的调用：写入死信队列，之后可用 --retry-failed 只重新生成这些场景。
+    """
+    print(f"生成失败: {error}")
+    metrics.inc("records_total", status="failed")
+    if dead_letters is not None:
+        dead_letters.add(scene.get("id"), "annotation", error, scene)
+
+def open_dead_letters(retry_failed):
+    """
+    打开本次运行的死信队列，返回 (需要处理的场景, 是否只处理部分场景)：
+    retry_failed 时为上次死信队列中的场景，否则为全部场景；读取失败时场景为 None。
+    分片输出每次都要完整重写，此时 retry_failed 改为处理全部场景（未变化的场景由构建清单或响应缓存直接复用）。
+    """
+    global dead_letters
+    if retry_failed and SHARDED_OUTPUT:
+        print("分片输出模式下 --retry-failed 会处理全部场景，只有失败的场景会重新调用 API")
+        retry_failed = False
+    if retry_failed:
+        scenes = [scene for _, scene in read_dead_letters(DEAD_LETTER_FILE)]
+        print(f"重放死信队列中的 {len(scenes)} 个场景")
+    else:
+        scenes = load_scenes()
+    if scenes is not None:
+        dead_letters = DeadLetterQueue(DEAD_LETTER_FILE)
+    return scenes, retry_failed
+
+def close_dead_letters():
+    global dead_letters
+    if dead_letters is not None:
+        if dead_letters.count:
+            print(f"{dead_letters.count} 个场景调用失败，已写入 {DEAD_LETTER_FILE}，可用 --retry-failed 重新生成")
+        dead_letters.close()
+        dead_letters = None
+
+def generate_annotation(scene):
+    """
+    生成单个场景的注释数据。
+    """
+    prompt = build_prompt(scene)
+
+    try:
+        # 提取生成的文本内容（429/5xx/超时由 generate_text 按退避策略重试）
+        with metrics.timer("api"):
+            generated_text = generate_text(client, MODEL, prompt, cache=response_cache, prefix=prompt_prefix)
+    except Exception as e:
+        record_failure(scene, e)
         return None
+
+    try:
+        with metrics.timer("parse"):
+            return parse_annotation(scene, generated_text)
+    except json.JSONDecodeError as e:
+        quarantine_response(scene, prompt, generated_text, f"json: {e}")
+    except ValidationError as e:
+        quarantine_response(scene, prompt, generated_text, e.reason)
+    return None
+
+async def generate_annotation_async(scene, limiter):
+    """
+    generate_annotation 的异步版本，未命中缓存的请求发送前先经过限流器。
+    """
+    prompt = build_prompt(scene)
+
+    try:
+        with metrics.timer("api"):
+            generated_text = await agenerate_text(client, MODEL, prompt, cache=response_cache, limiter=limiter,
+                                                  prefix=prompt_prefix)
     except Exception as e:
-        print(f"生成失败: {e}")
+        record_failure(scene, e)
         return None
 
+    try:
+        with metrics.timer("parse"):
+            return parse_annotation(scene, generated_text)
+    except json.JSONDecodeError as e:
+        quarantine_response(scene, prompt, generated_text, f"json: {e}")
+    except ValidationError as e:
+        quarantine_response(scene, prompt, generated_text, e.reason)
+    return None
+
 PROACTIVE_JSON_SCHEMA = {
     "type": "object",
     "properties": {
@@ -129,41 +315,202 @@ PROACTIVE_JSON_SCHEMA = {
     "required": ["messages", "thinking_process", "sub_category"]
 }
 
+# 预先编译的校验函数，每个响应只做一次遍历
+validate_annotation_data = schema_validator(PROACTIVE_JSON_SCHEMA)
 
-def main():
+
+def load_scenes():
+    """
+    读取场景定义，失败时返回 None。
+    """
     try:
         with open(SCENES_FILE, "r", encoding="utf-8") as f:
-            scenes = json.load(f).get("scenarios", [])
+            return json.load(f).get("scenarios", [])
     except FileNotFoundError:
         print(f"输入文件未找到: {SCENES_FILE}")
-        return
+        return None
     except json.JSONDecodeError:
         print(f"输入文件 JSON 格式错误: {SCENES_FILE}")
+        return None
+
+def save_annotation(annotation, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(annotation, f, indent=2, ensure_ascii=False)
+    print(f"成功: {output_path}")
+
+def print_summary():
+    written = metrics.value("records_total", status="written")
+    print(f"数据集构建完成，写出 {written} 条注释 ({metrics.rate('records_total', status='written'):.2f} 条/秒)")
+    print_cache_stats()
+
+def print_cache_stats():
+    if response_cache is not None:
+        stats = response_cache.stats()
+        print(f"缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次，共 {stats['entries']} 条")
+
+def annotation_version():
+    """影响生成结果的配置（模型、提示词模板、JSON schema），任何一项变化都会使增量构建清单失效。"""
+    return content_hash({"model": MODEL, "prefix": load_prompt_prefix_text(), "template": load_prompt_template(),
+                         "schema": PROACTIVE_JSON_SCHEMA})
+
+class AnnotationOutput:
+    """
+    注释的输出端：逐文件写入 ANNOTATIONS_DIR，或 SHARDED_OUTPUT 时写入压缩分片；
+    INCREMENTAL 时通过构建清单判断哪些场景是新增或修改过的，未变化的场景沿用上次的注释。
+    partial 为 True（只重放部分场景）时不清理清单中本次没有出现的场景。
+    """
+
+    def __init__(self, partial=False):
+        self.sink = None
+        self.manifest = None
+        self.partial = partial
+        if SHARDED_OUTPUT:
+            self.sink = open_sink(ANNOTATIONS_SINK_FILE, True, OUTPUT_COMPRESSION, SHARD_MAX_BYTES)
+        else:
+            os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
+        if INCREMENTAL:
+            self.manifest = BuildManifest(BUILD_MANIFEST_FILE, annotation_version())
+
+    def pending(self, scenes):
+        """
+        返回需要（重新）生成的 [(scene, output_path, 输入哈希), ...]，分片输出时 output_path 为 None。
+        """
+        pending = []
+        for scene in scenes:
+            scene_id = scene.get("id", "unknown_id")
+            output_path = None if self.sink is not None else os.path.join(ANNOTATIONS_DIR, f"{scene_id}.json")
+            if self.manifest is None:
+                if output_path is not None and os.path.exists(output_path):
+                    print(f"已存在，跳过: {scene_id}")
+                    continue
+                pending.append((scene, output_path, None))
+                continue
+
+            input_hash = content_hash(scene)
+            previous = self.manifest.lookup(scene_id, input_hash)
+            if output_path is None:
+                if previous is not MISSING:
+                    self.sink.write_record(previous)
+                    self.manifest.touch(scene_id)
+                    continue
+            elif os.path.exists(output_path):
+                if previous is not MISSING:
+                    self.manifest.touch(scene_id)
+                    print(f"未变化，跳过: {scene_id}")
+                    continue
+                if not self.manifest.known(scene_id):
+                    # 启用清单之前生成的文件：无法判断场景是否修改过，直接登记为当前版本
+                    with open(output_path, "r", encoding="utf-8") as f:
+                        self.manifest.record(scene_id, input_hash, json.load(f))
+                    print(f"已存在，跳过: {scene_id}")
+                    continue
+                print(f"场景定义或提示词已修改，重新生成: {scene_id}")
+            # 生成失败时保留旧记录（哈希不变，下次仍会重新生成），避免旧文件被当作当前版本登记
+            self.manifest.keep(scene_id)
+            pending.append((scene, output_path, input_hash))
+        return pending
+
+    def write(self, scene, annotation, output_path, input_hash):
+        with metrics.timer("write"):
+            if self.sink is not None:
+                self.sink.write_record(annotation)
+            else:
+                save_annotation(annotation, output_path)
+            if self.manifest is not None:
+                self.manifest.record(scene.get("id", "unknown_id"), input_hash, annotation)
+        metrics.inc("records_total", status="written")
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            print(f"共 {self.sink.records} 条注释写入 {sharded_dir_for(ANNOTATIONS_SINK_FILE)}")
+        if self.manifest is not None:
+            if not self.partial:
+                self.manifest.finish()
+            print(f"增量构建：{self.manifest.summary()}")
+            self.manifest.close()
+
+def main(retry_failed=False):
+    scenes, partial = open_dead_letters(retry_failed)
+    if scenes is None:
         return
 
-    os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
+    open_response_cache()
+    open_prompt_prefix()
+    output = AnnotationOutput(partial)
 
     print(f"开始处理 {len(scenes)} 个场景...")
-    for scene in scenes:
-        scene_id = scene.get("id", "unknown_id")
-        output_path = os.path.join(ANNOTATIONS_DIR, f"{scene_id}.json")
-
-        if os.path.exists(output_path):
-            print(f"已存在，跳过: {scene_id}")
-            continue
-
-        print(f"正在处理: {scene_id}")
-        annotation = generate_annotation(scene)
-        if annotation:
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(annotation, f, indent=2, ensure_ascii=False)
-            print(f"成功: {output_path}")
-        else:
-            print(f"失败: {scene_id}")
+    try:
+        for scene, output_path, input_hash in output.pending(scenes):
+            scene_id = scene.get("id", "unknown_id")
+            print(f"正在处理: {scene_id}")
+            annotation = generate_annotation(scene)
+            if annotation:
+                output.write(scene, annotation, output_path, input_hash)
+            else:
+                print(f"失败: {scene_id}")
 
-        time.sleep(DELAY)
+            time.sleep(DELAY)
+    finally:
+        output.close()
+        close_quarantine()
+        close_dead_letters()
+        close_prompt_prefix()
 
-    print("数据集构建完成")
+    print_summary()
+
+async def main_async(concurrency=CONCURRENCY, rpm=RPM_LIMIT, tpm=TPM_LIMIT, retry_failed=False):
+    """
+    并发处理所有场景：最多 concurrency 个请求同时在途，由 RPM/TPM 令牌桶控制发送速率，
+    每个场景完成后立即写出结果。
+    """
+    scenes, partial = open_dead_letters(retry_failed)
+    if scenes is None:
+        return
+
+    open_response_cache()
+    open_prompt_prefix()
+    output = AnnotationOutput(partial)
+
+    queue = asyncio.Queue()
+    for item in output.pending(scenes):
+        queue.put_nowait(item)
+
+    print(f"开始处理 {queue.qsize()} 个场景 (并发数 {concurrency})...")
+    limiter = RateLimiter(rpm=rpm, tpm=tpm)
+
+    async def worker():
+        while True:
+            try:
+                scene, output_path, input_hash = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            scene_id = scene.get("id", "unknown_id")
+            print(f"正在处理: {scene_id}")
+            annotation = await generate_annotation_async(scene, limiter)
+            if annotation:
+                # 所有 worker 运行在同一个事件循环线程中，写入输出和清单无需加锁
+                output.write(scene, annotation, output_path, input_hash)
+            else:
+                print(f"失败: {scene_id}")
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, queue.qsize()))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        output.close()
+        close_quarantine()
+        close_dead_letters()
+        close_prompt_prefix()
+
+    print_summary()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--retry-failed", action="store_true", help="只重新生成死信队列中调用失败的场景")
+    args = parser.parse_args()
+
+    if ASYNC_MODE:
+        asyncio.run(main_async(retry_failed=args.retry_failed))
+    else:
+        main(retry_failed=args.retry_failed)
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+多记录批量提示：把多条记录打包进一个请求，共用同一段格式说明，
+再把合并的响应按记录 ID 拆分；每条回复的 <think>/<perplexity>/final_answer 由 utils.validation.parse_tagged_reply 校验。
+"""
+import re
+
+RECORD_START = "=== RECORD {record_id} ==="
+RECORD_END = "=== END RECORD ==="
+RESPONSE_START = "=== RESPONSE {record_id} ==="
+RESPONSE_END = "=== END RESPONSE ==="
+
+BATCH_OUTPUT_INSTRUCTIONS = f"""每条记录都必须单独回复，并用以下分隔符包裹（ID 与记录中的 ID 完全一致，不要遗漏任何记录）：
+{RESPONSE_START.format(record_id="<ID>")}
+按上述格式的回复
+{RESPONSE_END}"""
+
+_RESPONSE_PATTERN = re.compile(r"=== RESPONSE (.+?) ===\s*(.*?)\s*=== END RESPONSE ===", re.DOTALL)
+
+
+def build_batch_prompt(header, blocks, response_format):
+    """
+    构建批量提示词。
+
+    Args:
+        header (str): 任务说明。
+        blocks (list): [(记录 ID, 记录内容文本), ...]
+        response_format (str): 所有记录共用的回复格式说明，只出现一次。
+    """
+    parts = [header, ""]
+    for record_id, body in blocks:
+        parts.append(RECORD_START.format(record_id=record_id))
+        parts.append(body)
+        parts.append(RECORD_END)
+        parts.append("")
+    parts.append(response_format)
+    parts.append("")
+    parts.append(BATCH_OUTPUT_INSTRUCTIONS)
+    return "\n".join(parts)
+
+
+def split_batch_response(text, expected_ids):
+    """
+    将合并的响应拆分为 {记录 ID: 该记录的回复文本}，忽略不在 expected_ids 中的 ID。
+    同一 ID 出现多次时保留第一次。
+    """
+    expected = set(expected_ids)
+    replies = {}
+    for match in _RESPONSE_PATTERN.finditer(text):
+        record_id = match.group(1).strip()
+        if record_id in expected and record_id not in replies:
+            replies[record_id] = match.group(2)
+    return replies
+
+
+def format_reply(think, perplexity, final_answer):
+    return f"<think>{think}</think>\n<perplexity>{perplexity}</perplexity>\nfinal_answer: {final_answer}"
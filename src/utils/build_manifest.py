@@ -0,0 +1,199 @@
+"""
+增量构建清单（SQLite）：为每条输入记录保存内容哈希、构建版本和上次的转换结果。
+重新运行时，哈希与版本都未变化的记录直接沿用上次的结果，只有新增或改动的记录才重新转换；
+本次构建中没有出现的记录（输入中已删除）在 finish() 时从清单中清除。
+
+构建版本由转换代码（脚本及其用到的 utils 模块）、提示词模板、相关配置等计算得到（见 code_version），
+任何一项变化都会使全部记录失效。
+
+清单保存每条输出的压缩副本，体积与输出相当，第一次构建也比直接转换慢一倍左右，
+只在需要反复重建、且每次只改动少量输入时才值得开启（各转换脚本的 INCREMENTAL 默认关闭）。
+
+多进程转换时，主进程持有可写的 BuildManifest，子进程在初始化时通过 init_worker_manifest
+以只读方式打开同一个清单，并用 run_incremental 在子进程中完成命中判断，命中的记录不再转换。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+
+MISSING = object() # lookup 未命中时的返回值（上次的结果本身可能是 None）
+
+
+def content_hash(value):
+    """字符串按原文计算，其他对象按键排序后的 JSON 计算 SHA-256。"""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """文件内容的 SHA-256，文件不存在时返回空字符串。"""
+    if not os.path.exists(path):
+        return ""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def utils_sources(*names):
+    """utils 包中名为 names 的模块的源文件路径，供 code_version 一并计算哈希。"""
+    utils_dir = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(utils_dir, f"{name}.py") for name in names]
+
+
+def code_version(source_files=(), **settings):
+    """
+    根据转换代码（源文件内容）和影响输出的配置计算构建版本。
+    source_files 应包含转换脚本本身以及决定输出格式的 utils 模块（见 utils_sources）。
+    """
+    return content_hash({
+        "sources": [file_hash(path) for path in source_files],
+        "settings": settings,
+    })
+
+
+class BuildManifest:
+    """
+    Args:
+        path (str): SQLite 文件路径。
+        version (str): 当前构建版本，与清单中记录的版本不同的条目一律视为失效。
+        readonly (bool): 只读打开（子进程中使用），此时不能调用 record/touch/finish。
+    """
+
+    COMMIT_EVERY = 1000 # 每写入多少条提交一次
+
+    def __init__(self, path, version, readonly=False):
+        self.path = path
+        self.version = version
+        self.readonly = readonly
+        self.reused = 0
+        self.rebuilt = 0
+        self._pending = 0
+
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            self.build_id = None
+            return
+
+        manifest_dir = os.path.dirname(path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " key TEXT PRIMARY KEY,"
+            " input_hash TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " output BLOB NOT NULL,"
+            " build INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'build'").fetchone()
+        self.build_id = int(row[0]) + 1 if row else 1
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('build', ?)", (str(self.build_id),))
+        self._conn.commit()
+
+    def lookup(self, key, input_hash):
+        """输入哈希和版本都与上次构建一致时返回上次保存的结果，否则返回 MISSING。"""
+        row = self._conn.execute(
+            "SELECT output FROM records WHERE key = ? AND input_hash = ? AND version = ?",
+            (key, input_hash, self.version),
+        ).fetchone()
+        if row is None:
+            return MISSING
+        return json.loads(zlib.decompress(row[0]))
+
+    def record(self, key, input_hash, output):
+        """保存本次构建的结果（需可 JSON 序列化）。"""
+        blob = zlib.compress(json.dumps(output, ensure_ascii=False).encode("utf-8"))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO records (key, input_hash, version, output, build) VALUES (?, ?, ?, ?, ?)",
+            (key, input_hash, self.version, blob, self.build_id),
+        )
+        self.rebuilt += 1
+        self._maybe_commit()
+
+    def known(self, key):
+        """清单中是否有 key 的记录（不论哈希和版本是否一致）。"""
+        return self._conn.execute("SELECT 1 FROM records WHERE key = ?", (key,)).fetchone() is not None
+
+    def keep(self, key):
+        """标记记录在本次构建中仍然存在（finish 时不删除），不改变其哈希。"""
+        self._conn.execute("UPDATE records SET build = ? WHERE key = ?", (self.build_id, key))
+        self._maybe_commit()
+
+    def touch(self, key):
+        """标记沿用上次结果的记录。"""
+        self.keep(key)
+        self.reused += 1
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._pending = 0
+
+    def finish(self):
+        """提交本次构建，删除本次没有出现的记录，返回删除的条数。"""
+        cur = self._conn.execute("DELETE FROM records WHERE build != ?", (self.build_id,))
+        self._conn.commit()
+        self._pending = 0
+        return cur.rowcount
+
+    def summary(self):
+        return f"沿用 {self.reused} 条，重新生成 {self.rebuilt} 条"
+
+    def close(self):
+        if not self.readonly:
+            self._conn.commit()
+        self._conn.close()
+
+
+# 当前（子）进程中只读打开的清单，见 init_worker_manifest
+_worker_manifest = None
+
+
+def init_worker_manifest(path, version):
+    """在转换子进程中只读打开清单；path 为 None 时关闭增量模式。"""
+    global _worker_manifest
+    _worker_manifest = BuildManifest(path, version, readonly=True) if path else None
+
+
+def worker_incremental():
+    return _worker_manifest is not None
+
+
+def lookup_worker(key, input_hash):
+    if _worker_manifest is None:
+        return MISSING
+    return _worker_manifest.lookup(key, input_hash)
+
+
+def run_incremental(fn, index, source, **kwargs):
+    """
+    在子进程中转换一条输入：source 与上次构建相同时沿用上次的结果，否则调用 fn(index, source, **kwargs)。
+    返回 (key, input_hash, 是否沿用, 结果)，由主进程交给 save_incremental。未开启增量模式时不计算哈希。
+    """
+    key = str(index)
+    if _worker_manifest is None:
+        return key, None, False, fn(index, source, **kwargs)
+    input_hash = content_hash(source)
+    cached = _worker_manifest.lookup(key, input_hash)
+    if cached is not MISSING:
+        return key, input_hash, True, cached
+    return key, input_hash, False, fn(index, source, **kwargs)
+
+
+def save_incremental(manifest, key, input_hash, reused, result):
+    """主进程中登记 run_incremental 的返回值，manifest 为 None（未开启增量模式）时什么也不做。"""
+    if manifest is None:
+        return
+    if reused:
+        manifest.touch(key)
+    else:
+        manifest.record(key, input_hash, result)
@@ -0,0 +1,369 @@
+"""
+多后端 LLM 客户端池：把多个 Gemini API key / 模型和 OpenAI 兼容端点（如本地 vLLM）组合成一个客户端。
+接口与 google-genai 的 Client 相同（client.models.generate_content / client.aio.models.generate_content），
+可以直接交给 utils.llm_client.generate_text，响应缓存、重试、限流和死信队列的逻辑都不变。
+
+路由：每个请求发给预计完成时间最短的后端，
+    预计时间 = max(该后端限流器需要等待的时间, 429 冷却的剩余时间) + 延迟 EWMA × (在途请求数 + 1)
+- 每个后端有自己的 RateLimiter（配置中的 rpm / tpm，即这个 key 的配额），剩余配额少的后端等待时间长，分到的请求少；
+- 成功请求的延迟计入 EWMA；5xx、超时等失败按 FAILURE_PENALTY 倍计入，持续出错的后端逐渐被绕开；
+- 返回 429 的后端按服务器建议的时间（没有时为 DEFAULT_COOLDOWN 秒）冷却，请求立即改发给还没试过的其他后端，
+  所有后端都返回 429 时才抛给调用方，由 generate_text 按 Retry-After 等待后重试。
+其他失败直接抛给调用方，generate_text 重试时重新选择后端，通常会换到另一个后端。
+
+连接复用：同一个 API key 的 Gemini 后端共用一个 genai.Client（内部持有 httpx 连接池）；
+OpenAI 兼容端点使用 keep-alive 的 httpx.Client / httpx.AsyncClient，连接数上限为 max_connections。
+
+配置文件（JSON），key 建议通过 api_key_env 从环境变量读取，不要写进文件：
+    {"backends": [
+        {"name": "gemini-a", "type": "gemini", "api_key_env": "GEMINI_API_KEY_A", "rpm": 1000, "tpm": 1000000},
+        {"name": "gemini-b", "type": "gemini", "api_key_env": "GEMINI_API_KEY_B", "model": "gemini-2.0-flash-lite"},
+        {"name": "local", "type": "openai", "base_url": "http://127.0.0.1:8000/v1", "model": "qwen2.5-7b-instruct",
+         "max_connections": 64}
+    ]}
+Gemini 后端未指定 model 时使用调用方传入的模型名，base_url 可指向 mock 服务器。
+有后端换用了其他模型时，响应缓存的键为调用方模型名加上这些模型名（见 cache_model_name），
+查找、写入和删除缓存都用同一个键，与单个客户端的缓存互不混用；上下文缓存绑定单个 key，客户端池只支持内联提示词前缀。
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+
+from utils.llm_client import OUTPUT_TOKEN_ESTIMATE, make_client
+from utils.metrics import metrics
+from utils.ratelimit import RateLimiter, estimate_tokens
+from utils.retry import retry_after_hint, status_code
+
+BACKEND_TYPES = ("gemini", "openai")
+EWMA_ALPHA = 0.3 # 新观测值在延迟 EWMA 中的权重
+INITIAL_LATENCY = 1.0 # 还没有观测值的后端的预计延迟（秒）
+FAILURE_PENALTY = 4.0 # 失败请求按 max(延迟, 当前 EWMA) 的这么多倍计入 EWMA
+DEFAULT_COOLDOWN = 10.0 # 429 没有给出 Retry-After 时的冷却秒数
+DEFAULT_TIMEOUT = 120.0 # OpenAI 兼容端点的请求超时（秒）
+DEFAULT_MAX_CONNECTIONS = 32
+
+
+class UsageMetadata:
+    """把 OpenAI 的 usage 转换成与 Gemini usage_metadata 相同的字段名。"""
+
+    def __init__(self, usage):
+        usage = usage or {}
+        details = usage.get("prompt_tokens_details") or {}
+        self.prompt_token_count = usage.get("prompt_tokens")
+        self.candidates_token_count = usage.get("completion_tokens")
+        self.total_token_count = usage.get("total_tokens")
+        self.cached_content_token_count = details.get("cached_tokens")
+
+
+class ChatResponse:
+    """OpenAI chat completion 响应中 generate_text 用到的部分：text 和 usage_metadata。"""
+
+    def __init__(self, payload):
+        choices = payload.get("choices") or [{}]
+        self.text = (choices[0].get("message") or {}).get("content") or ""
+        self.usage_metadata = UsageMetadata(payload.get("usage"))
+
+
+def _contents_text(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_contents_text(item) for item in contents)
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return "\n".join(part.text for part in parts if getattr(part, "text", None))
+    return str(contents)
+
+
+# GenerateContentConfig 字段到 chat completions 参数的映射
+_CONFIG_FIELDS = {"temperature": "temperature", "top_p": "top_p", "max_output_tokens": "max_tokens",
+                  "stop_sequences": "stop", "seed": "seed"}
+
+
+def chat_payload(model, contents, config=None):
+    """把 generate_content 的参数转换为 /chat/completions 的请求体（只转换常用的生成参数）。"""
+    messages = []
+    system = getattr(config, "system_instruction", None) if config is not None else None
+    if system:
+        messages.append({"role": "system", "content": _contents_text(system)})
+    messages.append({"role": "user", "content": _contents_text(contents)})
+    payload = {"model": model, "messages": messages}
+    for field, name in _CONFIG_FIELDS.items():
+        value = getattr(config, field, None) if config is not None else None
+        if value is not None:
+            payload[name] = value
+    if config is not None and getattr(config, "response_mime_type", None) == "application/json":
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+class OpenAICompatibleClient:
+    """
+    OpenAI 兼容的 /chat/completions 端点（vLLM、llama.cpp server 等）。
+    同步请求共用一个 httpx.Client；异步请求共用一个 httpx.AsyncClient，在当前事件循环中第一次使用时创建。
+    非 2xx 响应抛出 httpx.HTTPStatusError，utils.retry 据此判断是否重试并读取 Retry-After。
+    """
+
+    def __init__(self, base_url, api_key=None, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT,
+                 proxy=None):
+        import httpx
+
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        # 不读取代理环境变量：make_client 为 Gemini 设置的 HTTP(S)_PROXY 不应作用于本地端点
+        self._options = {"limits": httpx.Limits(max_connections=max_connections,
+                                                max_keepalive_connections=max_connections),
+                         "timeout": timeout, "proxy": proxy, "trust_env": False}
+        self._client = httpx.Client(**self._options)
+        self._async_client = None
+        self._async_loop = None
+
+    def generate(self, model, contents, config=None):
+        response = self._client.post(self.url, json=chat_payload(model, contents, config), headers=self._headers)
+        response.raise_for_status()
+        return ChatResponse(response.json())
+
+    async def agenerate(self, model, contents, config=None):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(**self._options)
+            self._async_loop = loop
+        response = await self._async_client.post(self.url, json=chat_payload(model, contents, config),
+                                                 headers=self._headers)
+        response.raise_for_status()
+        return ChatResponse(response.json())
+
+    def close(self):
+        self._client.close()
+
+
+class Backend:
+    """
+    一个后端（一个 key + 模型，或一个 OpenAI 兼容端点）及其路由状态：延迟 EWMA、在途请求数、429 冷却截止时间。
+    路由状态由 ClientPool 在自己的锁内读写。
+    """
+
+    def __init__(self, name, kind, client, model=None, limiter=None):
+        self.name = name
+        self.kind = kind
+        self.client = client
+        self.model = model
+        self.limiter = limiter or RateLimiter()
+        self.latency = None
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+    def expected_time(self, tokens, now):
+        queue_wait = max(self.limiter.wait_time(tokens), self.cooldown_until - now)
+        latency = self.latency if self.latency is not None else INITIAL_LATENCY
+        return max(0.0, queue_wait) + latency * (self.in_flight + 1)
+
+    def observe(self, latency):
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+
+    def generate(self, model, contents, config):
+        if self.kind == "openai":
+            return self.client.generate(self.model, contents, config)
+        return self.client.models.generate_content(model=self.model or model, contents=contents, config=config)
+
+    async def agenerate(self, model, contents, config):
+        if self.kind == "openai":
+            return await self.client.agenerate(self.model, contents, config)
+        return await self.client.aio.models.generate_content(model=self.model or model, contents=contents,
+                                                             config=config)
+
+
+class _Models:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def generate_content(self, model, contents, config=None):
+        return self._pool.generate_content(model, contents, config)
+
+
+class _AsyncModels:
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def generate_content(self, model, contents, config=None):
+        return await self._pool.agenerate_content(model, contents, config)
+
+
+class _Aio:
+    def __init__(self, pool):
+        self.models = _AsyncModels(pool)
+
+
+class ClientPool:
+    """
+    按预计完成时间在多个 Backend 之间分发请求，接口与 genai.Client 的 models / aio.models 相同。
+    429 时换一个还没试过的后端重发，其他失败更新该后端的状态后原样抛出异常。
+    """
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("ClientPool needs at least one backend")
+        self.backends = list(backends)
+        self._lock = threading.Lock()
+        self.models = _Models(self)
+        self.aio = _Aio(self)
+
+    def _choose(self, tokens, tried=()):
+        """选择预计完成时间最短且不在 tried 中的后端，都试过时返回 None。"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend not in tried]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda backend: backend.expected_time(tokens, now))
+            backend.in_flight += 1
+        return backend
+
+    def _finish(self, backend, tokens, latency, response=None, exc=None):
+        outcome = "ok"
+        with self._lock:
+            backend.in_flight -= 1
+            if exc is None:
+                backend.observe(latency)
+            elif status_code(exc) == 429:
+                outcome = "429"
+                cooldown = retry_after_hint(exc)
+                backend.cooldown_until = time.monotonic() + (cooldown if cooldown is not None else DEFAULT_COOLDOWN)
+            else:
+                outcome = str(status_code(exc) or type(exc).__name__)
+                backend.observe(max(latency, backend.latency or 0.0) * FAILURE_PENALTY)
+            ewma = backend.latency
+        if response is not None:
+            usage = getattr(response, "usage_metadata", None)
+            backend.limiter.settle(tokens, getattr(usage, "total_token_count", None) if usage else None)
+        else:
+            # 失败的请求没有消耗 token，退还预扣的 TPM 配额
+            backend.limiter.settle(tokens, 0)
+        metrics.inc("llm_backend_requests_total", backend=backend.name, outcome=outcome)
+        if ewma is not None:
+            metrics.set("llm_backend_latency_ewma_seconds", ewma, backend=backend.name)
+
+    def generate_content(self, model, contents, config=None):
+        tokens = estimate_tokens(_contents_text(contents)) + OUTPUT_TOKEN_ESTIMATE
+        tried = []
+        while True:
+            backend = self._choose(tokens, tried)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                backend.limiter.acquire(tokens)
+                start = time.perf_counter()
+                response = backend.generate(model, contents, config)
+            except Exception as e:
+                self._finish(backend, tokens, time.perf_counter() - start, exc=e)
+                if status_code(e) == 429 and len(tried) < len(self.backends):
+                    continue
+                raise
+            self._finish(backend, tokens, time.perf_counter() - start, response)
+            return response
+
+    async def agenerate_content(self, model, contents, config=None):
+        tokens = estimate_tokens(_contents_text(contents)) + OUTPUT_TOKEN_ESTIMATE
+        tried = []
+        while True:
+            backend = self._choose(tokens, tried)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                await backend.limiter.acquire_async(tokens)
+                start = time.perf_counter()
+                response = await backend.agenerate(model, contents, config)
+            except Exception as e:
+                self._finish(backend, tokens, time.perf_counter() - start, exc=e)
+                if status_code(e) == 429 and len(tried) < len(self.backends):
+                    continue
+                raise
+            self._finish(backend, tokens, time.perf_counter() - start, response)
+            return response
+
+    def cache_model(self, model):
+        """响应缓存键中的模型名，见 cache_model_name。"""
+        return cache_model_name(model, [backend.model for backend in self.backends])
+
+    def describe(self):
+        """各后端的当前状态，供打印或调试。"""
+        with self._lock:
+            return [{"name": backend.name, "type": backend.kind, "model": backend.model,
+                     "latency_ewma": backend.latency, "in_flight": backend.in_flight} for backend in self.backends]
+
+    def close(self):
+        for backend in self.backends:
+            if backend.kind == "openai":
+                backend.client.close()
+
+
+def cache_model_name(model, backend_models):
+    """
+    响应缓存键中的模型名：后端换用的其他模型按名称排序附在调用方模型名之后，所有后端都使用调用方模型时就是 model。
+    请求发出前不知道会由哪个后端处理，因此键只取决于调用方模型和池的配置，查找、写入和删除缓存时都能重新算出。
+    """
+    others = sorted({backend_model for backend_model in backend_models if backend_model and backend_model != model})
+    return "+".join([model, *others])
+
+
+@functools.lru_cache(maxsize=None)
+def _configured_models(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return tuple(spec.get("model") for spec in config.get("backends", []))
+
+
+def pool_cache_model(path, model):
+    """按后端配置文件计算 cache_model_name，只读取配置，不创建客户端（缓存全部命中时不需要 key 和 SDK）。"""
+    return cache_model_name(model, _configured_models(path))
+
+
+def _api_key(spec):
+    env = spec.get("api_key_env")
+    if env:
+        if env not in os.environ:
+            raise ValueError(f"Environment variable {env} for backend {spec.get('name')!r} is not set")
+        return os.environ[env]
+    return spec.get("api_key")
+
+
+def build_client_pool(specs):
+    """
+    根据后端配置列表创建 ClientPool。同一个 (key, base_url) 的 Gemini 后端共用一个客户端和连接池。
+    """
+    gemini_clients = {}
+    backends = []
+    for i, spec in enumerate(specs):
+        kind = spec.get("type", "gemini")
+        if kind not in BACKEND_TYPES:
+            raise ValueError(f"Unknown backend type {kind!r}, expected one of {BACKEND_TYPES}")
+        name = spec.get("name") or f"{kind}-{i}"
+        api_key = _api_key(spec)
+        if kind == "openai":
+            if not spec.get("base_url") or not spec.get("model"):
+                raise ValueError(f"OpenAI-compatible backend {name!r} needs base_url and model")
+            client = OpenAICompatibleClient(spec["base_url"], api_key,
+                                            max_connections=spec.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+                                            timeout=spec.get("timeout", DEFAULT_TIMEOUT), proxy=spec.get("proxy"))
+        else:
+            key = (api_key, spec.get("base_url"))
+            if key not in gemini_clients:
+                gemini_clients[key] = make_client(api_key, spec.get("base_url"))
+            client = gemini_clients[key]
+        limiter = RateLimiter(rpm=spec.get("rpm"), tpm=spec.get("tpm"))
+        backends.append(Backend(name, kind, client, spec.get("model"), limiter))
+    return ClientPool(backends)
+
+
+def load_client_pool(path):
+    """读取后端配置文件（见模块说明）并创建 ClientPool。"""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    pool = build_client_pool(config.get("backends", []))
+    print(f"LLM 客户端池: {', '.join(backend.name for backend in pool.backends)}")
+    return pool
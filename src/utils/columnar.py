@@ -0,0 +1,203 @@
+"""
+把转换输出 (JSONL) 导出为列式的 Parquet 或 Arrow IPC 文件，下游按标签过滤或加载时不必逐行 json.loads。
+
+列布局（所有转换脚本的输出共用同一个 schema）：
+- 标签列 proactive_category、sub_category、uncertainty_type、source 为 dictionary<int32, string>，
+  字典在整个文件中只追加不重排，Arrow IPC 中以增量字典写出；
+- requires_tool 为 bool，messages 为 list<struct<role, content, story_ref>>；
+- thinking_process 的结构因转换脚本而异，以 JSON 字符串保存；
+- 其余字段（original_action_index、reference_answer 等）合并成一个 JSON 字符串列 extra，
+  row_to_record 可以还原出原 JSONL 中的记录（值为 null 的标准字段省略）。
+每 row_group_rows 条记录写成一个 Parquet row group（或一个 Arrow record batch），便于多线程并行读取。
+需要 pyarrow。
+"""
+import json
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+LABEL_COLUMNS = ("source", "proactive_category", "sub_category", "uncertainty_type")
+DEFAULT_ROW_GROUP_ROWS = 64 * 1024
+
+MESSAGE_TYPE = pa.struct([
+    pa.field("role", pa.string()),
+    pa.field("content", pa.string()),
+    pa.field("story_ref", pa.string()),
+])
+LABEL_TYPE = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    pa.field("id", pa.string()),
+    pa.field("source", LABEL_TYPE),
+    pa.field("proactive_category", LABEL_TYPE),
+    pa.field("sub_category", LABEL_TYPE),
+    pa.field("uncertainty_type", LABEL_TYPE),
+    pa.field("requires_tool", pa.bool_()),
+    pa.field("messages", pa.list_(MESSAGE_TYPE)),
+    pa.field("final_answer", pa.string()),
+    pa.field("source_dataset_id", pa.string()),
+    pa.field("thinking_process", pa.string()),
+    pa.field("extra", pa.string()),
+])
+_FIXED_FIELDS = frozenset(name for name in SCHEMA.names if name != "extra") - {"source"}
+
+
+def _optional_str(value):
+    return None if value is None else str(value)
+
+
+def _json_or_none(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False)
+
+
+def record_to_row(record, source):
+    """
+    把一条记录转换为与 SCHEMA 列顺序一致的元组。供多进程驱动在子进程中调用。
+    """
+    messages = []
+    for message in record.get("messages") or []:
+        if isinstance(message, dict):
+            messages.append({"role": _optional_str(message.get("role")),
+                             "content": _optional_str(message.get("content")),
+                             "story_ref": _optional_str(message.get("story_ref"))})
+    requires_tool = record.get("requires_tool")
+    extra = {key: value for key, value in record.items() if key not in _FIXED_FIELDS}
+    return (
+        _optional_str(record.get("id")),
+        source,
+        _optional_str(record.get("proactive_category")),
+        _optional_str(record.get("sub_category")),
+        _optional_str(record.get("uncertainty_type")),
+        requires_tool if isinstance(requires_tool, bool) else None,
+        messages,
+        _optional_str(record.get("final_answer")),
+        _optional_str(record.get("source_dataset_id")),
+        _json_or_none(record.get("thinking_process")),
+        _json_or_none(extra) if extra else None,
+    )
+
+
+def line_to_row(line, source):
+    """解析一行 JSONL 并转换为行元组，空行或无法解析时返回 None。"""
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return record_to_row(record, source) if isinstance(record, dict) else None
+
+
+class LabelEncoder:
+    """
+    标签值到字典编码的映射，整个文件共用：新值只追加到字典末尾，
+    已经写出的 batch 中的编码始终有效。
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, values):
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            indices.append(code)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(self.values, pa.string()))
+
+
+class ColumnarWriter:
+    """
+    逐行累积，每 row_group_rows 行写出一个 row group / record batch。
+
+    Args:
+        path (str): 输出文件路径。
+        fmt (str): "parquet" 或 "arrow"（Arrow IPC 文件，可以 memory map 零拷贝读取）。
+        row_group_rows (int): 每个 row group 的行数。
+        compression (str): 压缩算法，如 "zstd"、"lz4"，None 表示不压缩（压缩的 Arrow 文件无法零拷贝读取）。
+    """
+
+    def __init__(self, path, fmt="parquet", row_group_rows=DEFAULT_ROW_GROUP_ROWS, compression="zstd"):
+        if fmt not in ("parquet", "arrow"):
+            raise ValueError(f"Unknown columnar format: {fmt!r}")
+        self.path = path
+        self.fmt = fmt
+        self.row_group_rows = row_group_rows
+        self.rows = 0
+        self.row_groups = 0
+        self._pending = []
+        self._encoders = {name: LabelEncoder() for name in LABEL_COLUMNS}
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, SCHEMA, compression=compression or "none",
+                                            use_dictionary=True, write_statistics=True)
+        else:
+            options = ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True)
+            self._writer = ipc.new_file(path, SCHEMA, options=options)
+
+    def write_row(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= self.row_group_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        arrays = []
+        for field, values in zip(SCHEMA, columns):
+            if field.name in self._encoders:
+                arrays.append(self._encoders[field.name].encode(values))
+            else:
+                arrays.append(pa.array(values, field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+        if self.fmt == "parquet":
+            self._writer.write_batch(batch, row_group_size=len(self._pending))
+        else:
+            self._writer.write_batch(batch)
+        self.rows += len(self._pending)
+        self.row_groups += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_table(path, columns=None, filter=None):
+    """
+    读取导出的 Parquet 或 Arrow 文件（按扩展名判断），只读取 columns 中的列；
+    filter 为 pyarrow.compute 表达式，例如 pc.field("proactive_category") == "clarification"。
+    各 row group / record batch 并行扫描，Parquet 会按列统计信息跳过不可能匹配的 row group。
+    """
+    dataset = ds.dataset(path, format="ipc" if path.endswith(".arrow") else "parquet")
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def row_to_record(row):
+    """把 Table.to_pylist() 中的一行还原为转换输出中的记录（source 列不属于原记录）。"""
+    record = {}
+    for name in SCHEMA.names:
+        value = row.get(name)
+        if name in ("source", "extra") or (value is None and name != "messages"):
+            continue
+        if name == "thinking_process":
+            value = json.loads(value)
+        elif name == "messages":
+            value = [{key: item for key, item in message.items() if item is not None} for message in value or []]
+        record[name] = value
+    if row.get("extra"):
+        record.update(json.loads(row["extra"]))
+    return record
@@ -0,0 +1,221 @@
+"""
+数据集统计：对转换输出做一次并行流式扫描，按 proactive_category、sub_category、requires_tool
+计数，并统计每条样本的消息轮数和字符数直方图。
+
+每个输入块（未压缩 JSONL 按字节区间切分，压缩分片整块处理）在子进程中得到一个 PartialStats，
+PartialStats 之间可以任意顺序合并，所以各块的结果按完成顺序归并即可。
+proactive 的定义与 readme 表格一致：proactive_category 不是 direct_answer。
+"""
+import json
+import os
+from collections import Counter
+from multiprocessing import Pool
+
+from utils.parallel import DEFAULT_CHUNK_BYTES, default_workers, split_line_ranges
+from utils.sink import MANIFEST_NAME, dataset_files, open_text
+
+NON_PROACTIVE_CATEGORY = "direct_answer"
+
+
+def histogram_bucket(n):
+    """按 2 的幂分桶：0 -> 0，1 -> 1，2~3 -> 2，4~7 -> 4 ……，返回桶的下界。"""
+    return 1 << (n.bit_length() - 1) if n > 0 else 0
+
+
+class PartialStats:
+    """可合并的部分统计结果。"""
+
+    def __init__(self):
+        self.total = 0
+        self.proactive = 0
+        self.invalid = 0
+        self.categories = Counter()
+        self.sub_categories = Counter() # 键为 "proactive_category/sub_category"
+        self.requires_tool = Counter()
+        self.message_counts = Counter() # 消息条数 -> 样本数
+        self.char_lengths = Counter() # 所有消息的总字符数按 2 的幂分桶 -> 样本数
+
+    def add(self, record):
+        category = record.get("proactive_category")
+        self.total += 1
+        if category != NON_PROACTIVE_CATEGORY:
+            self.proactive += 1
+        self.categories[category] += 1
+        self.sub_categories[f"{category}/{record.get('sub_category')}"] += 1
+        self.requires_tool[record.get("requires_tool")] += 1
+
+        messages = record.get("messages") or []
+        self.message_counts[len(messages)] += 1
+        chars = sum(len(message.get("content") or "") for message in messages if isinstance(message, dict))
+        self.char_lengths[histogram_bucket(chars)] += 1
+
+    def add_line(self, line):
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            self.invalid += 1
+            return
+        if isinstance(record, dict):
+            self.add(record)
+        else:
+            self.invalid += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.proactive += other.proactive
+        self.invalid += other.invalid
+        self.categories.update(other.categories)
+        self.sub_categories.update(other.sub_categories)
+        self.requires_tool.update(other.requires_tool)
+        self.message_counts.update(other.message_counts)
+        self.char_lengths.update(other.char_lengths)
+        return self
+
+    @property
+    def non_proactive(self):
+        return self.total - self.proactive
+
+    def to_dict(self):
+        def sorted_counts(counter):
+            return {str(key): count for key, count in sorted(counter.items(), key=lambda item: str(item[0]))}
+
+        def histogram(counter):
+            return {str(key): counter[key] for key in sorted(counter)}
+
+        return {
+            "total": self.total,
+            "proactive": self.proactive,
+            "non_proactive": self.non_proactive,
+            "invalid_lines": self.invalid,
+            "proactive_category": sorted_counts(self.categories),
+            "sub_category": sorted_counts(self.sub_categories),
+            "requires_tool": sorted_counts(self.requires_tool),
+            "message_count_histogram": histogram(self.message_counts),
+            "char_length_histogram": histogram(self.char_lengths),
+        }
+
+
+def _stats_line_range(path, start, end):
+    stats = PartialStats()
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    for line in data.split(b"\n"):
+        stats.add_line(line.decode("utf-8"))
+    return stats
+
+
+def _stats_file(path):
+    stats = PartialStats()
+    if path.endswith(".json"):
+        # 逐场景保存的单个 JSON 文件（src/pipeline.py 的默认输出）
+        with open(path, "r", encoding="utf-8") as f:
+            stats.add_line(f.read())
+        return stats
+    with open_text(path) as f:
+        for line in f:
+            stats.add_line(line)
+    return stats
+
+
+def _run_task(task):
+    label, kind, args = task
+    if kind == "range":
+        return label, _stats_line_range(*args)
+    return label, _stats_file(*args)
+
+
+def stats_tasks(label, path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    把一个数据集拆成若干统计任务。path 可以是 JSONL 文件、压缩文件、分片目录，
+    或由单个 JSON 文件组成的目录（每个文件一条样本）。
+    """
+    if os.path.isdir(path) and not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json"))
+    else:
+        files = dataset_files(path)
+
+    tasks = []
+    for file_path in files:
+        if file_path.endswith(".jsonl"):
+            for start, end, _ in split_line_ranges(file_path, chunk_bytes):
+                tasks.append((label, "range", (file_path, start, end)))
+        else:
+            tasks.append((label, "file", (file_path,)))
+    return tasks
+
+
+def collect_stats(datasets, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    对多个数据集做一次并行扫描。
+
+    Args:
+        datasets (dict): {数据集名: 路径}。
+        workers (int): 进程数，1 表示在当前进程中运行。
+
+    Returns:
+        dict: {数据集名: PartialStats}
+    """
+    workers = workers or default_workers()
+    results = {label: PartialStats() for label in datasets}
+    tasks = [task for label, path in datasets.items() for task in stats_tasks(label, path, chunk_bytes)]
+
+    if workers == 1:
+        for label, partial in map(_run_task, tasks):
+            results[label].merge(partial)
+        return results
+
+    with Pool(workers) as pool:
+        for label, partial in pool.imap_unordered(_run_task, tasks):
+            results[label].merge(partial)
+    return results
+
+
+README_HEADER = ["dataset", "category", "proactive_num", "non_proactive_num", "total"]
+
+
+def render_markdown_table(header, rows):
+    """按列宽对齐渲染 markdown 表格，返回行列表。"""
+    widths = [max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))]
+
+    def render_row(cells):
+        return "| " + " | ".join(str(cell).ljust(width) for cell, width in zip(cells, widths)) + " |"
+
+    return [render_row(header), "| " + " | ".join("-" * width for width in widths) + " |",
+            *(render_row(row) for row in rows)]
+
+
+def parse_markdown_table(lines):
+    """解析 render_markdown_table 格式的表格，返回 (表头, 行列表)。"""
+    rows = [[cell.strip() for cell in line.strip().strip("|").split("|")] for line in lines]
+    return rows[0], rows[2:]
+
+
+def update_readme_table(readme_path, computed_rows):
+    """
+    用统计结果替换 readme 中数据集表格的对应行（按 dataset 列匹配），
+    其余手工维护的行保持不变，新的数据集追加在末尾。返回新的表格行。
+    """
+    with open(readme_path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+
+    start = next((i for i, line in enumerate(lines) if line.startswith("| dataset ")), None)
+    if start is None:
+        start = end = len(lines)
+        rows = []
+    else:
+        end = start
+        while end < len(lines) and lines[end].startswith("|"):
+            end += 1
+        _, rows = parse_markdown_table(lines[start:end])
+
+    computed = {row[0]: row for row in computed_rows}
+    merged = [computed.pop(row[0], row) for row in rows]
+    merged.extend(row for row in computed_rows if row[0] in computed)
+
+    table = render_markdown_table(README_HEADER, merged)
+    with open(readme_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines[:start] + table + lines[end:]) + "\n")
+    return table
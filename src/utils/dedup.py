@@ -0,0 +1,138 @@
+"""
+MinHash-LSH 近似去重。
+
+每条样本取其用户消息（小写、合并空白后）的 UTF-8 字节 k-gram 作为 shingle，
+用 numpy 一次算出全部 num_perm 个哈希函数下的最小值作为签名；
+签名按 bands × rows 分段，同一段完全相同的样本成为候选对，估计的 Jaccard 相似度
+（签名中相同位置的比例）不低于阈值时用并查集合并为同一簇。
+整个过程只对落入同一个桶的样本做比较，耗时与样本数近似线性。
+"""
+import json
+
+import numpy as np
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16 # 16 段 × 每段 8 行，相似度约 0.7 以上的样本大概率成为候选
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.7
+
+
+def user_text(record):
+    """拼接样本中所有用户消息（引用了 CoQA 故事的消息带上 story_ref）。"""
+    parts = []
+    for message in record.get("messages") or []:
+        if isinstance(message, dict) and message.get("role") == "user":
+            if message.get("story_ref"):
+                parts.append(f"[story:{message['story_ref']}]")
+            parts.append(message.get("content") or "")
+    return " ".join(" ".join(parts).lower().split())
+
+
+class MinHasher:
+    """
+    Args:
+        num_perm (int): 哈希函数个数，即签名长度。
+        shingle_size (int): shingle 的字节数（不超过 8）。
+        seed (int): 生成哈希函数参数的随机种子，同一个种子得到的签名可以互相比较。
+    """
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, shingle_size=DEFAULT_SHINGLE_SIZE, seed=1):
+        if not 1 <= shingle_size <= 8:
+            raise ValueError("shingle_size must be between 1 and 8 bytes")
+        rng = np.random.default_rng(seed)
+        # multiply-shift 哈希：((a * x + b) mod 2^64) >> 32，a 取奇数
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._weights = np.uint64(256) ** np.arange(shingle_size, dtype=np.uint64)
+
+    def shingles(self, text):
+        """返回 text 中不重复的 shingle，每个 shingle 的字节直接拼成一个 uint64（无冲突）。"""
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        if len(data) == 0:
+            return np.empty(0, dtype=np.uint64)
+        if len(data) < self.shingle_size:
+            return np.array([int.from_bytes(data.tobytes(), "little")], dtype=np.uint64)
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.shingle_size).astype(np.uint64)
+        return np.unique(windows @ self._weights)
+
+    def signature(self, text):
+        """返回 uint32 签名，文本为空时返回 None。"""
+        shingles = self.shingles(text)
+        if len(shingles) == 0:
+            return None
+        hashed = (shingles[:, None] * self.a + self.b) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]] # 路径减半
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        """合并 x、y 所在的集合，以较小的下标为根，使每个簇的根是最早出现的样本。"""
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x == root_y:
+            return False
+        if root_x > root_y:
+            root_x, root_y = root_y, root_x
+        self.parent[root_y] = root_x
+        return True
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parent))], dtype=np.int64)
+
+
+def lsh_clusters(signatures, valid=None, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD):
+    """
+    对签名矩阵做 LSH 分桶并合并相似样本。
+
+    Args:
+        signatures (np.ndarray): (样本数, num_perm) 的 uint32 矩阵。
+        valid (np.ndarray): 布尔掩码，False 的样本（如没有用户消息）不参与去重，各自成簇。
+        bands (int): 分段数，必须整除 num_perm。
+        threshold (float): 候选对的估计 Jaccard 相似度下限。
+
+    Returns:
+        np.ndarray: 每个样本所在簇的根（簇中最早出现的样本下标）。
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+    rows = num_perm // bands
+    candidates = np.flatnonzero(valid) if valid is not None else np.arange(n)
+    union_find = UnionFind(n)
+
+    for band in range(bands):
+        if len(candidates) < 2:
+            break
+        # 每段的 rows 个 uint32 看作一个定长字节串，np.unique 一次完成分桶
+        keys = np.ascontiguousarray(signatures[candidates, band * rows:(band + 1) * rows])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel()
+        _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        # 同一个桶中的样本都与桶内最早出现的样本比较
+        leaders = candidates[first_index[inverse.ravel()]]
+        in_bucket = leaders != candidates
+        members, leaders = candidates[in_bucket], leaders[in_bucket]
+        if len(members) == 0:
+            continue
+        similar = (signatures[members] == signatures[leaders]).mean(axis=1) >= threshold
+        for member, leader in zip(members[similar].tolist(), leaders[similar].tolist()):
+            union_find.union(member, leader)
+
+    return union_find.roots()
+
+
+def signature_from_line(minhasher, line):
+    """解析一行样本并返回 (样本 ID, 签名字节或 None)。"""
+    record = json.loads(line)
+    signature = minhasher.signature(user_text(record))
+    return record.get("id"), signature.tobytes() if signature is not None else None
@@ -0,0 +1,123 @@
+"""
+增量 JSON 读取器：从单个大 JSON 文档中逐个产出某个数组的元素，
+不需要把整个文档读进内存。例如 CoQA-Abg 的 {"version": ..., "data": [...]}。
+只依赖标准库，每次只在内存中保留当前元素及一个读缓冲区。
+"""
+import json
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}:"
+_decoder = json.JSONDecoder()
+
+
+class MissingKeyError(KeyError):
+    """iter_json_array 的 path 中的某个键在文档中不存在（与转换数据时的 KeyError 区分）。"""
+
+
+class _StreamReader:
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """丢弃已消费的部分并继续读取，文件结束时返回 False。"""
+        if self.eof:
+            return False
+        # 当前元素比缓冲区还大时成倍扩大读取量，避免反复从头解码
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.buf, self.pos)
+
+    def peek(self):
+        """跳过空白，返回下一个字符，文件结束时返回空字符串。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise self.error(f"Expecting '{ch}'")
+        self.pos += 1
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # 数字可能在缓冲区边界被截断（如 "12" + "3" 或 "-2.5" + "e3"），
+            # 值后面不是分隔符时再读一块确认
+            if (end == len(self.buf) or self.buf[end] not in _DELIMITERS) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(f, path=(), chunk_size=1 << 20):
+    """
+    逐个产出 JSON 文档中位于 path 处的数组元素。
+
+    Args:
+        f: 以文本模式打开的文件对象。
+        path (sequence): 从根对象到目标数组的键路径，例如 ("data",)；为空时根本身应为数组。
+        chunk_size (int): 每次读取的字符数。
+
+    Raises:
+        MissingKeyError: path 中的某个键不存在（KeyError 的子类）。
+        json.JSONDecodeError: 文档格式错误，或 path 处不是对象/数组。
+    """
+    reader = _StreamReader(f, chunk_size)
+
+    for key in path:
+        reader.expect("{")
+        if reader.peek() == "}":
+            raise MissingKeyError(key)
+        while True:
+            name = reader.decode_value()
+            reader.expect(":")
+            if name == key:
+                break
+            reader.decode_value() # 跳过不需要的值
+            ch = reader.peek()
+            if ch == ",":
+                reader.pos += 1
+            elif ch == "}":
+                raise MissingKeyError(key)
+            else:
+                raise reader.error("Expecting ',' delimiter")
+
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.decode_value()
+        ch = reader.peek()
+        if ch == ",":
+            reader.pos += 1
+        elif ch == "]":
+            return
+        else:
+            raise reader.error("Expecting ',' delimiter")
+
+
+def iter_json_array_file(path, key_path=(), chunk_size=1 << 20):
+    """打开 path 并调用 iter_json_array。"""
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_json_array(f, key_path, chunk_size)
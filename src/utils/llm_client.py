@@ -0,0 +1,259 @@
+"""
+Gemini 调用的公共入口：先查响应缓存，未命中时经过限流器再调用 API。
+缓存命中不消耗任何配额，也不会被限流。
+429、5xx 和超时按 utils.retry 的退避策略重试，每次重试都重新经过限流器；最终失败时抛出最后一次的异常。
+google-genai 只在创建客户端时导入，离线脚本导入本模块不需要安装 SDK。
+传入 prefix（utils.prompt_cache）时 prompt 只是每个请求不同的后缀：完整提示词为 prefix.full_prompt(prompt)，
+静态前缀由 prefix 决定内联发送还是引用上下文缓存。
+每次调用都记入 utils.metrics：缓存命中、每次尝试的延迟和结果、重试原因、限流等待时间以及响应中的 token 用量。
+"""
+import os
+import threading
+import time
+
+from utils.metrics import metrics
+from utils.ratelimit import estimate_tokens
+from utils.retry import DEFAULT_RETRY_POLICY, status_code
+
+PROXY = "http://127.0.0.1:10808"
+OUTPUT_TOKEN_ESTIMATE = 1024 # 发送前对输出 token 数的预估，完成后按实际用量修正
+
+
+def make_client(api_key=None, base_url=None):
+    """
+    创建 Gemini 客户端，api_key 为 None 时使用环境变量中的默认 key。
+    指定了 base_url 或设置了环境变量 GEMINI_BASE_URL 时直接连接该地址（例如本地 mock 服务器），不经过代理；
+    否则使用 GEMINI_PROXY 指定的代理（默认 127.0.0.1:10808，设为空字符串表示不使用代理）。
+    """
+    from google import genai
+    from google.genai import types
+
+    base_url = base_url or os.environ.get("GEMINI_BASE_URL")
+    if base_url:
+        os.environ.setdefault("NO_PROXY", "127.0.0.1,localhost")
+        return genai.Client(
+            api_key=api_key or os.environ.get("GEMINI_API_KEY", "mock-key"),
+            http_options=types.HttpOptions(base_url=base_url),
+        )
+
+    proxy = os.environ.get("GEMINI_PROXY", PROXY)
+    if proxy:
+        os.environ["HTTP_PROXY"] = proxy
+        os.environ["HTTPS_PROXY"] = proxy
+    return genai.Client(api_key=api_key)
+
+
+def make_llm_client(backends_file=None):
+    """
+    backends_file 为 None 时创建单个 Gemini 客户端，否则按配置文件创建多后端客户端池 (utils.client_pool)。
+    脚本中用 LazyClient(lambda: make_llm_client(BACKENDS_FILE)) 延迟创建，命令行覆盖 BACKENDS_FILE 后仍然生效。
+    缓存键中的模型名由 llm_cache_model(BACKENDS_FILE, model) 给出，作为 LazyClient 的 cache_model 传入。
+    """
+    if backends_file:
+        from utils.client_pool import load_client_pool
+        return load_client_pool(backends_file)
+    return make_client()
+
+
+def llm_cache_model(backends_file, model):
+    """
+    make_llm_client(backends_file) 创建的客户端在响应缓存键中使用的模型名（见 utils.client_pool.cache_model_name），
+    只读取配置文件，不创建客户端。
+    """
+    if backends_file:
+        from utils.client_pool import pool_cache_model
+        return pool_cache_model(backends_file, model)
+    return model
+
+
+class LazyClient:
+    """
+    客户端的代理：第一次访问属性（如 client.models）时才调用 factory 创建真正的客户端，
+    因此脚本可以在模块级定义 client，导入时不需要 SDK、代理或凭据。
+    cache_model 为 model -> 响应缓存键中的模型名，不创建客户端，缓存全部命中时不需要凭据；None 时就是 model 本身。
+    """
+
+    def __init__(self, factory=make_client, cache_model=None):
+        self._factory = factory
+        self._cache_model = cache_model
+        self._client = None
+        self._lock = threading.Lock()
+
+    def cache_model(self, model):
+        return self._cache_model(model) if self._cache_model is not None else model
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+
+class CallStats:
+    """
+    记录实际发出的 API 调用（不含缓存命中）的次数、失败数、重试数和耗时，供压测脚本读取。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = []
+
+    def record(self, latency, ok=True):
+        with self._lock:
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(latency)
+
+    def record_retry(self, exc=None, wait=None):
+        with self._lock:
+            self.retries += 1
+
+    def percentile(self, q):
+        with self._lock:
+            if not self.latencies:
+                return 0.0
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+call_stats = CallStats()
+
+
+def _total_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return usage.total_token_count if usage else None
+
+
+# usage_metadata 中记入 llm_tokens_total 的字段
+_USAGE_FIELDS = {"prompt": "prompt_token_count", "cached": "cached_content_token_count",
+                 "output": "candidates_token_count"}
+
+
+def cache_model(client, model):
+    """
+    通过 client 调用 model 时响应缓存键中的模型名。客户端池有后端换用其他模型时与 model 不同，
+    查找、写入和删除 (ResponseCache.discard) 缓存都要用这个名字。
+    """
+    resolve = getattr(client, "cache_model", None)
+    return resolve(model) if resolve is not None else model
+
+
+def _record_usage(model, response):
+    usage = getattr(response, "usage_metadata", None)
+    for kind, field in _USAGE_FIELDS.items():
+        count = getattr(usage, field, None) if usage else None
+        if count:
+            metrics.inc("llm_tokens_total", count, model=model, kind=kind)
+
+
+def _record_attempt(model, latency, exc=None):
+    call_stats.record(latency, ok=exc is None)
+    outcome = "ok" if exc is None else str(status_code(exc) or type(exc).__name__)
+    metrics.inc("llm_requests_total", model=model, outcome=outcome)
+    metrics.observe("llm_request_seconds", latency, model=model)
+
+
+def _settle_attempt(limiter, estimated, response=None):
+    """
+    每次尝试结束后修正限流器中预扣的 token：成功时按实际用量修正，失败时全部退还，
+    否则每次重试都会多扣一份 TPM 配额，连续 429/5xx 之后吞吐下降。请求数配额不退还。
+    """
+    if limiter is not None:
+        limiter.settle(estimated, _total_tokens(response) if response is not None else 0)
+
+
+def _retry_recorder(model):
+    def on_retry(exc, wait):
+        call_stats.record_retry(exc, wait)
+        metrics.inc("llm_retries_total", model=model, reason=str(status_code(exc) or type(exc).__name__))
+    return on_retry
+
+
+def generate_text(client, model, prompt, config=None, cache=None, limiter=None, retry=DEFAULT_RETRY_POLICY,
+                  prefix=None):
+    """
+    同步生成文本，返回响应文本。retry 为 None 时不重试，prefix 为提示词的静态前缀。
+    """
+    full_prompt = prefix.full_prompt(prompt) if prefix is not None else prompt
+    if cache is not None:
+        cached = cache.get(cache_model(client, model), full_prompt, config)
+        if cached is not None:
+            metrics.inc("llm_cache_hits_total", model=model)
+            return cached
+
+    contents, request_config = prefix.request(prompt, config) if prefix is not None else (prompt, config)
+    estimated = estimate_tokens(contents) + OUTPUT_TOKEN_ESTIMATE
+
+    def attempt():
+        if limiter is not None:
+            with metrics.timer("rate_limit_wait"):
+                limiter.acquire(estimated)
+        start = time.perf_counter()
+        try:
+            response = client.models.generate_content(model=model, contents=contents, config=request_config)
+        except Exception as e:
+            _record_attempt(model, time.perf_counter() - start, e)
+            _settle_attempt(limiter, estimated)
+            raise
+        _record_attempt(model, time.perf_counter() - start)
+        _settle_attempt(limiter, estimated, response)
+        return response
+
+    response = retry.call(attempt, on_retry=_retry_recorder(model)) if retry is not None else attempt()
+    _record_usage(model, response)
+
+    text = response.text
+    if cache is not None and text:
+        cache.put(cache_model(client, model), full_prompt, text, config)
+    return text
+
+
+async def agenerate_text(client, model, prompt, config=None, cache=None, limiter=None, retry=DEFAULT_RETRY_POLICY,
+                         prefix=None):
+    """
+    generate_text 的异步版本。
+    """
+    full_prompt = prefix.full_prompt(prompt) if prefix is not None else prompt
+    if cache is not None:
+        cached = cache.get(cache_model(client, model), full_prompt, config)
+        if cached is not None:
+            metrics.inc("llm_cache_hits_total", model=model)
+            return cached
+
+    contents, request_config = prefix.request(prompt, config) if prefix is not None else (prompt, config)
+    estimated = estimate_tokens(contents) + OUTPUT_TOKEN_ESTIMATE
+
+    async def attempt():
+        if limiter is not None:
+            with metrics.timer("rate_limit_wait"):
+                await limiter.acquire_async(estimated)
+        start = time.perf_counter()
+        try:
+            response = await client.aio.models.generate_content(model=model, contents=contents,
+                                                                config=request_config)
+        except Exception as e:
+            _record_attempt(model, time.perf_counter() - start, e)
+            _settle_attempt(limiter, estimated)
+            raise
+        _record_attempt(model, time.perf_counter() - start)
+        _settle_attempt(limiter, estimated, response)
+        return response
+
+    if retry is not None:
+        response = await retry.acall(attempt, on_retry=_retry_recorder(model))
+    else:
+        response = await attempt()
+    _record_usage(model, response)
+
+    text = response.text
+    if cache is not None and text:
+        cache.put(cache_model(client, model), full_prompt, text, config)
+    return text
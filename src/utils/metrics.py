@@ -0,0 +1,388 @@
+"""
+流水线的轻量级性能指标：各阶段耗时、延迟直方图、计数器（记录数、重试数、token 数），导出为
+Prometheus textfile（node_exporter 的 textfile collector 可直接读取）或 JSON 快照，用来判断时间花在 API、
+JSON 解析还是磁盘写入上。
+
+所有脚本共用模块级的 metrics 注册表：
+    with metrics.timer("parse"):               # 记入 stage_seconds{stage="parse"}
+        ...
+    metrics.inc("records_total", status="written")
+    metrics.observe("llm_request_seconds", latency, model=MODEL)
+
+记录指标只是在锁内更新几个数字，不做任何 I/O；只有通过 MetricsExporter 或 write_metrics 导出时才写文件。
+多进程转换时子进程中的指标不会汇总，转换脚本在主进程中把等待结果的时间记为 convert 阶段。
+
+Profiler 提供两种性能剖析：cProfile（确定性，只覆盖主线程，输出 .pstats）和
+采样剖析（定时采样所有线程的调用栈，开销低，输出 flamegraph.pl / speedscope 可读的 folded stacks）。
+"""
+import bisect
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+METRIC_PREFIX = "proactive_"
+# 覆盖从单条记录的 JSON 解析（微秒级）到带重试的 API 调用（分钟级）
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SNAPSHOT_QUANTILES = (0.5, 0.9, 0.99)
+
+DESCRIPTIONS = {
+    "stage_seconds": "Wall time spent in each pipeline stage",
+    "records_total": "Records processed, by outcome",
+    "llm_requests_total": "LLM API calls actually sent (cache hits excluded), by outcome",
+    "llm_request_seconds": "Latency of a single LLM API call attempt",
+    "llm_retries_total": "LLM API call attempts that were retried, by reason",
+    "llm_cache_hits_total": "LLM requests answered from the response cache",
+    "llm_tokens_total": "Tokens reported by the API usage metadata, by kind",
+    "llm_backend_requests_total": "Requests sent to each client pool backend, by outcome",
+    "llm_backend_latency_ewma_seconds": "Latency EWMA the client pool routes on, per backend",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """固定分桶的直方图（与 Prometheus histogram 相同的累计语义在导出时计算）。"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # 最后一个桶为 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """按桶内线性插值估计分位数，落在 +Inf 桶时返回最大的有限边界。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return float(self.buckets[-1])
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return float(self.buckets[-1])
+
+
+class _Value:
+    """计数器或 gauge 的一个序列。"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+
+class _BoundCounter:
+    __slots__ = ("lock", "series")
+
+    def __init__(self, lock, series):
+        self.lock = lock
+        self.series = series
+
+    def inc(self, value=1):
+        with self.lock:
+            self.series.value += value
+
+
+class _Timer:
+    """可重复使用的计时上下文，每次进入和退出记录一次耗时。不同线程或协程交错使用时各自创建一个。"""
+
+    __slots__ = ("lock", "histogram", "start")
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record(time.perf_counter() - self.start)
+
+    def record(self, elapsed):
+        with self.lock:
+            self.histogram.observe(elapsed)
+
+
+class Metrics:
+    """
+    线程安全的指标注册表。指标名不含 METRIC_PREFIX，同名指标只能是一种类型。
+    const_labels 会附加到导出的每个序列上（统一命令行入口设置为子命令名）。
+    逐条记录调用的热点循环可以先用 counter() / timer() 取得绑定了标签的序列，避免每次都整理标签；
+    reset() 之后需要重新获取。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.const_labels = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._types = {}
+            self._series = {}
+
+    def _get(self, name, kind, labels):
+        """返回（必要时创建）name 在 labels 下的序列，调用方持有锁。"""
+        if self._types.setdefault(name, kind) != kind:
+            raise ValueError(f"Metric {name} is a {self._types[name]}, not a {kind}")
+        series = self._series.setdefault(name, {})
+        key = _label_key(labels)
+        if key not in series:
+            series[key] = Histogram() if kind == "histogram" else _Value()
+        return series[key]
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._get(name, "counter", labels).value += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._get(name, "gauge", labels).value = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._get(name, "histogram", labels).observe(value)
+
+    def counter(self, name, **labels):
+        """绑定了标签的计数器：counter("records_total", status="written").inc()。"""
+        with self._lock:
+            return _BoundCounter(self._lock, self._get(name, "counter", labels))
+
+    def timer(self, stage, **labels):
+        """with metrics.timer("write"): 把代码块的耗时记入 stage_seconds{stage=...}。"""
+        with self._lock:
+            return _Timer(self._lock, self._get("stage_seconds", "histogram", dict(labels, stage=stage)))
+
+    def timed(self, iterable, stage, **labels):
+        """逐个产出 iterable 的元素，把每次等待下一个元素的时间记入 stage_seconds{stage=...}。"""
+        iterator = iter(iterable)
+        timer = self.timer(stage, **labels)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            timer.record(time.perf_counter() - start)
+            yield item
+
+    def value(self, name, **labels):
+        """计数器或 gauge 的当前值，直方图返回观测次数；不存在时返回 0。"""
+        with self._lock:
+            series = self._series.get(name, {}).get(_label_key(labels))
+        if series is None:
+            return 0
+        return series.count if isinstance(series, Histogram) else series.value
+
+    def rate(self, name, **labels):
+        """计数器自 reset 以来的平均速率（每秒）。"""
+        elapsed = time.time() - self.started
+        return self.value(name, **labels) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """JSON 可序列化的快照：计数器附带平均速率，直方图附带次数、总和、均值和估计的分位数。"""
+        with self._lock:
+            uptime = time.time() - self.started
+            result = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "uptime_seconds": uptime,
+                      "labels": dict(self.const_labels), "metrics": {}}
+            for name, series in sorted(self._series.items()):
+                kind = self._types[name]
+                entries = []
+                for key, value in sorted(series.items()):
+                    entry = {"labels": dict(key)}
+                    if kind == "histogram":
+                        entry.update(count=value.count, sum=value.sum,
+                                     mean=value.sum / value.count if value.count else 0.0,
+                                     **{f"p{round(q * 100)}": value.quantile(q) for q in SNAPSHOT_QUANTILES})
+                    else:
+                        entry["value"] = value.value
+                        if kind == "counter":
+                            entry["per_second"] = value.value / uptime if uptime > 0 else 0.0
+                    entries.append(entry)
+                result["metrics"][name] = {"type": kind, "series": entries}
+        return result
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (text exposition format 0.0.4)。"""
+        const = _label_key(self.const_labels)
+        lines = []
+        with self._lock:
+            uptime_name = METRIC_PREFIX + "uptime_seconds"
+            lines += [f"# HELP {uptime_name} Seconds since metrics were reset", f"# TYPE {uptime_name} gauge",
+                      f"{uptime_name}{_format_labels(const)} {_format_number(time.time() - self.started)}"]
+            for name, series in sorted(self._series.items()):
+                kind = self._types[name]
+                full_name = METRIC_PREFIX + name
+                lines.append(f"# HELP {full_name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for key, value in sorted(series.items()):
+                    pairs = const + key
+                    if kind != "histogram":
+                        lines.append(f"{full_name}{_format_labels(pairs)} {_format_number(value.value)}")
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(value.buckets + ("+Inf",), value.counts):
+                        cumulative += n
+                        le = bound if isinstance(bound, str) else _format_number(float(bound))
+                        lines.append(f"{full_name}_bucket{_format_labels(pairs + (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(pairs)} {_format_number(value.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(pairs)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def write_metrics(path, registry=metrics):
+    """
+    写出指标：.prom 结尾时为 Prometheus textfile，否则为 JSON 快照。
+    先写临时文件再原子替换，采集方不会读到写了一半的文件。
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if path.endswith(".prom"):
+        content = registry.to_prometheus()
+    else:
+        content = json.dumps(registry.snapshot(), ensure_ascii=False, indent=2) + "\n"
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    """
+    后台线程每 interval 秒写出一次指标，关闭时再写出最终结果。
+    长时间运行的生成任务可以边运行边被采集；interval 为 None 时只在关闭时写出。
+    """
+
+    def __init__(self, path, interval=15.0, registry=metrics):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            write_metrics(self.path, self.registry)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        write_metrics(self.path, self.registry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SamplingProfiler:
+    """
+    每 interval 秒采样一次所有线程（除自身外）的调用栈，统计每条栈出现的次数。
+    写出为 folded stacks（"文件:函数;文件:函数 次数"），可用 flamegraph.pl 或 speedscope 查看。
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    with Profiler("run.pstats"): 对代码块做性能剖析，结束时写出结果。
+    mode 为 "cprofile"（只覆盖当前线程，用 python -m pstats 或 snakeviz 查看）
+    或 "sampling"（覆盖所有线程，适合线程池改写和异步生成）。
+    """
+
+    def __init__(self, path, mode="cprofile", interval=0.005):
+        if mode not in ("cprofile", "sampling"):
+            raise ValueError(f"Unknown profiler mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self._profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler(interval)
+
+    def __enter__(self):
+        if self.mode == "cprofile":
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path)
+        else:
+            self._profiler.stop()
+            self._profiler.dump(self.path)
+        print(f"性能剖析结果已保存到 {self.path}", file=sys.stderr)
@@ -0,0 +1,85 @@
+"""
+按权重从各数据集中抽样，组成类别均衡的训练混合集。
+
+分层 (stratum) 为 (数据集, proactive_category)。每层的目标条数为
+    总条数 × 数据集权重占比 × 该类别在此数据集内的权重占比，
+类别权重只在数据集中实际出现的类别之间归一化（例如 seal-tools 只有 tool_use，全部配额都给 tool_use）。
+
+抽样分两遍流式读取，内存占用与数据集大小无关：
+1. 计数：统计每层的样本数 n，据此计算配额 k；
+2. 选择抽样 (Knuth Algorithm S)：顺序扫描，每条样本以 (k - 已选) / (n - 已见) 的概率入选，
+   恰好选出 k 条且每个 k 元子集的概率相同，只需要保存两个计数器。
+   允许上采样时 k > n 的层中每条样本先重复 k // n 次，剩下的 k % n 条再按同样方式抽取。
+每层使用由 (seed, 数据集, 类别) 派生的独立随机数生成器，结果只取决于 seed 和输入内容。
+"""
+import hashlib
+import random
+
+DEFAULT_CATEGORY_WEIGHT = 1.0
+
+
+def stratum_rng(seed, source, category):
+    """由 seed 和分层名派生的随机数生成器，与处理顺序和 PYTHONHASHSEED 无关。"""
+    digest = hashlib.blake2b(f"{seed}\0{source}\0{category}".encode("utf-8"), digest_size=8).digest()
+    return random.Random(int.from_bytes(digest, "little"))
+
+
+def stratum_fractions(counts, source_weights, category_weights):
+    """
+    返回 {(数据集, 类别): 目标占比}，占比之和为 1。
+    counts 为 {(数据集, 类别): 样本数}；不在 source_weights 中或权重为 0 的数据集不参与混合，
+    不在 category_weights 中的类别使用 DEFAULT_CATEGORY_WEIGHT。
+    """
+    categories_by_source = {}
+    for (source, category), n in counts.items():
+        if n > 0 and source_weights.get(source, 0) > 0:
+            categories_by_source.setdefault(source, []).append(category)
+
+    total_source_weight = sum(source_weights[source] for source in categories_by_source)
+    fractions = {}
+    for source, categories in categories_by_source.items():
+        weights = {category: category_weights.get(category, DEFAULT_CATEGORY_WEIGHT) for category in categories}
+        total_category_weight = sum(weights.values())
+        if total_category_weight <= 0:
+            continue
+        for category, weight in weights.items():
+            fractions[(source, category)] = (source_weights[source] / total_source_weight
+                                             * weight / total_category_weight)
+    return fractions
+
+
+def compute_quotas(counts, source_weights, category_weights, total=None, upsample=False):
+    """
+    返回 {(数据集, 类别): 配额}。
+    total 为 None 时取不需要上采样就能满足所有占比的最大条数；
+    upsample 为 False 时配额不超过该层的样本数（样本不足的层按实际条数输出，整体占比会偏离目标）。
+    """
+    fractions = stratum_fractions(counts, source_weights, category_weights)
+    if total is None:
+        total = int(min((counts[key] / fraction for key, fraction in fractions.items() if fraction > 0),
+                        default=0))
+    quotas = {}
+    for key, fraction in fractions.items():
+        quota = int(round(total * fraction))
+        quotas[key] = quota if upsample else min(quota, counts[key])
+    return quotas
+
+
+class SelectionSampler:
+    """
+    从已知长度 n 的流中等概率选出 quota 条（quota 可以大于 n，此时每条至少重复 quota // n 次）。
+    每看到一条样本调用一次 copies()，返回这条样本应输出的份数。
+    """
+
+    def __init__(self, n, quota, rng):
+        self.base, self.remaining = divmod(quota, n) if n else (0, 0)
+        self.unseen = n
+        self.rng = rng
+
+    def copies(self):
+        extra = 0
+        if self.remaining and self.rng.random() * self.unseen < self.remaining:
+            extra = 1
+            self.remaining -= 1
+        self.unseen -= 1
+        return self.base + extra
@@ -0,0 +1,184 @@
+"""
+按长度打包训练样本：把多条样本装进同一个最长 max_tokens 的训练序列，减少 padding。
+
+1. 长度索引：子进程解析每条样本，统计消息的字符数和非 ASCII 字符数；主进程用 numpy
+   扫描换行符得到每行的字节偏移，并一次性按 utils.ratelimit.estimate_tokens 的规则算出 token 估计。
+   结果保存为紧凑的 .npz 索引（每条样本 18 字节），输入文件未变化时重复打包可直接复用。
+2. 装箱：best-fit-decreasing，剩余容量保存在有序列表中，用 bisect 找到能放下当前样本的最满的序列。
+3. 输出：按 (文件, 偏移) 从 mmap 中取出原始行，拼成 {"id", "num_tokens", "records"} 写入 sink。
+
+压缩的输入（.gz/.zst 或压缩分片）无法按偏移随机读取，会先解压到临时的 spool 文件。
+"""
+import bisect
+import json
+import mmap
+import os
+
+import numpy as np
+
+from utils.parallel import map_lines_ordered
+from utils.sink import dataset_files, open_text
+
+MESSAGE_OVERHEAD_TOKENS = 4 # 每条消息的角色标记等模板开销
+INDEX_DTYPE = np.dtype([("file", "<u2"), ("offset", "<u8"), ("size", "<u4"), ("tokens", "<u4")])
+
+
+def message_char_counts(index, line):
+    """返回 (字符数, 非 ASCII 字符数, 消息条数)，空行或无法解析时返回 None。"""
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        print(f"  - 跳过第 {index + 1} 行，JSON 解析失败.")
+        return None
+    chars = non_ascii = count = 0
+    for message in record.get("messages") or []:
+        content = (message.get("content") if isinstance(message, dict) else None) or ""
+        chars += len(content)
+        non_ascii += len(content) - len(content.encode("ascii", "ignore"))
+        count += 1
+    return chars, non_ascii, count
+
+
+def line_offsets(path):
+    """用 numpy 扫描换行符，返回每一行的 (起始偏移, 字节长度，不含换行符)。"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        newlines = np.flatnonzero(np.frombuffer(m, dtype=np.uint8) == ord("\n")).astype(np.uint64)
+    ends = newlines if len(newlines) and newlines[-1] == size - 1 else np.append(newlines, np.uint64(size))
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.uint64)
+    return starts, (ends - starts).astype(np.uint32)
+
+
+def plain_sources(paths, spool_path):
+    """
+    把输入展开成可按偏移随机读取的未压缩文件列表；压缩文件的内容依次追加到 spool_path。
+    返回 (文件列表, 是否使用了 spool)。
+    """
+    files = []
+    spool = None
+    for path in paths:
+        for file_path in dataset_files(path):
+            if file_path.endswith(".jsonl"):
+                files.append(file_path)
+                continue
+            if spool is None:
+                spool = open(spool_path, "w", encoding="utf-8")
+                files.append(spool_path)
+            with open_text(file_path) as f:
+                for line in f:
+                    spool.write(line if line.endswith("\n") else line + "\n")
+    if spool is not None:
+        spool.close()
+    return files, spool is not None
+
+
+def _source_signature(files):
+    return [[path, os.path.getsize(path), os.stat(path).st_mtime_ns] for path in files]
+
+
+def build_length_index(files, workers=None):
+    """对 files 中的每个有效样本计算 token 估计，返回 INDEX_DTYPE 的结构化数组。"""
+    parts = []
+    for file_id, path in enumerate(files):
+        starts, sizes = line_offsets(path)
+        counts = list(map_lines_ordered(path, message_char_counts, workers))
+        valid = np.array([c is not None for c in counts], dtype=bool)
+        stats = np.array([c for c in counts if c is not None], dtype=np.int64).reshape(-1, 3)
+        chars, non_ascii, messages = stats[:, 0], stats[:, 1], stats[:, 2]
+
+        part = np.empty(int(valid.sum()), dtype=INDEX_DTYPE)
+        part["file"] = file_id
+        part["offset"] = starts[:len(valid)][valid]
+        part["size"] = sizes[:len(valid)][valid]
+        part["tokens"] = non_ascii + (chars - non_ascii) // 4 + 1 + messages * MESSAGE_OVERHEAD_TOKENS
+        parts.append(part)
+    return np.concatenate(parts) if parts else np.empty(0, dtype=INDEX_DTYPE)
+
+
+def save_length_index(path, files, index):
+    np.savez(path, index=index, sources=json.dumps(_source_signature(files)))
+
+
+def load_length_index(path, files):
+    """索引存在且输入文件（路径、大小、修改时间）未变化时返回索引，否则返回 None。"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if json.loads(str(data["sources"])) != _source_signature(files):
+            return None
+        return data["index"]
+
+
+def best_fit_decreasing(lengths, capacity):
+    """
+    Best-fit-decreasing 装箱。超过 capacity 的样本单独成箱。
+
+    Returns:
+        list[list[int]]: 每个箱中的样本下标（按长度从大到小）。
+    """
+    order = np.argsort(-np.asarray(lengths, dtype=np.int64), kind="stable")
+    bins = []
+    free = [] # 有序的 (剩余容量, 箱编号)
+    for item in order.tolist():
+        size = int(lengths[item])
+        if size >= capacity:
+            bins.append([item])
+            continue
+        # 剩余容量 >= size 的箱中最满的一个
+        position = bisect.bisect_left(free, (size, -1))
+        if position < len(free):
+            remaining, bin_id = free.pop(position)
+            bins[bin_id].append(item)
+        else:
+            remaining, bin_id = capacity, len(bins)
+            bins.append([item])
+        if remaining - size > 0:
+            bisect.insort(free, (remaining - size, bin_id))
+    return bins
+
+
+def iter_packs(files, index, bins):
+    """按箱的顺序产出 (样本行列表, token 数)。"""
+    maps = []
+    handles = []
+    try:
+        for path in files:
+            f = open(path, "rb")
+            handles.append(f)
+            maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None)
+        for members in bins:
+            lines = []
+            for item in members:
+                entry = index[item]
+                start = int(entry["offset"])
+                lines.append(maps[entry["file"]][start:start + int(entry["size"])].decode("utf-8"))
+            yield lines, int(index["tokens"][members].sum())
+    finally:
+        for m in maps:
+            if m is not None:
+                m.close()
+        for f in handles:
+            f.close()
+
+
+def utilization_report(index, bins, capacity):
+    """统计打包效果：序列数、填充率（及逐条 padding 到 capacity 时的填充率）和各序列的填充分布。"""
+    tokens = index["tokens"].astype(np.int64)
+    fills = np.array([tokens[members].sum() for members in bins], dtype=np.int64)
+    oversize = int((tokens > capacity).sum())
+    used = np.minimum(fills, capacity)
+    return {
+        "records": int(len(index)),
+        "packs": int(len(bins)),
+        "capacity": capacity,
+        "total_tokens": int(tokens.sum()),
+        "utilization": float(used.sum() / (len(bins) * capacity)) if len(bins) else 0.0,
+        "unpacked_utilization": float(np.minimum(tokens, capacity).sum() / (len(index) * capacity)) if len(index) else 0.0,
+        "oversize_records": oversize,
+        "fill_histogram": {f"{low}-{low + 10}%": int(count) for low, count in zip(
+            range(0, 100, 10), np.histogram(used / capacity * 100, bins=10, range=(0, 100))[0])},
+    }
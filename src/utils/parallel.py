@@ -0,0 +1,117 @@
+"""
+离线转换脚本共用的多进程驱动。
+把输入切分成若干块交给进程池中的现有逐条转换函数处理，再按输入顺序合并结果，
+因此依赖输入序号的 ID（如 converted_item_{i:05d}、vague_task_{base_id:05d}_...）与单进程运行完全一致。
+"""
+import os
+from collections import deque
+from multiprocessing import Pool
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DEFAULT_CHUNK_ITEMS = 1000
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def split_line_ranges(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    按大约 chunk_bytes 的大小把文件切成以换行符对齐的字节区间。
+    返回 [(起始字节, 结束字节, 该区间第一行的行号), ...]，行号从 0 开始。
+    """
+    ranges = []
+    start = 0
+    line_index = 0
+    with open(path, "rb") as f:
+        while True:
+            f.seek(start + chunk_bytes)
+            tail = f.readline() # 读到当前行末尾，保证区间在换行处结束
+            end = f.tell()
+            if not tail or end <= start:
+                end = os.path.getsize(path)
+            if end <= start:
+                break
+            ranges.append((start, end, line_index))
+            f.seek(start)
+            line_index += f.read(end - start).count(b"\n")
+            start = end
+    return ranges
+
+
+def _convert_line_range(fn, path, start, end, first_line):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop() # 区间以换行结尾时最后一段为空
+    return [fn(first_line + offset, line.decode("utf-8")) for offset, line in enumerate(lines)]
+
+
+def _convert_batch(fn, batch):
+    return [fn(index, item) for index, item in batch]
+
+
+def _ordered_results(pool, func, tasks, max_pending):
+    """
+    以有限的在途任务数提交 tasks，并按提交顺序产出每个任务返回的结果列表中的元素。
+    （Pool.imap 会一次性消费整个输入迭代器，不适合流式输入。）
+    """
+    pending = deque()
+    for args in tasks:
+        pending.append(pool.apply_async(func, args))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def map_lines_ordered(path, fn, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES, initializer=None, initargs=()):
+    """
+    对文本文件的每一行调用 fn(行号, 行内容)，按行号顺序产出返回值。
+    行号从 0 开始，包含空行；行内容不含换行符。
+    fn、initializer 必须是模块级函数（或其 functools.partial），以便传给子进程。
+    workers 为 1 时不创建进程池，直接在当前进程中运行。
+    """
+    workers = workers or default_workers()
+    tasks = ((fn, path, start, end, first_line)
+             for start, end, first_line in split_line_ranges(path, chunk_bytes))
+
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for args in tasks:
+            yield from _convert_line_range(*args)
+        return
+
+    with Pool(workers, initializer, initargs) as pool:
+        yield from _ordered_results(pool, _convert_line_range, tasks, workers * 2)
+
+
+def map_items_ordered(items, fn, workers=None, chunk_size=DEFAULT_CHUNK_ITEMS, initializer=None, initargs=()):
+    """
+    对可迭代对象（可以是流式生成器）中的每个元素调用 fn(序号, 元素)，按序号顺序产出返回值。
+    输入按 chunk_size 个元素分块发给子进程，同时在途的块数不超过 2 * workers，内存占用有界。
+    """
+    workers = workers or default_workers()
+
+    def batches():
+        batch = []
+        for index, item in enumerate(items):
+            batch.append((index, item))
+            if len(batch) >= chunk_size:
+                yield (fn, batch)
+                batch = []
+        if batch:
+            yield (fn, batch)
+
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for args in batches():
+            yield from _convert_batch(*args)
+        return
+
+    with Pool(workers, initializer, initargs) as pool:
+        yield from _ordered_results(pool, _convert_batch, batches(), workers * 2)
@@ -0,0 +1,138 @@
+"""
+提示词静态前缀的上下文缓存。
+
+提示词拆成所有请求都相同的静态前缀（任务说明、JSON Schema、要求）和每个请求不同的后缀：
+- InlinePrefix：每个请求都发送 前缀 + 后缀；
+- ContextCachedPrefix：把前缀注册为 Gemini 的上下文缓存 (cachedContents)，之后的请求只发送后缀并通过
+  GenerateContentConfig.cached_content 引用缓存，前缀不再作为输入 token 重复发送和预填充。
+  第一次实际发送请求时才注册（响应缓存全部命中时不会创建），注册失败（模型不支持缓存等）时退回 InlinePrefix 的行为。
+  Gemini 的显式上下文缓存有最小长度（gemini-2.0-flash 为 4096 tokens，见 MIN_CACHE_TOKENS），
+  估计的前缀长度不足 min_tokens 时不调用 caches.create，直接内联发送。
+
+两种方式的完整提示词相同，响应缓存始终以 full_prompt(后缀) 为键，切换方式不会使已缓存的响应失效。
+本地 mock 服务器 (src/bench/mock_gemini.py) 实现了 cachedContents 接口，可以在压测中对比两种方式。
+"""
+import threading
+import time
+
+from utils.ratelimit import estimate_tokens
+
+PREFIX_SEPARATOR = "\n\n"
+MIN_CACHE_TOKENS = 4096 # Gemini 显式上下文缓存的最小输入 token 数（gemini-2.0-flash）
+
+
+class InlinePrefix:
+    """在每个请求中直接发送前缀。"""
+
+    def __init__(self, text):
+        self.text = text
+        self.name = None # 上下文缓存的资源名，内联发送时为 None
+
+    def full_prompt(self, suffix):
+        """前缀和后缀拼接成的完整提示词，用作响应缓存的键。"""
+        return self.text + PREFIX_SEPARATOR + suffix
+
+    def request(self, suffix, config=None):
+        """返回实际发送的 (contents, config)。"""
+        return self.full_prompt(suffix), config
+
+    def release(self):
+        pass
+
+
+class ContextCachedPrefix(InlinePrefix):
+    """
+    把前缀注册为上下文缓存，请求只发送后缀。
+
+    Args:
+        text (str): 静态前缀。
+        client: Gemini 客户端（可以是 utils.llm_client.LazyClient）。
+        model (str): 模型名，上下文缓存只能被同一模型的请求使用。
+        ttl (int): 缓存的存活秒数。
+        refresh_margin (int): 距离过期不足这么多秒时，在下一次请求前延长存活时间。
+        display_name (str): 缓存的显示名称，便于在控制台中识别。
+        min_tokens (int): 模型允许缓存的最小 token 数，估计的前缀长度不足时不注册缓存。
+    """
+
+    def __init__(self, text, client, model, ttl=3600, refresh_margin=300, display_name=None,
+                 min_tokens=MIN_CACHE_TOKENS):
+        super().__init__(text)
+        self.client = client
+        self.model = model
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.display_name = display_name
+        self.min_tokens = min_tokens
+        self.expires = 0.0
+        self._registered = False
+        self._lock = threading.Lock()
+
+    def _register(self):
+        """创建上下文缓存，前缀太短或创建失败时打印原因并退回内联发送。"""
+        tokens = estimate_tokens(self.text)
+        if tokens < self.min_tokens:
+            print(f"提示词前缀约 {tokens} tokens，短于上下文缓存的最小长度 {self.min_tokens}，改为在每个请求中发送")
+            return
+
+        from google.genai import types
+
+        try:
+            cached = self.client.caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=self.text)])],
+                ttl=f"{self.ttl}s",
+                display_name=self.display_name,
+            ))
+        except Exception as e:
+            print(f"无法创建上下文缓存，改为在每个请求中发送提示词前缀: {e}")
+            return
+        self.name = cached.name
+        self.expires = time.time() + self.ttl
+        usage = getattr(cached, "usage_metadata", None)
+        tokens = getattr(usage, "total_token_count", None)
+        print(f"提示词前缀已注册为上下文缓存 {self.name}" + (f"（{tokens} tokens）" if tokens else ""))
+
+    def _refresh(self):
+        """缓存快要过期时延长存活时间，失败时退回内联发送。"""
+        from google.genai import types
+
+        try:
+            self.client.caches.update(name=self.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+            self.expires = time.time() + self.ttl
+        except Exception as e:
+            print(f"无法延长上下文缓存 {self.name}，改为在每个请求中发送提示词前缀: {e}")
+            self.name = None
+
+    def _prepare(self):
+        """
+        第一次请求前注册缓存，之后在快要过期时延长存活时间。
+        两者都是同步调用，每个 TTL 周期最多一次，异步流水线中会短暂阻塞事件循环。
+        """
+        with self._lock:
+            if not self._registered:
+                self._register()
+                self._registered = True
+            elif self.name is not None and time.time() >= self.expires - self.refresh_margin:
+                self._refresh()
+
+    def request(self, suffix, config=None):
+        if not self._registered or (self.name is not None and time.time() >= self.expires - self.refresh_margin):
+            self._prepare()
+        name = self.name
+        if name is None:
+            return super().request(suffix, config)
+
+        from google.genai import types
+
+        if config is None:
+            return suffix, types.GenerateContentConfig(cached_content=name)
+        return suffix, config.model_copy(update={"cached_content": name})
+
+    def release(self):
+        """删除上下文缓存，不再为剩余的存活时间付费。"""
+        with self._lock:
+            name, self.name = self.name, None
+        if name is not None:
+            try:
+                self.client.caches.delete(name=name)
+            except Exception as e:
+                print(f"删除上下文缓存 {name} 失败: {e}")
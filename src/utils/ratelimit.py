@@ -0,0 +1,105 @@
+"""
+令牌桶限流器，同时约束每分钟请求数 (RPM) 和每分钟 token 数 (TPM)。
+同一个限流器既可以在线程中使用 (acquire)，也可以在 asyncio 中使用 (acquire_async)。
+"""
+import asyncio
+import threading
+import time
+
+
+def estimate_tokens(text):
+    """
+    粗略估计文本的 token 数：中日韩字符约 1 个字符 1 个 token，其余约 4 个字符 1 个 token。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+
+class TokenBucket:
+    """
+    单个令牌桶：容量为 capacity，每秒补充 rate 个令牌。
+    采用"先扣除、再等待"的方式：令牌可以透支，透支部分换算成调用方需要等待的时间，
+    这样并发请求会按到达顺序依次排队，而不需要轮询。
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """扣除 amount 个令牌，返回需要等待的秒数。"""
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计算，否则永远等不到足够的令牌
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def wait_time(self, amount, now):
+        """不扣除令牌，返回现在扣除 amount 个令牌需要等待的秒数。"""
+        self._refill(now)
+        shortfall = min(amount, self.capacity) - self.tokens
+        return shortfall / self.rate if shortfall > 0 else 0.0
+
+    def refund(self, amount):
+        """归还多扣的令牌（amount 为负数时表示补扣）。"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    组合 RPM 与 TPM 两个令牌桶。rpm 或 tpm 为 None/0 时不限制对应维度。
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm, rpm / 60.0) if rpm else None
+        self._tokens = TokenBucket(tpm, tpm / 60.0) if tpm else None
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            return wait
+
+    def wait_time(self, tokens=0):
+        """现在发送一个消耗约 tokens 个 token 的请求需要等待的秒数（不占用配额），用于在多个后端之间选择。"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            return wait
+
+    def acquire(self, tokens=0):
+        """阻塞直到可以发送一个消耗约 tokens 个 token 的请求。"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """acquire 的 asyncio 版本。"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated, actual):
+        """
+        请求完成后，用 API 返回的实际 token 数修正发送前的预估值。
+        """
+        if self._tokens is None or actual is None:
+            return
+        with self._lock:
+            self._tokens.refund(estimated - actual)
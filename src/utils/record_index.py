@@ -0,0 +1,230 @@
+"""
+转换输出 (JSONL) 的偏移索引：按 ID 或位置 O(1) 取出任意一条样本，按标签快速随机抽样，不需要扫描或加载整个文件。
+
+索引保存在同目录的 <文件名>.records.idx 侧车文件中（numpy .npz 格式）：
+- records：每条样本一项 (偏移, 字节长度, proactive_category 编码, sub_category 编码, requires_tool)，共 17 字节；
+- labels：各标签列的取值表，编码即取值在表中的下标；
+- id_hashes / slots：ID 的 64 位 blake2b 哈希，以及开放寻址（线性探测）哈希表，
+  槽中保存样本位置 + 1（0 表示空槽），装载因子不超过 0.5；
+- sources：输入文件的 (路径, 大小, 修改时间)，文件变化后索引自动失效并重建。
+读取时 mmap 整个 JSONL，只解析被取出的那一行。压缩文件和分片目录无法按偏移读取，不支持。
+"""
+import hashlib
+import json
+import mmap
+import os
+
+import numpy as np
+
+from utils.packing import line_offsets
+from utils.parallel import map_lines_ordered
+
+LABEL_FIELDS = ("proactive_category", "sub_category")
+RECORD_DTYPE = np.dtype([("offset", "<u8"), ("size", "<u4"), ("proactive_category", "<u2"),
+                         ("sub_category", "<u2"), ("requires_tool", "i1")])
+MISSING_LABEL = 0xFFFF # 标签缺失时的编码
+_EMPTY_SLOT = 0
+
+
+INDEX_SUFFIX = ".records.idx" # 与工具目录索引 (utils.tool_index 的 .tools.idx) 区分，同一文件可以同时有两种索引
+
+
+def index_path_for(path):
+    return path + INDEX_SUFFIX
+
+
+def id_hash(record_id):
+    """ID 的 64 位哈希（跨进程稳定，不受 PYTHONHASHSEED 影响）。"""
+    return int.from_bytes(hashlib.blake2b(str(record_id).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def record_keys(index, line):
+    """
+    返回 (ID 哈希, proactive_category, sub_category, requires_tool)，空行或无法解析时返回 None。
+    供多进程驱动在子进程中调用。
+    """
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        print(f"  - 跳过第 {index + 1} 行，JSON 解析失败.")
+        return None
+    if not isinstance(record, dict):
+        return None
+    requires_tool = record.get("requires_tool")
+    return (id_hash(record.get("id")), record.get("proactive_category"), record.get("sub_category"),
+            -1 if not isinstance(requires_tool, bool) else int(requires_tool))
+
+
+def _build_slots(hashes):
+    """开放寻址哈希表：容量为不小于 2n 的 2 的幂，冲突时线性探测下一个槽。"""
+    capacity = 1 << max(1, (2 * len(hashes) - 1).bit_length())
+    mask = capacity - 1
+    slots = np.zeros(capacity, dtype=np.uint32)
+    for position, h in enumerate(hashes.tolist()):
+        slot = h & mask
+        while slots[slot] != _EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        slots[slot] = position + 1
+    return slots
+
+
+def _source_signature(path):
+    return [path, os.path.getsize(path), os.stat(path).st_mtime_ns]
+
+
+def build_record_index(path, workers=None):
+    """
+    扫描 path 建立索引，返回 (records, labels, id_hashes, slots)。
+    换行符位置由 numpy 在 mmap 上扫描得到，只有提取 ID 和标签需要解析 JSON（可多进程）。
+    """
+    starts, sizes = line_offsets(path)
+    keys = list(map_lines_ordered(path, record_keys, workers))
+    valid = np.array([key is not None for key in keys], dtype=bool)
+    keys = [key for key in keys if key is not None]
+
+    records = np.empty(len(keys), dtype=RECORD_DTYPE)
+    records["offset"] = starts[:len(valid)][valid]
+    records["size"] = sizes[:len(valid)][valid]
+    records["requires_tool"] = [key[3] for key in keys]
+
+    labels = {}
+    for column, field in enumerate(LABEL_FIELDS, start=1):
+        values = {}
+        codes = [MISSING_LABEL if key[column] is None else values.setdefault(key[column], len(values)) for key in keys]
+        if len(values) >= MISSING_LABEL:
+            raise ValueError(f"Too many distinct values for {field}: {len(values)}")
+        records[field] = codes
+        labels[field] = list(values)
+
+    id_hashes = np.array([key[0] for key in keys], dtype=np.uint64)
+    return records, labels, id_hashes, _build_slots(id_hashes)
+
+
+class RecordIndex:
+    """
+    已打开的索引和 JSONL 文件。用 open_record_index 打开（索引缺失或过期时自动重建）。
+
+    用法：
+        with open_record_index("dataset/proactive_annotations_from_in3.jsonl") as dataset:
+            dataset.get("vague_task_00042_assistant_action_3")
+            dataset[1234]
+            dataset.sample(20, seed=0, proactive_category="clarification")
+    """
+
+    def __init__(self, path, records, labels, id_hashes, slots):
+        self.path = path
+        self.records = records
+        self.labels = labels
+        self.id_hashes = id_hashes
+        self.slots = slots
+        self._mask = len(slots) - 1
+        self._f = open(path, "rb")
+        self._mmap = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def __len__(self):
+        return len(self.records)
+
+    def line(self, position):
+        """第 position 条样本的原始 JSON 行（bytes，不含换行符）。"""
+        entry = self.records[position]
+        offset = int(entry["offset"])
+        return self._mmap[offset:offset + int(entry["size"])]
+
+    def __getitem__(self, position):
+        return json.loads(self.line(position))
+
+    def position_of(self, record_id):
+        """返回 ID 对应的样本位置，不存在时返回 None。哈希相同时读取样本核对 ID。"""
+        h = id_hash(record_id)
+        slot = h & self._mask
+        while True:
+            value = int(self.slots[slot])
+            if value == _EMPTY_SLOT:
+                return None
+            position = value - 1
+            if int(self.id_hashes[position]) == h and str(self[position].get("id")) == str(record_id):
+                return position
+            slot = (slot + 1) & self._mask
+
+    def get(self, record_id, default=None):
+        position = self.position_of(record_id)
+        return self[position] if position is not None else default
+
+    def positions(self, requires_tool=None, **labels):
+        """
+        返回满足所有条件的样本位置数组，例如 positions(proactive_category="clarification", requires_tool=False)。
+        只在索引数组上过滤，不读取 JSONL。
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        for field, value in labels.items():
+            if field not in LABEL_FIELDS:
+                raise ValueError(f"Unknown label field: {field}")
+            values = self.labels[field]
+            code = values.index(value) if value in values else None
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.records[field] == code
+        if requires_tool is not None:
+            mask &= self.records["requires_tool"] == int(requires_tool)
+        return np.flatnonzero(mask)
+
+    def sample(self, k, seed=None, **conditions):
+        """不放回地随机抽取 k 条（不足 k 条时全部返回）满足条件的样本，只读取被抽中的行。"""
+        candidates = self.positions(**conditions)
+        rng = np.random.default_rng(seed)
+        chosen = rng.choice(candidates, size=min(k, len(candidates)), replace=False)
+        return [self[int(position)] for position in chosen]
+
+    def label_counts(self):
+        """各标签取值的样本数。"""
+        counts = {}
+        for field in LABEL_FIELDS:
+            codes, numbers = np.unique(self.records[field], return_counts=True)
+            counts[field] = {(self.labels[field][code] if code != MISSING_LABEL else None): int(number)
+                             for code, number in zip(codes.tolist(), numbers.tolist())}
+        return counts
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_record_index(index_path, path, records, labels, id_hashes, slots):
+    # 传入文件对象，避免 np.savez 自动追加 .npz 扩展名
+    with open(index_path, "wb") as f:
+        np.savez(f, records=records, id_hashes=id_hashes, slots=slots,
+                 labels=json.dumps(labels, ensure_ascii=False), sources=json.dumps(_source_signature(path)))
+
+
+def load_record_index(index_path, path):
+    """索引存在且 JSONL 文件（路径、大小、修改时间）未变化时返回 (records, labels, id_hashes, slots)，否则返回 None。"""
+    if not os.path.exists(index_path):
+        return None
+    with np.load(index_path) as data:
+        if json.loads(str(data["sources"])) != _source_signature(path):
+            return None
+        return data["records"], json.loads(str(data["labels"])), data["id_hashes"], data["slots"]
+
+
+def open_record_index(path, index_path=None, workers=None, rebuild=False):
+    """
+    打开 path 的索引，侧车文件缺失、过期或 rebuild 为 True 时重新建立并保存。
+    """
+    if not path.endswith(".jsonl") or not os.path.isfile(path):
+        raise ValueError(f"Offset index requires an uncompressed JSONL file: {path}")
+    index_path = index_path or index_path_for(path)
+    loaded = None if rebuild else load_record_index(index_path, path)
+    if loaded is None:
+        print(f"建立索引: {path}")
+        loaded = build_record_index(path, workers)
+        save_record_index(index_path, path, *loaded)
+    return RecordIndex(path, *loaded)
@@ -0,0 +1,149 @@
+"""
+基于 SQLite 的 LLM 响应缓存。
+键为 (模型, 提示词, 生成参数) 的 SHA-256 哈希，支持按总大小和存活时间淘汰，并统计命中/未命中次数。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_FILE = "cache/gemini_responses.sqlite"
+
+
+def _to_jsonable(obj):
+    # GenerateContentConfig 等 pydantic 对象
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(exclude_none=True, mode="json")
+    return str(obj)
+
+
+def make_cache_key(model, prompt, config=None):
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "config": config},
+        sort_keys=True, ensure_ascii=False, default=_to_jsonable,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    持久化响应缓存，可在多个线程之间共享。
+
+    Args:
+        path (str): SQLite 文件路径。
+        max_bytes (int): 缓存内容总大小上限，超出时按最近访问时间淘汰，None 表示不限制。
+        max_age (float): 条目最长存活秒数，过期条目视为未命中并在淘汰时删除，None 表示不过期。
+    """
+
+    EVICT_EVERY = 100 # 每写入多少条检查一次是否需要淘汰
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, max_bytes=None, max_age=None):
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+        self._conn.commit()
+
+    def get(self, model, prompt, config=None):
+        """返回缓存的响应文本，未命中时返回 None。"""
+        key = make_cache_key(model, prompt, config)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, prompt, response, config=None):
+        key = make_cache_key(model, prompt, config)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def discard(self, model, prompt, config=None):
+        """删除一条缓存（例如未通过校验的响应），下次运行时重新请求。"""
+        key = make_cache_key(model, prompt, config)
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        """删除过期条目，并在超出大小上限时删除最久未访问的条目。返回删除的条目数。"""
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self):
+        removed = 0
+        if self.max_age is not None:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            )
+            removed += cur.rowcount
+
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                stale_keys = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    stale_keys.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+                removed += len(stale_keys)
+
+        self._conn.commit()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
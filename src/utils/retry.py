@@ -0,0 +1,181 @@
+"""
+LLM 调用的错误分类与重试，以及记录最终失败请求的死信队列 (dead-letter queue)。
+
+- 429、408、5xx 以及超时、连接错误可以重试，其余错误（400 参数错误、403 权限等）重试也不会成功；
+- 重试前按 full jitter 指数退避等待 random(0, min(max_delay, base_delay * 2^attempt)) 秒，
+  服务器通过 Retry-After 头或 google.rpc.RetryInfo 给出等待时间时至少等待这么久；
+- 遇到永久错误或重试次数用完的记录写入死信 JSONL，之后用 --retry-failed 只重放这些记录。
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+try:
+    import httpx
+    _TRANSIENT_ERRORS = (TimeoutError, ConnectionError, httpx.TimeoutException, httpx.NetworkError,
+                         httpx.RemoteProtocolError)
+except ImportError:
+    _TRANSIENT_ERRORS = (TimeoutError, ConnectionError)
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+_DURATION_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)s\s*$")
+
+
+def status_code(exc):
+    """返回异常对应的 HTTP 状态码（google.genai.errors.APIError.code 或 response.status_code），没有时返回 None。"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def retry_after_hint(exc):
+    """返回服务器建议的等待秒数（Retry-After 头或 RetryInfo.retryDelay），没有时返回 None。"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        error = details.get("error", details)
+        for detail in (error.get("details") if isinstance(error, dict) else None) or []:
+            if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("google.rpc.RetryInfo"):
+                match = _DURATION_PATTERN.match(str(detail.get("retryDelay", "")))
+                if match:
+                    return float(match.group(1))
+    return None
+
+
+def classify_error(exc):
+    """返回 (是否可以重试, 错误描述)。"""
+    code = status_code(exc)
+    if code is not None:
+        message = getattr(exc, "message", None) or str(exc)
+        return code in RETRYABLE_STATUS, f"HTTP {code}: {message}"
+    return isinstance(exc, _TRANSIENT_ERRORS), f"{type(exc).__name__}: {exc}"
+
+
+class RetryPolicy:
+    """
+    Args:
+        max_attempts (int): 包括第一次在内的最大尝试次数。
+        base_delay (float): 第一次重试的退避上限（秒），之后每次翻倍。
+        max_delay (float): 退避上限（秒），不限制服务器建议的等待时间。
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, exc):
+        """第 attempt 次（从 0 开始）失败后的等待秒数。"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = retry_after_hint(exc)
+        return max(backoff, hint) if hint is not None else backoff
+
+    def _should_retry(self, attempt, exc):
+        return attempt + 1 < self.max_attempts and classify_error(exc)[0]
+
+    def call(self, fn, on_retry=None):
+        """
+        调用 fn()，可重试的错误按退避策略重试，永久错误或重试次数用完时抛出最后一次的异常。
+        每次重试前调用 on_retry(exc, 等待秒数)。
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return fn()
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                wait = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, wait)
+                time.sleep(wait)
+
+    async def acall(self, fn, on_retry=None):
+        """call 的异步版本，fn 返回协程。"""
+        for attempt in range(self.max_attempts):
+            try:
+                return await fn()
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                wait = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, wait)
+                await asyncio.sleep(wait)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def dead_letter_path_for(output_file):
+    return output_file + ".failed.jsonl"
+
+
+class DeadLetterQueue:
+    """
+    线程安全的死信 JSONL，每行 {"id", "stage", "error", "retryable", "time", "input"}。
+    retryable 为 true 表示重试次数用完（如持续 429），false 表示永久错误。
+    每次运行都会重新尝试上次失败的记录，所以打开时清空旧内容；关闭时没有任何记录则删除文件。
+    """
+
+    def __init__(self, path):
+        dead_letter_dir = os.path.dirname(path)
+        if dead_letter_dir:
+            os.makedirs(dead_letter_dir, exist_ok=True)
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._f = open(path, "w", encoding="utf-8")
+
+    def add(self, record_id, stage, exc, input_data):
+        retryable, error = classify_error(exc)
+        entry = {"id": record_id, "stage": stage, "error": error, "retryable": retryable,
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "input": input_data}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+            if self.count == 0:
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_dead_letters(path):
+    """
+    读取死信文件，返回 [(记录 ID, 输入), ...]，同一 ID 只保留最后一次；文件不存在时返回空列表。
+    """
+    if not os.path.exists(path):
+        return []
+    entries = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry["id"]] = entry["input"]
+    return list(entries.items())
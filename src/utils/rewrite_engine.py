@@ -0,0 +1,324 @@
+"""
+abg-coqa / seal-tools 共用的流式 LLM 改写引擎。
+逐行读取输入 JSONL，多线程调用改写函数，每完成一条立即写入输出文件，
+并把完成的记录 ID 追加到检查点日志 (journal)。中断后重新运行会跳过日志中已有的记录。
+调用最终失败的记录写入死信队列 <输出文件>.failed.jsonl，retry_failed=True 时只重放其中的记录。
+
+TaggedReplyRewriter 是两个改写脚本共用的提示词构建、调用和 <think>/<perplexity>/final_answer 解析逻辑，
+脚本只提供 describe_record 和提示词文本，再交给 rewrite_jsonl_file 处理整个文件。
+"""
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.batching import build_batch_prompt, split_batch_response, format_reply
+from utils.llm_client import cache_model, generate_text
+from utils.metrics import metrics
+from utils.retry import DeadLetterQueue, dead_letter_path_for, read_dead_letters
+from utils.validation import parse_tagged_reply, QuarantineWriter, quarantine_path_for
+
+
+def journal_path_for(output_file):
+    return output_file + ".journal"
+
+
+def load_journal(journal_file):
+    """
+    读取检查点日志，返回已完成的记录 ID 集合。
+    """
+    done = set()
+    if not os.path.exists(journal_file):
+        return done
+    with open(journal_file, "r", encoding="utf-8") as f:
+        for line in f:
+            record_id = line.rstrip("\n")
+            if record_id:
+                done.add(record_id)
+    return done
+
+
+def iter_jsonl_records(input_file):
+    """
+    逐行读取 JSONL，产出 (记录 ID, 记录)。没有 id 字段的记录使用行号作为 ID。
+    不是 JSON 对象或没有 messages 列表的行无法改写，打印后跳过。
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过第 {line_num} 行，JSON 解析失败: {e}")
+                continue
+            if not isinstance(record, dict) or not isinstance(record.get("messages"), list) or not record["messages"]:
+                print(f"跳过第 {line_num} 行，不是包含 messages 列表的 JSON 对象")
+                continue
+            yield str(record.get("id", f"line_{line_num}")), record
+
+
+def build_rewritten_record(record_id, record, assistant_content):
+    """
+    用新的 assistant 回复替换记录的最后一条消息，构建输出记录。
+    record_id 为 iter_jsonl_records 给出的 ID（记录本身没有 id 时为行号）。
+    """
+    new_messages = record["messages"]
+    new_messages[-1] = {
+        "role": "assistant",
+        "content": assistant_content
+    }
+
+    return {
+        "id": record.get("id", record_id),
+        "messages": new_messages,
+        "proactive_category": record.get("proactive_category", "tool_use"),
+        "sub_category": record.get("sub_category", "multi_api_call"),
+        "source_scene_id": record.get("source_scene_id", "")
+    }
+
+
+def _reply_single(reply_fn, record_id, record):
+    return {record_id: reply_fn(record)}
+
+
+def stream_rewrite(input_file, output_file, reply_fn, journal_file=None, max_workers=4,
+                   batch_reply_fn=None, batch_size=1, max_batch_attempts=2, retry_failed=False):
+    """
+    对 input_file 中的每条记录调用 reply_fn(record) 生成新的 assistant 回复，
+    替换最后一条消息后写入 output_file。
+    reply_fn 返回空值或抛出异常的记录不会写入日志，下次运行时会重新处理；
+    抛出异常（重试次数用完或永久错误）的记录同时写入死信队列，retry_failed=True 时只处理死信队列中的记录。
+    同时在途的请求数不超过 2 * max_workers，内存占用与输入大小无关。
+
+    提供 batch_reply_fn 且 batch_size > 1 时启用批量模式：每次把 batch_size 条记录
+    [(记录 ID, 记录), ...] 交给 batch_reply_fn，它返回 {记录 ID: 回复}。
+    缺失或解析失败的记录会重新排队，累计 max_batch_attempts 次批量失败后改用 reply_fn 单独处理；
+    batch_reply_fn 抛出异常时，这一批的记录直接改用 reply_fn 单独处理，不再重新打包。
+
+    返回本次运行新写入的记录数。
+    """
+    journal_file = journal_file or journal_path_for(output_file)
+    done = load_journal(journal_file)
+    dead_letter_file = dead_letter_path_for(output_file)
+    batched = batch_reply_fn is not None and batch_size > 1
+    unit_size = batch_size if batched else 1
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if retry_failed:
+        # 死信队列在打开新的死信文件时清空，必须先读出
+        source = [(record_id, record) for record_id, record in read_dead_letters(dead_letter_file)
+                  if record_id not in done]
+        print(f"重放死信队列中的 {len(source)} 条记录")
+        mode = "a"
+    else:
+        source = iter_jsonl_records(input_file)
+        if done:
+            print(f"从检查点恢复：已完成 {len(done)} 条记录，将跳过")
+            mode = "a"
+        else:
+            mode = "w"
+
+    written = 0
+    failed = 0
+    max_in_flight = max_workers * 2
+    pending = ((record_id, record) for record_id, record in source if record_id not in done)
+    requeued = deque() # 批量结果中缺失或解析失败、等待重新打包的记录
+    batch_attempts = {}
+
+    with open(output_file, mode, encoding="utf-8") as f_out, \
+         open(journal_file, mode, encoding="utf-8") as f_journal, \
+         DeadLetterQueue(dead_letter_file) as dead_letters, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        in_flight = {}
+
+        def submit(unit, as_batch):
+            for record_id, _ in unit:
+                print(f"处理记录 ID: {record_id}")
+            if as_batch:
+                future = executor.submit(batch_reply_fn, unit)
+            else:
+                record_id, record = unit[0]
+                future = executor.submit(_reply_single, reply_fn, record_id, record)
+            in_flight[future] = (unit, as_batch)
+
+        def next_unit():
+            unit = []
+            while len(unit) < unit_size and requeued:
+                unit.append(requeued.popleft())
+            while len(unit) < unit_size:
+                item = next(pending, None)
+                if item is None:
+                    break
+                unit.append(item)
+            return unit
+
+        def drain():
+            nonlocal written, failed
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                unit, as_batch = in_flight.pop(future)
+                error = None
+                try:
+                    replies = future.result() or {}
+                except Exception as e:
+                    print(f"处理记录 {', '.join(record_id for record_id, _ in unit)} 时出错: {e}")
+                    replies = {}
+                    error = e
+
+                for record_id, record in unit:
+                    assistant_content = replies.get(record_id)
+
+                    if not assistant_content:
+                        if as_batch and error is not None:
+                            # 批量调用本身失败（重试次数用完或永久错误），再打包一次也多半失败，直接单独处理
+                            submit([(record_id, record)], as_batch=False)
+                        elif as_batch:
+                            batch_attempts[record_id] = batch_attempts.get(record_id, 0) + 1
+                            if batch_attempts[record_id] < max_batch_attempts:
+                                requeued.append((record_id, record))
+                            else:
+                                submit([(record_id, record)], as_batch=False)
+                        else:
+                            failed += 1
+                            metrics.inc("records_total", status="failed")
+                            if error is not None:
+                                dead_letters.add(record_id, "rewrite", error, record)
+                        continue
+
+                    batch_attempts.pop(record_id, None)
+                    result = build_rewritten_record(record_id, record, assistant_content)
+
+                    # 先写结果再写日志：崩溃时最多重复处理一条记录，不会丢失记录
+                    with metrics.timer("write"):
+                        f_out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        f_out.flush()
+                        f_journal.write(record_id + "\n")
+                        f_journal.flush()
+                    written += 1
+                    metrics.inc("records_total", status="written")
+
+        while True:
+            while len(in_flight) < max_in_flight:
+                unit = next_unit()
+                if not unit:
+                    break
+                submit(unit, as_batch=batched)
+            if not in_flight:
+                break
+            drain()
+
+    print(f"处理完成！本次写入 {written} 条记录 ({metrics.rate('records_total', status='written'):.2f} 条/秒)，"
+          f"失败 {failed} 条，输出: {output_file}")
+    if dead_letters.count:
+        print(f"{dead_letters.count} 条记录调用失败，已写入 {dead_letter_file}，可用 --retry-failed 重放")
+    return written
+
+
+class TaggedReplyRewriter:
+    """
+    让模型按 <think>/<perplexity>/final_answer 格式重写记录的最后一条回复。
+
+    Args:
+        describe_record (callable): record -> 交给模型分析的记录内容，返回 None 时跳过该记录。
+        prompt_header (str): 单条模式的任务说明。
+        batch_prompt_header (str): 批量模式的任务说明。
+        response_format (str): 回复格式说明，批量模式下每个请求只出现一次。
+        client: Gemini 客户端或客户端池（见 utils.llm_client.make_llm_client）。
+        model (str): 模型名。
+        limiter (RateLimiter): 所有请求共用的限流器。
+        cache (ResponseCache): 响应缓存，None 时不缓存。
+        format_reply (callable): 解析出的 (think, perplexity, final_answer) -> assistant 回复。
+    """
+
+    def __init__(self, describe_record, prompt_header, batch_prompt_header, response_format, client, model,
+                 limiter=None, cache=None, format_reply=format_reply):
+        self.describe_record = describe_record
+        self.prompt_header = prompt_header
+        self.batch_prompt_header = batch_prompt_header
+        self.response_format = response_format
+        self.client = client
+        self.model = model
+        self.limiter = limiter
+        self.cache = cache
+        self.format_reply = format_reply
+        self.quarantine = None # 由 rewrite_jsonl_file 打开
+
+    def _generate(self, prompt):
+        # 429/5xx/超时由 generate_text 重试，最终失败时抛出异常，由 stream_rewrite 写入死信队列
+        return generate_text(self.client, self.model, prompt, cache=self.cache, limiter=self.limiter)
+
+    def reply(self, record):
+        """处理单条记录，返回新的 assistant 回复；没有可分析的内容或回复格式不完整时返回 None。"""
+        record_body = self.describe_record(record)
+        if record_body is None:
+            return None
+
+        prompt = f"{self.prompt_header}\n\n{record_body}\n\n{self.response_format}"
+        with metrics.timer("api"):
+            result_text = self._generate(prompt)
+
+        # 单次扫描解析 think/perplexity/final_answer，格式不完整时隔离，不再用固定文本补齐
+        with metrics.timer("parse"):
+            parts, reason = parse_tagged_reply(result_text)
+        if parts is None:
+            print(f"记录 {record.get('id')} 的回复格式不完整: {reason}")
+            metrics.inc("records_total", status="quarantined")
+            if self.quarantine is not None:
+                self.quarantine.add(record.get("id"), "rewrite", reason, response=result_text, input_data=record)
+            if self.cache is not None:
+                self.cache.discard(cache_model(self.client, self.model), prompt)
+            return None
+        return self.format_reply(*parts)
+
+    def reply_batch(self, items):
+        """批量处理 [(记录 ID, 记录), ...]，返回 {记录 ID: assistant 回复}，缺失或格式不完整的记录不在结果中。"""
+        blocks = []
+        for record_id, record in items:
+            record_body = self.describe_record(record)
+            if record_body is not None:
+                blocks.append((record_id, record_body))
+        if not blocks:
+            return {}
+
+        prompt = build_batch_prompt(self.batch_prompt_header, blocks, self.response_format)
+        with metrics.timer("api", batch="true"):
+            result_text = self._generate(prompt)
+
+        replies = {}
+        with metrics.timer("parse", batch="true"):
+            record_ids = [record_id for record_id, _ in blocks]
+            for record_id, reply_text in split_batch_response(result_text, record_ids).items():
+                parts, _ = parse_tagged_reply(reply_text)
+                if parts:
+                    replies[record_id] = self.format_reply(*parts)
+        # 有记录缺失或解析失败时删除缓存，否则重新打包成相同的批次时会命中缓存、重放同一个坏回复
+        if len(replies) < len(blocks) and self.cache is not None:
+            self.cache.discard(cache_model(self.client, self.model), prompt)
+        return replies
+
+
+def rewrite_jsonl_file(input_file, output_file, rewriter, max_workers=4, batch_size=1, retry_failed=False):
+    """
+    用 rewriter (TaggedReplyRewriter) 改写整个 JSONL 文件，结果边处理边写入，中断后重新运行会从检查点继续。
+    格式不完整的回复在单条处理时写入 <输出文件>.quarantine.jsonl，调用失败的记录写入死信队列；
+    retry_failed=True 时只重放上次死信队列中的记录。返回本次写入的记录数。
+    """
+    rewriter.quarantine = QuarantineWriter(quarantine_path_for(output_file))
+    try:
+        written = stream_rewrite(input_file, output_file, rewriter.reply, max_workers=max_workers,
+                                 batch_reply_fn=rewriter.reply_batch, batch_size=batch_size,
+                                 retry_failed=retry_failed)
+    finally:
+        rewriter.quarantine.close()
+    if rewriter.quarantine.count:
+        print(f"{rewriter.quarantine.count} 条回复格式不完整，已写入 {rewriter.quarantine.path}")
+    if rewriter.cache is not None:
+        stats = rewriter.cache.stats()
+        print(f"缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
+    return written
@@ -0,0 +1,226 @@
+"""
+所有转换脚本共用的数据集输出：
+- JsonlWriter：单个（可选 gzip/zstd 压缩的）JSONL 文件；
+- ShardedWriter：按大小滚动的压缩 JSONL 分片目录，附带 manifest.json，
+  记录每个分片的文件名、记录数、原始字节数和落盘字节数，下游可以并行读取各个分片。
+读取时用 iter_lines / iter_records，会自动识别普通文件、压缩文件和分片目录。
+zstd 压缩需要安装 zstandard 包，gzip 只依赖标准库。
+"""
+import gzip
+import io
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _require_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the 'zstandard' package: pip install zstandard") from None
+    return zstandard
+
+
+def _open_compressed_writer(raw, compression, level):
+    """在已打开的二进制文件对象上包装压缩流。"""
+    if compression is None:
+        return raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level if level is not None else 6)
+    if compression == "zstd":
+        zstandard = _require_zstandard()
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).stream_writer(raw, closefd=False)
+    raise ValueError(f"Unknown compression: {compression!r}")
+
+
+def _compression_from_path(path):
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+class JsonlWriter:
+    """
+    写单个 JSONL 文件，压缩格式由文件扩展名 (.gz / .zst) 决定。
+    write() 接受已序列化、不含换行符的一行。
+    """
+
+    def __init__(self, path, level=None):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.path = path
+        self.records = 0
+        self._raw = open(path, "wb")
+        self._stream = _open_compressed_writer(self._raw, _compression_from_path(path), level)
+
+    def write(self, line):
+        self._stream.write(line.encode("utf-8") + b"\n")
+        self.records += 1
+
+    def write_record(self, record):
+        self.write(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedWriter:
+    """
+    按大小滚动写出压缩 JSONL 分片，关闭时写出 manifest.json。
+
+    Args:
+        out_dir (str): 分片目录。
+        prefix (str): 分片文件名前缀，分片命名为 {prefix}-{序号:05d}.jsonl[.gz|.zst]。
+        max_bytes (int): 单个分片落盘大小的上限（压缩后，受压缩缓冲影响可能略微超出）。
+        compression (str): "gzip"、"zstd" 或 None。
+        level (int): 压缩级别，None 时使用各格式的默认值。
+    """
+
+    def __init__(self, out_dir, prefix="part", max_bytes=DEFAULT_SHARD_BYTES, compression="gzip", level=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression!r}")
+        if compression == "zstd":
+            _require_zstandard()
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.level = level
+        self.records = 0
+        self.shards = []
+        self._raw = None
+        self._stream = None
+        self._shard = None
+
+    def _open_shard(self):
+        name = f"{self.prefix}-{len(self.shards):05d}.jsonl{COMPRESSION_SUFFIXES[self.compression]}"
+        self._raw = open(os.path.join(self.out_dir, name), "wb")
+        self._stream = _open_compressed_writer(self._raw, self.compression, self.level)
+        self._shard = {"name": name, "records": 0, "bytes": 0, "compressed_bytes": 0}
+        self.shards.append(self._shard)
+
+    def _close_shard(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._shard["compressed_bytes"] = self._raw.tell()
+        self._raw.close()
+        self._raw = self._stream = self._shard = None
+
+    def write(self, line):
+        if self._shard is not None and self._raw.tell() >= self.max_bytes:
+            self._close_shard()
+        if self._shard is None:
+            self._open_shard()
+        data = line.encode("utf-8") + b"\n"
+        self._stream.write(data)
+        self._shard["records"] += 1
+        self._shard["bytes"] += len(data)
+        self.records += 1
+
+    def write_record(self, record):
+        self.write(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        if self._shard is not None:
+            self._close_shard()
+        manifest = {
+            "format": "jsonl",
+            "compression": self.compression,
+            "total_records": self.records,
+            "total_bytes": sum(shard["bytes"] for shard in self.shards),
+            "total_compressed_bytes": sum(shard["compressed_bytes"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        manifest_path = os.path.join(self.out_dir, MANIFEST_NAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sharded_dir_for(path):
+    """把 xxx.jsonl 形式的输出路径映射为同名分片目录 xxx/。"""
+    root, ext = os.path.splitext(path)
+    return root if ext == ".jsonl" else path + ".shards"
+
+
+def open_sink(path, sharded=False, compression="gzip", max_bytes=DEFAULT_SHARD_BYTES, level=None):
+    """
+    打开输出：sharded 为 False 时写 path 这一个文件（按扩展名决定是否压缩），
+    否则写入 sharded_dir_for(path) 目录下的分片。
+    """
+    if not sharded:
+        return JsonlWriter(path, level=level)
+    prefix = os.path.basename(sharded_dir_for(path))
+    return ShardedWriter(sharded_dir_for(path), prefix=prefix, max_bytes=max_bytes,
+                         compression=compression, level=level)
+
+
+def resolve_dataset_path(path):
+    """返回转换输出实际所在的位置：path 本身或其分片目录，都不存在时返回 None。"""
+    if os.path.exists(path):
+        return path
+    sharded = sharded_dir_for(path)
+    if os.path.isdir(sharded):
+        return sharded
+    return None
+
+
+def read_manifest(dataset_dir):
+    with open(os.path.join(dataset_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dataset_files(path):
+    """返回组成数据集的文件列表：分片目录按 manifest 顺序返回各分片，否则返回 [path]。"""
+    if os.path.isdir(path):
+        return [os.path.join(path, shard["name"]) for shard in read_manifest(path)["shards"]]
+    return [path]
+
+
+def open_text(path):
+    """以文本模式打开单个（可能压缩的）JSONL 文件。"""
+    compression = _compression_from_path(path)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        zstandard = _require_zstandard()
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_lines(path):
+    """逐行读取数据集（单个文件、压缩文件或分片目录），跳过空行。"""
+    for file_path in dataset_files(path):
+        with open_text(file_path) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip():
+                    yield line
+
+
+def iter_records(path):
+    for line in iter_lines(path):
+        yield json.loads(line)
@@ -0,0 +1,116 @@
+"""
+CoQA-Abg 故事去重：每个不同的 story 只写一次到侧表 (JSONL，{"story_id": 哈希, "story": 文本})，
+转换后的样本在第一条用户消息中用 story_ref 引用它。读取时再按需还原完整消息。
+"""
+import hashlib
+import json
+
+from utils.sink import iter_records
+
+STORY_QUESTION_TEMPLATE = "According to the story:\n\n{story}\n\nAnswer the following question:\n\n{question}"
+
+
+def combine_story_question(story, question):
+    return STORY_QUESTION_TEMPLATE.format(story=story, question=question)
+
+
+def story_hash(story):
+    return hashlib.sha256(story.encode("utf-8")).hexdigest()[:16]
+
+
+class StoryTableWriter:
+    """
+    按内容哈希去重写入故事侧表。只在内存中保留已写入故事的哈希。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._seen = set()
+        self._f = open(path, "w", encoding="utf-8")
+
+    def add(self, story):
+        """写入（如尚未写入）并返回故事的引用 ID。"""
+        story_id = story_hash(story)
+        if story_id not in self._seen:
+            self._seen.add(story_id)
+            self._f.write(json.dumps({"story_id": story_id, "story": story}, ensure_ascii=False) + "\n")
+        return story_id
+
+    def __len__(self):
+        return len(self._seen)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StoryCollector:
+    """
+    在转换子进程中代替 StoryTableWriter：计算故事的引用 ID，并收集本进程首次见到的故事，
+    由主进程通过 drain() 取回后写入侧表（主进程的 StoryTableWriter 负责跨进程去重）。
+    """
+
+    def __init__(self):
+        self._seen = set()
+        self._new_stories = []
+
+    def add(self, story):
+        story_id = story_hash(story)
+        if story_id not in self._seen:
+            self._seen.add(story_id)
+            self._new_stories.append(story)
+        return story_id
+
+    def drain(self):
+        new_stories, self._new_stories = self._new_stories, []
+        return new_stories
+
+
+def load_story_table(path):
+    """读取故事侧表，返回 {story_id: story}。"""
+    stories = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                stories[entry["story_id"]] = entry["story"]
+    return stories
+
+
+def materialize_item(item, stories):
+    """
+    将引用了故事的样本还原为完整消息（与 inline 模式的输出一致）。
+    """
+    messages = []
+    for message in item["messages"]:
+        story_id = message.get("story_ref")
+        if story_id is None:
+            messages.append(message)
+        else:
+            messages.append({
+                "role": message["role"],
+                "content": combine_story_question(stories[story_id], message["content"]),
+            })
+    return {**item, "messages": messages}
+
+
+def iter_materialized(items_path, stories_path):
+    """逐条产出还原后的样本。items_path 可以是 JSONL 文件、压缩文件或分片目录。"""
+    stories = load_story_table(stories_path)
+    for item in iter_records(items_path):
+        yield materialize_item(item, stories)
+
+
+def materialize_file(items_path, stories_path, output_path):
+    """把引用格式的输出还原为完整的 JSONL，返回写入的样本数。"""
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f_out:
+        for item in iter_materialized(items_path, stories_path):
+            f_out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,176 @@
+"""
+Seal-Tools 工具目录的二进制索引：api_name -> tool.jsonl 中该行的字节偏移和长度。
+索引和 tool.jsonl 都通过 mmap 只读映射，完整的工具记录（parameters、required 等）在用到时才解析；
+多个转换子进程打开同一份索引时共享操作系统的页缓存，无需各自重新解析 tool.jsonl。
+
+索引文件格式（小端）：
+    头部    magic(8s) version(I) count(I) source_size(Q) source_mtime_ns(Q)
+    条目    count 个 (record_offset(Q) record_length(I) name_offset(I) name_length(H))，按名称字节序排序
+    名称区  所有 api_name 的 UTF-8 字节依次拼接
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from functools import lru_cache
+
+MAGIC = b"TOOLIDX1"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQQ")
+_ENTRY = struct.Struct("<QIIH")
+
+
+INDEX_SUFFIX = ".tools.idx" # 与转换输出的偏移索引 (utils.record_index 的 .records.idx) 区分
+
+
+def index_path_for(tools_path):
+    return tools_path + INDEX_SUFFIX
+
+
+def build_tool_index(tools_path, index_path=None):
+    """
+    扫描 tool.jsonl 并写出索引文件。同名工具以最后一次出现为准。返回索引中的工具数。
+    """
+    index_path = index_path or index_path_for(tools_path)
+    locations = {}
+    offset = 0
+    with open(tools_path, "rb") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped:
+                try:
+                    api_name = json.loads(stripped).get("api_name")
+                except json.JSONDecodeError as e:
+                    print(f"Error parsing tools file '{tools_path}' at byte {offset}: {e}", file=sys.stderr)
+                    api_name = None
+                if api_name and isinstance(api_name, str):
+                    locations[api_name.encode("utf-8")] = (offset, len(line))
+            offset += len(line)
+
+    stat = os.stat(tools_path)
+    names = sorted(locations)
+    entries = bytearray()
+    names_blob = bytearray()
+    for name in names:
+        record_offset, record_length = locations[name]
+        entries += _ENTRY.pack(record_offset, record_length, len(names_blob), len(name))
+        names_blob += name
+
+    tmp_path = f"{index_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(names), stat.st_size, stat.st_mtime_ns))
+        f.write(entries)
+        f.write(names_blob)
+    os.replace(tmp_path, index_path) # 原子替换，避免其他进程读到写了一半的索引
+    return len(names)
+
+
+def _index_is_current(tools_path, index_path):
+    if not os.path.exists(index_path):
+        return False
+    stat = os.stat(tools_path)
+    with open(index_path, "rb") as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return False
+    magic, version, _, source_size, source_mtime_ns = _HEADER.unpack(header)
+    return (magic == MAGIC and version == VERSION
+            and source_size == stat.st_size and source_mtime_ns == stat.st_mtime_ns)
+
+
+def ensure_tool_index(tools_path, index_path=None):
+    """索引不存在或与 tool.jsonl 不一致时重新构建，返回索引路径。"""
+    index_path = index_path or index_path_for(tools_path)
+    if not _index_is_current(tools_path, index_path):
+        build_tool_index(tools_path, index_path)
+    return index_path
+
+
+class ToolCatalog:
+    """
+    按 api_name 懒加载工具记录的只读目录。
+
+    Args:
+        tools_path (str): tool.jsonl 路径。文件不存在时得到一个空目录并打印警告。
+        index_path (str): 索引路径，默认为 tools_path + ".tools.idx"，过期时自动重建。
+        cache_size (int): 已解析工具记录的 LRU 缓存大小。
+    """
+
+    def __init__(self, tools_path, index_path=None, cache_size=1024):
+        self.tools_path = tools_path
+        self.count = 0
+        self._index = None
+        self._tools = None
+        self.get = lru_cache(maxsize=cache_size)(self._load)
+
+        if not os.path.exists(tools_path):
+            print(f"Warning: Tools file '{tools_path}' not found. Using empty map.", file=sys.stderr)
+            return
+
+        index_path = ensure_tool_index(tools_path, index_path)
+        with open(index_path, "rb") as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = _HEADER.unpack_from(self._index, 0)[2]
+        self._names_base = _HEADER.size + self.count * _ENTRY.size
+        if os.path.getsize(tools_path) > 0:
+            with open(tools_path, "rb") as f:
+                self._tools = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, api_name):
+        return self._find(api_name) is not None
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._index, _HEADER.size + i * _ENTRY.size)
+
+    def _name(self, entry):
+        start = self._names_base + entry[2]
+        return self._index[start:start + entry[3]]
+
+    def _find(self, api_name):
+        """二分查找，返回 (record_offset, record_length) 或 None。"""
+        if not self.count or not isinstance(api_name, str):
+            return None
+        key = api_name.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            name = self._name(entry)
+            if name == key:
+                return entry[0], entry[1]
+            if name < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _load(self, api_name):
+        location = self._find(api_name)
+        if location is None or self._tools is None:
+            return None
+        offset, length = location
+        return json.loads(self._tools[offset:offset + length])
+
+    def description(self, api_name):
+        """返回工具的 api_description，未找到时返回 None。"""
+        tool = self.get(api_name)
+        return tool.get("api_description", "") if tool is not None else None
+
+    def required_parameters(self, api_name):
+        """返回 [(参数名, 参数说明), ...]，只包含 required 中列出的参数。"""
+        tool = self.get(api_name)
+        if tool is None:
+            return []
+        parameters = tool.get("parameters") or {}
+        return [(name, (parameters.get(name) or {}).get("description", ""))
+                for name in tool.get("required") or []]
+
+    def close(self):
+        for m in (self._index, self._tools):
+            if m is not None:
+                m.close()
+        self._index = self._tools = None
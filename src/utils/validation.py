@@ -0,0 +1,192 @@
+"""
+生成结果的校验：
+- compile_schema：把 JSON Schema（PROACTIVE_JSON_SCHEMA 用到的 type/enum/properties/required/items 子集）
+  预先编译成嵌套的闭包，校验时不再解释 schema 字典；
+- parse_tagged_reply：单次顺序扫描解析 <think>/<perplexity>/final_answer 格式的回复；
+- QuarantineWriter：把未通过校验的记录连同原因写入隔离文件，而不是用默认内容替代后混进数据集。
+"""
+import json
+import os
+import threading
+
+_TYPE_CHECKS = {
+    "string": lambda value: isinstance(value, str),
+    "boolean": lambda value: isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "null": lambda value: value is None,
+}
+
+
+class ValidationError(ValueError):
+    """记录未通过校验，reason 为可读的原因。"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def compile_schema(schema):
+    """
+    编译 schema，返回 check(value)：通过时返回 None，否则返回第一处错误的路径和描述，
+    例如 ".messages[2].role: 'system' not in ['user', 'assistant']"。
+    """
+    checks = []
+
+    type_names = schema.get("type")
+    if type_names is not None:
+        if isinstance(type_names, str):
+            type_names = [type_names]
+        type_checks = [_TYPE_CHECKS[name] for name in type_names]
+        expected = " or ".join(type_names)
+
+        def check_type(value):
+            for type_check in type_checks:
+                if type_check(value):
+                    return None
+            return f": expected {expected}, got {type(value).__name__}"
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value):
+            return None if value in allowed else f": {value!r} not in {allowed}"
+        checks.append(check_enum)
+
+    required = schema.get("required", [])
+    properties = {name: compile_schema(sub_schema) for name, sub_schema in schema.get("properties", {}).items()}
+    if required or properties:
+        def check_object(value):
+            if not isinstance(value, dict):
+                return None # 类型错误由 check_type 报告
+            for name in required:
+                if name not in value:
+                    return f": missing required property '{name}'"
+            for name, check in properties.items():
+                if name in value:
+                    error = check(value[name])
+                    if error is not None:
+                        return f".{name}{error}"
+            return None
+        checks.append(check_object)
+
+    if "items" in schema:
+        check_item = compile_schema(schema["items"])
+
+        def check_array(value):
+            if not isinstance(value, list):
+                return None
+            for i, item in enumerate(value):
+                error = check_item(item)
+                if error is not None:
+                    return f"[{i}]{error}"
+            return None
+        checks.append(check_array)
+
+    def check(value):
+        for single_check in checks:
+            error = single_check(value)
+            if error is not None:
+                return error
+        return None
+    return check
+
+
+def schema_validator(schema):
+    """编译 schema，返回 validate(value)：不通过时抛出 ValidationError。"""
+    check = compile_schema(schema)
+
+    def validate(value):
+        error = check(value)
+        if error is not None:
+            raise ValidationError(f"schema: ${error}")
+    return validate
+
+
+def parse_tagged_reply(text, require_perplexity=True):
+    """
+    单次顺序扫描解析 "<think>...</think> <perplexity>...</perplexity> final_answer: ..." 格式的回复。
+    final_answer 后的冒号（半角或全角）不计入内容。
+
+    Returns:
+        tuple: ((think, perplexity, final_answer), None)，或格式不符时 (None, 原因)。
+               不要求 perplexity 且回复中没有 perplexity 时，perplexity 为 None。
+    """
+    if not text:
+        return None, "empty response"
+
+    def section(tag, start):
+        open_tag, close_tag = f"<{tag}>", f"</{tag}>"
+        begin = text.find(open_tag, start)
+        if begin < 0:
+            return None, start
+        end = text.find(close_tag, begin + len(open_tag))
+        if end < 0:
+            return False, start
+        return text[begin + len(open_tag):end].strip(), end + len(close_tag)
+
+    think, position = section("think", 0)
+    if think is None:
+        return None, "missing <think>"
+    if think is False:
+        return None, "unterminated <think>"
+
+    perplexity, after_perplexity = section("perplexity", position)
+    if perplexity is False:
+        return None, "unterminated <perplexity>"
+    if perplexity is None and require_perplexity:
+        return None, "missing <perplexity>"
+    if perplexity is not None:
+        position = after_perplexity
+
+    marker = text.find("final_answer", position)
+    if marker < 0:
+        return None, "missing final_answer"
+    final_answer = text[marker + len("final_answer"):].lstrip()
+    if final_answer[:1] in (":", "："):
+        final_answer = final_answer[1:]
+    final_answer = final_answer.strip()
+    if not final_answer:
+        return None, "empty final_answer"
+    return (think, perplexity, final_answer), None
+
+
+class QuarantineWriter:
+    """
+    线程安全地把未通过校验的记录追加到 JSONL 隔离文件：
+    {"id", "stage", "reason", "response", "input"}，每条写入后立即 flush。
+    """
+
+    def __init__(self, path):
+        quarantine_dir = os.path.dirname(path)
+        if quarantine_dir:
+            os.makedirs(quarantine_dir, exist_ok=True)
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def add(self, record_id, stage, reason, response=None, input_data=None):
+        entry = {"id": record_id, "stage": stage, "reason": reason, "response": response, "input": input_data}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def quarantine_path_for(output_file):
+    return output_file + ".quarantine.jsonl"